@@ -48,9 +48,10 @@ variable "openai_api_key" {
 
 locals {
   apps = {
-    csv   = { app_file = "csv_dashboard", port = 8501, path = "/csv" }
-    md    = { app_file = "markdown_summarizer", port = 8502, path = "/md" }
-    shiny = { app_file = "shiny_demo", port = 8503, path = "/shiny" }
+    # workers : 開くポート数 (Shiny は 1 コンテナに複数プロセスを立て、port から連番で待ち受ける)
+    csv   = { app_file = "csv_dashboard", port = 8501, path = "/csv", workers = 1 }
+    md    = { app_file = "markdown_summarizer", port = 8502, path = "/md", workers = 1 }
+    shiny = { app_file = "shiny_demo_prod", port = 8503, path = "/shiny", workers = 4 }
   }
 
   public_app = "proxy" # 逆プロキシを公開
@@ -136,6 +137,12 @@ resource "aws_lightsail_container_service_deployment_version" "current" {
     container_name = "proxy"
     image          = "${aws_ecr_repository.proxy.repository_url}:${var.image_tag}"
     ports          = { "80" = "HTTP" }
+
+    # Shiny の upstream (shiny-upstream.sh) を Shiny コンテナと同じワーカー数・ポートから生成する
+    environment = {
+      SHINY_WORKERS = tostring(local.apps.shiny.workers)
+      SHINY_PORT    = tostring(local.apps.shiny.port)
+    }
   }
 
   # ---- 2. 各 Streamlit アプリ ---------------------------------
@@ -147,8 +154,11 @@ resource "aws_lightsail_container_service_deployment_version" "current" {
       container_name = container.key
       image          = "${aws_ecr_repository.app.repository_url}:${var.image_tag}"
 
-      # Lightsail では “このポートを開く” 宣言が必須
-      ports = { tostring(container.value.port) = "HTTP" } # 例: "8501" = "HTTP"
+      # Lightsail では “このポートを開く” 宣言が必須 (Shiny はワーカーごとに連番のポートを開く)
+      ports = {
+        for i in range(container.value.workers) :
+        tostring(container.value.port + i) => "HTTP"
+      } # 例: "8501" = "HTTP"
 
       # Streamlit 起動用の環境変数
       environment = {
@@ -156,6 +166,8 @@ resource "aws_lightsail_container_service_deployment_version" "current" {
         OPENAI_API_KEY                 = var.openai_api_key
         STREAMLIT_SERVER_PORT          = tostring(container.value.port)
         STREAMLIT_SERVER_BASE_URL_PATH = container.value.path
+        SHINY_WORKERS                  = tostring(container.value.workers)
+        SHINY_PORT                     = tostring(container.value.port)
       }
     }
   }
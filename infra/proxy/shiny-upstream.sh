@@ -0,0 +1,17 @@
+#!/bin/sh
+# nginx 公式イメージの起動時 (/docker-entrypoint.d) に、Shiny の upstream に並べるサーバーを生成する。
+# ワーカー数・先頭ポートは Shiny コンテナ (scripts/launch.sh shiny_demo_prod) と同じ SHINY_WORKERS / SHINY_PORT を
+# 受け取り (infra/main.tf の locals.apps.shiny から渡す)、ポートの一覧を二重に管理しない。
+set -eu
+
+workers="${SHINY_WORKERS:-4}"
+port="${SHINY_PORT:-8503}"
+out=/etc/nginx/shiny_upstream.conf
+
+: > "$out"
+i=0
+while [ "$i" -lt "$workers" ]; do
+  echo "server shiny:$((port + i));" >> "$out"
+  i=$((i + 1))
+done
+echo "$0: $workers Shiny workers from port $port"
@@ -6,9 +6,33 @@ APP="${1:-${APP:-}}"
 case "$APP" in
   shiny_demo|"")  exec python -m shiny run --host 0.0.0.0 --port 8503 \
                        src/shiny_demo/main.py ;;
+  shiny_demo_prod)
+                  # 本番起動 : ポート SHINY_PORT から SHINY_WORKERS 個の uvicorn を 1 プロセスずつ起動する。
+                  # Shiny のセッションはプロセス内に状態を持つため、1 つのポートを共有する --workers ではなく
+                  # ポートを分け、nginx (infra/proxy/nginx.conf) でクライアントごとに同じプロセスへ振り分ける。
+                  # nginx の upstream も同じ SHINY_WORKERS / SHINY_PORT から生成する (infra/proxy/shiny-upstream.sh)。
+                  workers="${SHINY_WORKERS:-4}"
+                  port="${SHINY_PORT:-8503}"
+                  # データセットはワーカーを起動する前に 1 度だけ書き出し、各ワーカーはメモリマップで共有する
+                  python -m src.shiny_demo.dataset
+                  pids=()
+                  for ((i = 0; i < workers; i++)); do
+                    python -m uvicorn src.shiny_demo.main:app --host 0.0.0.0 --port $((port + i)) \
+                      --proxy-headers --forwarded-allow-ips '*' &
+                    pids+=("$!")
+                  done
+                  trap 'kill "${pids[@]}" 2>/dev/null' TERM INT
+                  # どれか 1 つでも落ちたら残りも止め、コンテナごと再起動させる
+                  status=0
+                  wait -n || status=$?
+                  kill "${pids[@]}" 2>/dev/null || true
+                  exit "$status" ;;
   csv_dashboard)  exec python -m streamlit run src/csv_dashboard/main.py \
                        --server.port 8501 --server.address 0.0.0.0 ;;
   markdown_summarizer)
+                  # ポートを開く前に重いモジュールとトークナイザーを読み込んでおく (失敗しても起動は続ける)
+                  python -m src.markdown_summarizer.warmup \
+                    || echo "[WARN] markdown_summarizer のウォームアップに失敗しました" >&2
                   exec python -m streamlit run src/markdown_summarizer/main.py \
                        --server.port 8502 --server.address 0.0.0.0 ;;
   *)              exec "$@" ;;
@@ -0,0 +1,235 @@
+"""
+合成データ生成 : ベンチマーク用に、行数・列の型の構成・カテゴリ数を指定した CSV を決定的に作る
+
+サンプルデータ (csv_dashboard の create_sample_data) と同じく日付・カテゴリ・数値の列を基本に、
+1,000 行〜5,000 万行まで同じ手順で生成する。生成はチャンク単位で行うため、行数によらずメモリ使用量は
+1 チャンク分に収まる。
+
+実行例 : python -m src.benchmarks.datagen --rows 10000000 --categories 3 --cardinality 1000
+"""
+
+import argparse
+import shutil
+import tempfile
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+from src.csv_dashboard.ingest import SAMPLE_ROWS
+from src.libs.settings import settings
+
+# 1 チャンクあたりの行数
+CHUNK_ROWS = 1_000_000
+# 日付列の起点と範囲
+DATE_START = np.datetime64("2025-01-01T00:00:00", "s")
+DATE_SPAN_SECONDS = 365 * 24 * 60 * 60
+
+
+@dataclass(frozen=True, slots=True)
+class DatasetSpec:
+    """合成データの構成"""
+
+    rows: int
+    # 列の型ごとの列数
+    floats: int = 2
+    ints: int = 1
+    categories: int = 2
+    datetimes: int = 1
+    strings: int = 0
+    bools: int = 0
+    # カテゴリ列のユニーク数
+    cardinality: int = 20
+    # 数値・カテゴリ列の欠損率
+    null_rate: float = 0.0
+    # int 列の、型推定のサンプル (先頭 SAMPLE_ROWS 行) より後の 1 行に数値でない値を混ぜるか
+    dirty: bool = False
+    seed: int = 42
+
+    @property
+    def name(self) -> str:
+        """構成から決まる名前 (キャッシュのファイル名に使う)"""
+        return (
+            f"r{self.rows}-f{self.floats}-i{self.ints}-c{self.categories}x{self.cardinality}"
+            f"-d{self.datetimes}-s{self.strings}-b{self.bools}-n{self.null_rate:g}{'-dirty' if self.dirty else ''}"
+            f"-seed{self.seed}"
+        )
+
+    @property
+    def category_labels(self) -> list[str]:
+        """カテゴリ列の値の一覧"""
+        return [f"c{i:05d}" for i in range(self.cardinality)]
+
+
+def _with_nulls(values: np.ndarray, rng: np.random.Generator, null_rate: float) -> pa.Array:
+    """null_rate の割合で欠損を混ぜた Arrow 配列"""
+    mask = rng.random(len(values)) < null_rate if null_rate > 0 else None
+    return pa.array(values, mask=mask)
+
+
+def generate_chunk(spec: DatasetSpec, start: int, n_rows: int) -> pa.Table:
+    """start 行目から n_rows 行分のチャンクを作る
+
+    乱数はシードとチャンクの開始位置から決めるため、チャンクの分け方が同じなら何度作っても同じ値になる。
+
+    Args:
+        spec: データの構成
+        start: チャンクの開始行
+        n_rows: チャンクの行数
+
+    Returns:
+        チャンクのテーブル
+    """
+    rng = np.random.default_rng([spec.seed, start])
+    columns: dict[str, pa.Array] = {}
+    for i in range(spec.datetimes):
+        seconds = rng.integers(0, DATE_SPAN_SECONDS, n_rows)
+        columns[f"date_{i}"] = pa.array(DATE_START + seconds.astype("timedelta64[s]"))
+    labels = pa.array(spec.category_labels)
+    for i in range(spec.categories):
+        # 出現頻度に偏りを持たせる (先頭のカテゴリほど多い)
+        codes = ((rng.zipf(1.3, n_rows) - 1) % spec.cardinality).astype(np.int32)
+        columns[f"category_{i}"] = pc.take(labels, _with_nulls(codes, rng, spec.null_rate))
+    for i in range(spec.floats):
+        columns[f"value_{i}"] = _with_nulls(rng.lognormal(3, 1, n_rows).round(2), rng, spec.null_rate)
+    for i in range(spec.ints):
+        counts = _with_nulls(rng.integers(0, 1_000_000, n_rows), rng, spec.null_rate)
+        dirty_row = SAMPLE_ROWS * 2 - start
+        if spec.dirty and 0 <= dirty_row < n_rows:
+            # サンプルでは int と推定される列が、後半で矛盾する (取り込みのフォールバック経路を通す)
+            values = counts.cast(pa.string()).to_pylist()
+            values[dirty_row] = "abc"
+            counts = pa.array(values, type=pa.string())
+        columns[f"count_{i}"] = counts
+    for i in range(spec.bools):
+        columns[f"flag_{i}"] = pa.array(rng.random(n_rows) < 0.5)
+    for i in range(spec.strings):
+        # 行ごとにほぼ一意な ID (category にならない高カーディナリティの文字列)
+        ids = pa.array(rng.integers(0, max(spec.rows, 1) * 10, n_rows)).cast(pa.string())
+        columns[f"id_{i}"] = pc.binary_join_element_wise("id-", ids, "")
+    return pa.table(columns)
+
+
+def iter_chunks(spec: DatasetSpec, chunk_rows: int = CHUNK_ROWS) -> Iterator[pa.Table]:
+    """spec.rows 行分のチャンクを順に作る
+
+    Args:
+        spec: データの構成
+        chunk_rows: 1 チャンクあたりの行数
+
+    Yields:
+        チャンクのテーブル
+    """
+    for start in range(0, spec.rows, chunk_rows):
+        yield generate_chunk(spec, start, min(chunk_rows, spec.rows - start))
+
+
+def generate_frame(spec: DatasetSpec) -> pd.DataFrame:
+    """合成データを DataFrame として作る (カテゴリ列は category 型)
+
+    Args:
+        spec: データの構成
+
+    Returns:
+        合成データのDataFrame
+    """
+    chunks = list(iter_chunks(spec))
+    if not chunks:
+        return pd.DataFrame()
+    df: pd.DataFrame = pa.concat_tables(chunks).to_pandas()
+    for i in range(spec.categories):
+        df[f"category_{i}"] = pd.Categorical(df[f"category_{i}"], categories=spec.category_labels)
+    return df
+
+
+def write_csv(spec: DatasetSpec, root: Path) -> Path:
+    """合成データを CSV に書き出す。同じ構成のファイルが既にあればそれを返す
+
+    一時ファイルに書いてから rename するため、中断しても書きかけのファイルは残らない。
+
+    Args:
+        spec: データの構成
+        root: 保存先のディレクトリ
+
+    Returns:
+        CSV ファイルのパス
+    """
+    target = root / f"{spec.name}.csv"
+    if target.exists():
+        return target
+    root.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=root, prefix=".tmp-", suffix=".csv", delete=False) as tmp:
+        tmp_path = Path(tmp.name)
+    try:
+        writer: pa_csv.CSVWriter | None = None
+        for chunk in iter_chunks(spec):
+            if writer is None:
+                writer = pa_csv.CSVWriter(str(tmp_path), chunk.schema)
+            writer.write_table(chunk)
+        if writer is not None:
+            writer.close()
+        tmp_path.rename(target)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return target
+
+
+def data_root() -> Path:
+    """合成データの保存先 (CACHE_DIR 配下)"""
+    return settings.cache_dir / "benchmarks"
+
+
+def add_spec_arguments(parser: argparse.ArgumentParser) -> None:
+    """DatasetSpec の各項目をコマンドライン引数として追加する"""
+    defaults = DatasetSpec(rows=0)
+    parser.add_argument("--floats", type=int, default=defaults.floats, help="float 列の数")
+    parser.add_argument("--ints", type=int, default=defaults.ints, help="int 列の数")
+    parser.add_argument("--categories", type=int, default=defaults.categories, help="カテゴリ列の数")
+    parser.add_argument("--datetimes", type=int, default=defaults.datetimes, help="日付列の数")
+    parser.add_argument("--strings", type=int, default=defaults.strings, help="高カーディナリティの文字列列の数")
+    parser.add_argument("--bools", type=int, default=defaults.bools, help="真偽値列の数")
+    parser.add_argument("--cardinality", type=int, default=defaults.cardinality, help="カテゴリ列のユニーク数")
+    parser.add_argument("--null-rate", type=float, default=defaults.null_rate, help="数値・カテゴリ列の欠損率")
+    parser.add_argument("--dirty", action="store_true", help="int 列の型推定のサンプルより後の行に数値でない値を混ぜる")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="乱数シード")
+
+
+def spec_from_args(args: argparse.Namespace, rows: int) -> DatasetSpec:
+    """add_spec_arguments で追加した引数から DatasetSpec を作る"""
+    return DatasetSpec(
+        rows=rows,
+        floats=args.floats,
+        ints=args.ints,
+        categories=args.categories,
+        datetimes=args.datetimes,
+        strings=args.strings,
+        bools=args.bools,
+        cardinality=args.cardinality,
+        null_rate=args.null_rate,
+        dirty=args.dirty,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    """合成データの CSV を書き出し、保存先を表示する"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="行数")
+    parser.add_argument("--out", type=Path, help="保存先のパス (省略時は CACHE_DIR/benchmarks 配下)")
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+
+    path = write_csv(spec_from_args(args, args.rows), data_root())
+    if args.out:
+        shutil.copyfile(path, args.out)
+        path = args.out
+    print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,555 @@
+"""
+ベンチマーク : 3 つのアプリのデータ処理を合成データでヘッドレスに実行し、スループット・レイテンシ・最大 RSS を計測する
+
+計測ケースごとにまっさらなプロセスを起動し、準備 (読み込み・インデックス構築など) の後に同じ処理を
+繰り返して所要時間の分位点を取る。--save で結果を JSON のベースラインとして保存し、以降の実行で
+--compare を指定するとベースラインからの退行を検出する (退行があれば終了コード 1)。
+
+実行例 : python -m src.benchmarks.run --rows 100000 1000000 --save .cache/benchmarks/baseline.json
+"""
+
+import argparse
+import datetime
+import fnmatch
+import json
+import platform
+import sys
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from multiprocessing import get_context
+from pathlib import Path
+from typing import cast
+
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+from src.benchmarks.datagen import DatasetSpec, add_spec_arguments, data_root, spec_from_args, write_csv
+from src.csv_dashboard.charts import column_sum, downsample, histogram, time_order
+from src.csv_dashboard.cube import RollupCube
+from src.csv_dashboard.filter_index import (
+    CategoryColumn,
+    FilterIndex,
+    FilterValue,
+    IncrementalFilter,
+    RangeColumn,
+    SearchColumn,
+)
+from src.csv_dashboard.ingest import read_csv_compact
+from src.csv_dashboard.pager import PAGE_SIZES, page_frame, sorted_positions
+from src.csv_dashboard.profile import profile_frame
+from src.csv_dashboard.query import ParquetCache, SqlFilterValue, duckdb_available
+from src.libs.metrics import peak_rss_bytes, rss_bytes
+from src.markdown_summarizer.bench import synthetic_docs
+from src.markdown_summarizer.compress import compress_markdown
+from src.shiny_demo import dataset as shiny_dataset
+from src.shiny_demo.groups import GroupIndex
+from src.shiny_demo.histogram import SortedColumn, histogram_figure
+
+# 1 回分の処理。処理した件数を返す
+type Step = Callable[[], int]
+# 合成データの構成と CSV のパスから、計測する 1 回分の処理を準備する
+type Setup = Callable[[DatasetSpec, Path], Step]
+
+# Shiny の表に送る行数の上限 (src.shiny_demo.main と同じ)
+SHINY_TABLE_MAX_ROWS = 10_000
+# AppTest で画面全体を実行する行数の上限 (これより大きいデータでは実行しない)
+APPTEST_MAX_ROWS = 1_000_000
+# AppTest の 1 回の実行のタイムアウト (秒)
+APPTEST_TIMEOUT = 600.0
+# Markdown の圧縮に使う文書数
+MARKDOWN_DOCS = 200
+# これより小さい p50 の悪化はタイマーの揺らぎとみなして退行にしない (秒)
+NOISE_FLOOR_SECONDS = 0.001
+MIB = 1024 * 1024
+
+
+@dataclass(frozen=True, slots=True)
+class CaseResult:
+    """1 ケース・1 データサイズの計測結果"""
+
+    case: str
+    rows: int
+    # 1 回あたりに処理した件数 (行数・文書数) と、その単位
+    items: int
+    unit: str
+    repeats: int
+    p50_s: float
+    p95_s: float
+    p99_s: float
+    mean_s: float
+    # 1 秒あたりの処理件数 (中央値から計算)
+    items_per_s: float
+    # 準備が終わった時点の RSS と、計測を終えた時点のプロセスの最大 RSS
+    setup_rss_bytes: int
+    peak_rss_bytes: int
+
+    @property
+    def key(self) -> str:
+        """ベースラインとの照合に使うキー"""
+        return f"{self.case}@{self.rows}"
+
+
+# ────────────────────────────────
+#   計測ケース
+# ────────────────────────────────
+class SkipCase(Exception):  # noqa: N818 (エラーではなく計測対象外の通知)
+    """このデータサイズでは計測しないケース"""
+
+
+def csv_read(spec: DatasetSpec, path: Path) -> Step:
+    """CSV の省メモリ取り込み (load_data のキャッシュミス時の処理。--dirty ではフォールバック経路)"""
+
+    def step() -> int:
+        with path.open("rb") as f:
+            _, report = read_csv_compact(f)
+        # サンプルより後に矛盾する値があれば、落ちずに pd.read_csv の経路で読み込めていること
+        if spec.dirty and report.engine != "pandas":
+            msg = "rows contradicting the sample did not take the fallback path"
+            raise RuntimeError(msg)
+        return report.rows
+
+    return step
+
+
+def csv_filter_index(_spec: DatasetSpec, path: Path) -> Step:
+    """フィルター用インデックスの構築 (データセットごとに 1 度)"""
+    with path.open("rb") as f:
+        df, _ = read_csv_compact(f)
+
+    profiles = profile_frame(df)
+
+    def step() -> int:
+        return FilterIndex.build(df, profiles).n_rows
+
+    return step
+
+
+def csv_profile(_spec: DatasetSpec, path: Path) -> Step:
+    """読み込み時の列プロファイル (ユニーク数・分位点・頻出値のスケッチ)"""
+    with path.open("rb") as f:
+        df, _ = read_csv_compact(f)
+
+    def step() -> int:
+        profile_frame(df)
+        return len(df)
+
+    return step
+
+
+def csv_apply_filters(_spec: DatasetSpec, path: Path) -> Step:
+    """サイドバーのフィルター操作 1 回分 (ウィジェットを 1 つ動かして再実行したときの差分適用)"""
+    with path.open("rb") as f:
+        df, _ = read_csv_compact(f)
+    index = FilterIndex.build(df)
+    state = IncrementalFilter(index)
+    columns = list(index.columns.items())
+    counter = iter(range(sys.maxsize))
+
+    def step() -> int:
+        n = next(counter)
+        col, col_index = columns[n % len(columns)]
+        state.begin()
+        if isinstance(col_index, CategoryColumn):
+            state.update(col, tuple(col_index.options[: n % 3 + 1]))
+        elif isinstance(col_index, SearchColumn):
+            # 検索語を 1 文字ずつ打ち込む
+            state.update(col, "id-123456"[: n % 9 + 1])
+        else:
+            # 範囲の下限を少しずつ動かす
+            fraction = (n % 10 + 1) / 20
+            state.update(col, (col_index.min + (col_index.max - col_index.min) * fraction, col_index.max))
+        state.select(df)
+        return index.n_rows
+
+    return step
+
+
+def csv_chart_prep(_spec: DatasetSpec, path: Path) -> Step:
+    """KPI とサーバー側ヒストグラムの集計"""
+    with path.open("rb") as f:
+        df, _ = read_csv_compact(f)
+    numeric_cols = df.select_dtypes("number").columns.tolist()
+
+    def step() -> int:
+        for col in numeric_cols:
+            column_sum(df[col])
+            histogram(df[col])
+        return len(df)
+
+    return step
+
+
+def csv_timeseries(_spec: DatasetSpec, path: Path) -> Step:
+    """時系列チャート 1 回分 (表示期間を狭めながら、間引き方式を交互に変えて 2,000 点に間引く)"""
+    with path.open("rb") as f:
+        df, _ = read_csv_compact(f)
+    index = FilterIndex.build(df)
+    time_cols = [c for c, i in index.columns.items() if isinstance(i, RangeColumn) and i.kind == "datetime"]
+    value_cols = df.select_dtypes("number").columns.tolist()
+    if not time_cols or not value_cols:
+        msg = "no datetime or numeric columns"
+        raise SkipCase(msg)
+    x, positions = time_order(cast("RangeColumn", index.columns[time_cols[0]]), None)
+    y = df[value_cols[0]].to_numpy(dtype=np.float64, na_value=np.nan)[positions]
+    counter = iter(range(sys.maxsize))
+
+    def step() -> int:
+        n = next(counter)
+        # 全期間・前半・前 1/4 … と表示期間を狭める
+        stop = max(len(x) >> (n % 4), 1)
+        downsample(x[:stop], y[:stop], 2_000, "lttb" if n % 2 == 0 else "minmax")
+        return stop
+
+    return step
+
+
+def csv_cube_build(_spec: DatasetSpec, path: Path) -> Step:
+    """集計キューブの構築 (データセットごとに 1 度)"""
+    with path.open("rb") as f:
+        df, _ = read_csv_compact(f)
+    index = FilterIndex.build(df)
+
+    def step() -> int:
+        RollupCube.build(df, index)
+        return len(df)
+
+    return step
+
+
+def csv_cube_query(_spec: DatasetSpec, path: Path) -> Step:
+    """ピボット集計 1 回分 (値選択列のフィルターをキューブに適用し、次元の組み合わせを変えて集計する)"""
+    with path.open("rb") as f:
+        df, _ = read_csv_compact(f)
+    index = FilterIndex.build(df)
+    cube = RollupCube.build(df, index)
+    if cube is None:
+        msg = "no cube dimensions"
+        raise SkipCase(msg)
+    dims = [d.name for d in cube.dimensions]
+    measure = cube.measures[0] if cube.measures else None
+    counter = iter(range(sys.maxsize))
+
+    def step() -> int:
+        n = next(counter)
+        group_by = [dims[n % len(dims)], dims[(n + 1) % len(dims)]] if len(dims) > 1 else dims
+        first = cube.dimensions[-1]
+        filters: dict[str, FilterValue] = {first.name: first.options[: n % 3 + 1]} if first.kind == "category" else {}
+        cube.query(group_by, grain="month", measure=measure, agg="mean", filters=filters)
+        return len(df)
+
+    return step
+
+
+def csv_sort_page(_spec: DatasetSpec, path: Path) -> Step:
+    """表の並べ替えとページの切り出し"""
+    with path.open("rb") as f:
+        df, _ = read_csv_compact(f)
+    index = FilterIndex.build(df)
+    columns = list(index.columns)
+    counter = iter(range(sys.maxsize))
+
+    def step() -> int:
+        n = next(counter)
+        positions = sorted_positions(index, None, columns[n % len(columns)], ascending=n % 2 == 0)
+        page_frame(df, positions, 1, PAGE_SIZES[-1])
+        return len(positions)
+
+    return step
+
+
+def csv_duckdb_query(_spec: DatasetSpec, path: Path) -> Step:
+    """DuckDB エンジンでのフィルター操作 1 回分 (件数・合計・ヒストグラム・先頭ページの問い合わせ)"""
+    if not duckdb_available():
+        msg = "duckdb is not installed"
+        raise SkipCase(msg)
+    cache = ParquetCache(data_root() / "parquet", max_bytes=sys.maxsize)
+    with path.open("rb") as f:
+        table = cache.open(path.stem, f)
+    ranges = []
+    for col in table.numeric_columns:
+        info = table.columns[col]
+        if isinstance(info.min, float) and isinstance(info.max, float):
+            ranges.append((col, info.min, info.max))
+    counter = iter(range(sys.maxsize))
+
+    def step() -> int:
+        n = next(counter)
+        col, lo, hi = ranges[n % len(ranges)]
+        # 範囲の下限を少しずつ動かす
+        filters: dict[str, SqlFilterValue] = {col: (lo + (hi - lo) * (n % 10 + 1) / 20, hi)}
+        table.summary(filters, ranges[0][0])
+        table.histogram(col, filters)
+        table.page(filters, col, ascending=n % 2 == 0, page=1, page_size=PAGE_SIZES[-1])
+        return table.n_rows
+
+    return step
+
+
+def _dashboard_script(path: str) -> None:
+    """アップロードの代わりに path の CSV を渡して CSV ダッシュボードを実行する (AppTest 用)"""
+    # AppTest はこの関数の本体だけをスクリプトとして実行するため、import も関数内に書く
+    import io
+    from pathlib import Path
+
+    from src.csv_dashboard import main as app
+
+    data = Path(path).read_bytes()
+    app.upload_csv = lambda: io.BytesIO(data)
+    app.main()
+
+
+def csv_app(spec: DatasetSpec, path: Path) -> Step:
+    """CSV ダッシュボードの画面全体の再実行 (取り込み・インデックスはキャッシュ済み)"""
+    if spec.rows > APPTEST_MAX_ROWS:
+        msg = f"rows > {APPTEST_MAX_ROWS:,}"
+        raise SkipCase(msg)
+
+    def step() -> int:
+        at = AppTest.from_function(_dashboard_script, args=(str(path),), default_timeout=APPTEST_TIMEOUT).run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        return spec.rows
+
+    return step
+
+
+def shiny_index_build(spec: DatasetSpec, _path: Path) -> Step:
+    """大陸ごとの行位置とヒストグラム用のソート済み列の構築 (共有データセットの書き出し時の処理)"""
+    df = shiny_dataset.generate_frame(spec.rows, seed=spec.seed)
+
+    def step() -> int:
+        GroupIndex.from_categorical(df["continent"])
+        for col in shiny_dataset.HIST_COLUMNS:
+            SortedColumn.from_values(df[col].to_numpy())
+        return len(df)
+
+    return step
+
+
+def shiny_dataset_load(spec: DatasetSpec, _path: Path) -> Step:
+    """ワーカー起動時の共有データセットのメモリマップ"""
+    root = data_root() / "shiny_demo"
+    shiny_dataset.write_dataset(root, spec.rows)
+
+    def step() -> int:
+        return len(shiny_dataset.load_dataset(root, spec.rows).frame)
+
+    return step
+
+
+def shiny_filtered(spec: DatasetSpec, _path: Path) -> Step:
+    """大陸の絞り込みと表に送る行の取り出し (filtered と tbl の reactive 計算)"""
+    df = shiny_dataset.generate_frame(spec.rows, seed=spec.seed)
+    index = GroupIndex.from_categorical(df["continent"])
+    counter = iter(range(sys.maxsize))
+
+    def step() -> int:
+        positions = index.positions(index.labels[next(counter) % len(index.labels)])
+        df.take(positions[:SHINY_TABLE_MAX_ROWS])
+        return len(positions)
+
+    return step
+
+
+def shiny_hist(spec: DatasetSpec, _path: Path) -> Step:
+    """ビン数・列を変えたときのヒストグラムの集計と Figure の作成 (hist の reactive 計算)"""
+    df = shiny_dataset.generate_frame(spec.rows, seed=spec.seed)
+    columns = {col: SortedColumn.from_values(df[col].to_numpy()) for col in shiny_dataset.HIST_COLUMNS}
+    names = list(columns)
+    counter = iter(range(sys.maxsize))
+
+    def step() -> int:
+        n = next(counter)
+        col = names[n % len(names)]
+        counts, edges = columns[col].histogram(5 + n % 46)
+        histogram_figure(counts, edges, f"Histogram of {col}")
+        return len(columns[col].values)
+
+    return step
+
+
+def markdown_compress(_spec: DatasetSpec, _path: Path) -> Step:
+    """要約前の入力圧縮 (データサイズによらず MARKDOWN_DOCS 件の文書)"""
+    docs = [text for _, text in synthetic_docs(MARKDOWN_DOCS)]
+
+    def step() -> int:
+        for text in docs:
+            compress_markdown(text)
+        return len(docs)
+
+    return step
+
+
+# ケース名 → (準備, 処理件数の単位)
+CASES: dict[str, tuple[Setup, str]] = {
+    "csv_dashboard.read_csv": (csv_read, "rows"),
+    "csv_dashboard.profile": (csv_profile, "rows"),
+    "csv_dashboard.filter_index": (csv_filter_index, "rows"),
+    "csv_dashboard.apply_filters": (csv_apply_filters, "rows"),
+    "csv_dashboard.chart_prep": (csv_chart_prep, "rows"),
+    "csv_dashboard.timeseries": (csv_timeseries, "rows"),
+    "csv_dashboard.cube_build": (csv_cube_build, "rows"),
+    "csv_dashboard.cube_query": (csv_cube_query, "rows"),
+    "csv_dashboard.sort_page": (csv_sort_page, "rows"),
+    "csv_dashboard.duckdb_query": (csv_duckdb_query, "rows"),
+    "csv_dashboard.app": (csv_app, "rows"),
+    "shiny_demo.index_build": (shiny_index_build, "rows"),
+    "shiny_demo.dataset_load": (shiny_dataset_load, "rows"),
+    "shiny_demo.filtered": (shiny_filtered, "rows"),
+    "shiny_demo.hist": (shiny_hist, "rows"),
+    "markdown_summarizer.compress": (markdown_compress, "docs"),
+}
+
+
+# ────────────────────────────────
+#   実行・集計
+# ────────────────────────────────
+def run_case(case: str, spec: DatasetSpec, path: Path, *, repeats: int, warmup: int) -> CaseResult | None:
+    """ケースを準備し、warmup 回の空回しの後に repeats 回計測する (新しいプロセス内で呼ぶ)
+
+    Args:
+        case: ケース名
+        spec: 合成データの構成
+        path: 合成データの CSV
+        repeats: 計測する回数
+        warmup: 計測前に空回しする回数
+
+    Returns:
+        計測結果 (このデータサイズでは計測しないケースならNone)
+    """
+    setup, unit = CASES[case]
+    try:
+        step = setup(spec, path)
+    except SkipCase:
+        return None
+    setup_rss = rss_bytes()
+    for _ in range(warmup):
+        step()
+    latencies = []
+    items = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        items = step()
+        latencies.append(time.perf_counter() - start)
+    p50, p95, p99 = (float(v) for v in np.percentile(latencies, [50, 95, 99]))
+    return CaseResult(
+        case=case,
+        rows=spec.rows,
+        items=items,
+        unit=unit,
+        repeats=repeats,
+        p50_s=p50,
+        p95_s=p95,
+        p99_s=p99,
+        mean_s=float(np.mean(latencies)),
+        items_per_s=items / p50 if p50 > 0 else 0.0,
+        setup_rss_bytes=setup_rss,
+        peak_rss_bytes=peak_rss_bytes(),
+    )
+
+
+def compare(results: list[CaseResult], baseline: dict[str, dict[str, float]], tolerance: float) -> list[str]:
+    """ベースラインと比べて、p50 または最大 RSS が (1 + tolerance) 倍を超えたケースを返す
+
+    p50 の差が NOISE_FLOOR_SECONDS 未満のケースは、倍率が大きくても退行とみなさない。
+
+    Args:
+        results: 今回の計測結果
+        baseline: キー → ベースラインの計測結果
+        tolerance: 許容する悪化の割合 (0.2 なら 20%)
+
+    Returns:
+        退行したケースの説明
+    """
+    regressions = []
+    for r in results:
+        base = baseline.get(r.key)
+        if base is None:
+            continue
+        for metric, value in (("p50_s", r.p50_s), ("peak_rss_bytes", r.peak_rss_bytes)):
+            ratio = value / base[metric] if base[metric] else 1.0
+            if metric == "p50_s" and value - base[metric] < NOISE_FLOOR_SECONDS:
+                continue
+            if ratio > 1 + tolerance:
+                regressions.append(f"{r.key} {metric}: {base[metric]:.4g} → {value:.4g} (x{ratio:.2f})")
+    return regressions
+
+
+def print_table(results: list[CaseResult], baseline: dict[str, dict[str, float]]) -> None:
+    """計測結果を表形式で表示する (ベースラインがあれば p50 の比も表示する)"""
+    header = f"{'case':<32} {'rows':>12} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'items/s':>14} {'peak MiB':>10}"
+    print(header + ("  vs base" if baseline else ""))
+    for r in results:
+        line = (
+            f"{r.case:<32} {r.rows:>12,} {r.p50_s * 1e3:>10.2f} {r.p95_s * 1e3:>10.2f} {r.p99_s * 1e3:>10.2f}"
+            f" {r.items_per_s:>14,.0f} {r.peak_rss_bytes / MIB:>10,.1f}"
+        )
+        base = baseline.get(r.key)
+        if base and base["p50_s"]:
+            line += f"  x{r.p50_s / base['p50_s']:.2f}"
+        print(line)
+
+
+def load_baseline(path: Path) -> dict[str, dict[str, float]]:
+    """--save で保存した JSON から、キー → 計測結果の辞書を作る"""
+    data = json.loads(path.read_text(encoding="utf-8"))
+    return {f"{r['case']}@{r['rows']}": r for r in data["results"]}
+
+
+def main() -> None:
+    """アプリのデータ処理を合成データで計測し、ベースラインの保存・比較を行う"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000], help="行数 (複数指定可)")
+    parser.add_argument("--cases", nargs="+", default=["*"], help="計測するケース名 (glob 可)")
+    parser.add_argument("--repeats", type=int, default=10, help="計測する回数")
+    parser.add_argument("--warmup", type=int, default=1, help="計測前に空回しする回数")
+    parser.add_argument("--save", type=Path, help="結果をベースラインとして保存するパス")
+    parser.add_argument("--compare", type=Path, help="比較するベースラインのパス")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="退行とみなす悪化の割合")
+    parser.add_argument("--list", action="store_true", help="ケース名の一覧を表示して終了")
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (setup, _) in CASES.items():
+            print(f"{name:<32} {setup.__doc__}")
+        return
+    cases = [name for name in CASES if any(fnmatch.fnmatch(name, pattern) for pattern in args.cases)]
+    baseline = load_baseline(args.compare) if args.compare else {}
+
+    results: list[CaseResult] = []
+    for rows in args.rows:
+        spec = spec_from_args(args, rows)
+        # 合成データの生成は計測に含めない (同じ構成なら前回のファイルを使う)
+        path = write_csv(spec, data_root())
+        for case in cases:
+            # 最大 RSS はプロセス単位の値なので、ケースごとにまっさらなプロセスで計測する
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(run_case, case, spec, path, repeats=args.repeats, warmup=args.warmup).result()
+            if result is not None:
+                results.append(result)
+
+    print_table(results, baseline)
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        spec_fields = asdict(spec_from_args(args, 0))
+        spec_fields.pop("rows")
+        report = {
+            "created_at": datetime.datetime.now(datetime.UTC).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "spec": spec_fields,
+            "results": [asdict(r) for r in results],
+        }
+        args.save.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\n".join(["regressions:", *regressions]), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
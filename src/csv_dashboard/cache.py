@@ -0,0 +1,118 @@
+"""
+列指向キャッシュ : 解析済みの CSV を Arrow IPC で保存し、次回以降はメモリマップでゼロコピー読込する
+"""
+
+import dataclasses
+import hashlib
+import json
+from functools import partial
+from pathlib import Path
+from typing import IO
+
+import pyarrow as pa
+from pandas import DataFrame
+
+from src.csv_dashboard.ingest import IngestReport
+from src.libs.disk_cache import CacheStats, DiskCache
+
+# コンテンツハッシュ計算時に一度に読むバイト数
+HASH_BLOCK_BYTES = 8 * 1024 * 1024
+# 取り込み統計を保存するスキーマメタデータのキー
+_REPORT_KEY = b"ingest_report"
+
+
+def content_key(file: IO[bytes]) -> str:
+    """ファイル内容をブロック単位で読みながらハッシュし、キャッシュキーを返す
+
+    Args:
+        file: ハッシュ対象のバイトストリーム (読み終えたら先頭に戻す)
+
+    Returns:
+        内容から決まる 32 桁の 16 進文字列
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    file.seek(0)
+    for block in iter(partial(file.read, HASH_BLOCK_BYTES), b""):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+class ColumnarCache:
+    """解析済み DataFrame を Arrow IPC ファイルとして保持するキャッシュ
+
+    圧縮しない IPC ファイルをメモリマップで開くため、数値列はページキャッシュ上の
+    バッファをそのまま参照し (ゼロコピー)、再起動後や別レプリカからも再解析なしで読み込める。
+    """
+
+    def __init__(self, root: Path, *, max_bytes: int) -> None:
+        self._store = DiskCache(root, suffix=".arrow", max_bytes=max_bytes)
+
+    def load(self, key: str) -> tuple[DataFrame, IngestReport] | None:
+        """キャッシュ済みのデータを読み込む
+
+        Args:
+            key: content_key で求めたキー
+
+        Returns:
+            DataFrameと取り込み時の統計、なければNone
+        """
+        path = self._store.get(key)
+        if path is None:
+            return None
+        try:
+            return self._open(path)
+        except (pa.ArrowInvalid, OSError):
+            # 書き込み途中で落ちた等の壊れたファイルは捨てて再解析させる
+            self._store.discard(key)
+            return None
+
+    def store(self, key: str, df: DataFrame, report: IngestReport) -> tuple[DataFrame, IngestReport]:
+        """DataFrame を Arrow IPC ファイルとして保存し、メモリマップで開き直したものを返す
+
+        解析直後のヒープ上のコピーの代わりに返り値を使えば、以降はページキャッシュ側を参照できる。
+
+        Args:
+            key: content_key で求めたキー
+            df: 保存するDataFrame
+            report: 取り込み時の統計 (スキーマメタデータとして一緒に保存する)
+
+        Returns:
+            メモリマップで開き直したDataFrameと取り込み統計
+        """
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = {**(table.schema.metadata or {}), _REPORT_KEY: json.dumps(dataclasses.asdict(report))}
+        table = table.replace_schema_metadata(metadata)
+
+        def write(path: Path) -> None:
+            with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+        path = self._store.put(key, write)
+        try:
+            return self._open(path)
+        except FileNotFoundError:
+            # 容量上限より大きく、書いた直後に追い出された場合はヒープ上のものを使う
+            return df, report
+
+    def spill(self, key: str, df: DataFrame, report: IngestReport) -> None:
+        """メモリから追い出す DataFrame を、まだ保存されていなければ保存する (容量上限で消されていた場合など)
+
+        Args:
+            key: content_key で求めたキー
+            df: 保存するDataFrame
+            report: 取り込み時の統計
+        """
+        if not self._store.path_for(key).exists():
+            self.store(key, df, report)
+
+    @staticmethod
+    def _open(path: Path) -> tuple[DataFrame, IngestReport]:
+        """IPC ファイルをメモリマップで開いて DataFrame に変換する"""
+        table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+        report = IngestReport(**json.loads(table.schema.metadata[_REPORT_KEY]))
+        return table.to_pandas(split_blocks=True), report
+
+    def stats(self) -> CacheStats:
+        """ヒット・ミス回数と使用容量を返す"""
+        return self._store.stats()
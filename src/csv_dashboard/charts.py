@@ -0,0 +1,226 @@
+"""
+チャート用の集計 : ブラウザ (Vega-Lite) に生データを送らず、サーバー側で NumPy によりビン分割・集計・間引きする
+"""
+
+import math
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from src.csv_dashboard.filter_index import RangeColumn
+
+type DownsampleMethod = Literal["lttb", "minmax"]
+
+# この行数以下なら生データを Vega-Lite に渡す (Altair の既定 max_rows と同じ)
+RAW_CHART_MAX_ROWS = 5_000
+# ヒストグラムの最大ビン数
+HIST_MAX_BINS = 30
+# 時系列チャートの間引き方式
+DOWNSAMPLE_METHODS: dict[DownsampleMethod, str] = {
+    "lttb": "LTTB (形状を保つ)",
+    "minmax": "区間ごとの最小・最大 (外れ値を残す)",
+}
+# 時系列チャートで指定できる点数の範囲
+TIMESERIES_MIN_POINTS = 100
+TIMESERIES_MAX_POINTS = 20_000
+
+
+def nice_bin_edges(lo: float, hi: float, maxbins: int = HIST_MAX_BINS) -> np.ndarray:
+    """Vega-Lite の bin と同じ規則で「きりの良い」ビン境界を求める
+
+    ステップ幅は 1・2・5 × 10^k から maxbins を超えない最小のものを選ぶ。
+
+    Args:
+        lo: データの最小値
+        hi: データの最大値
+        maxbins: 最大ビン数
+
+    Returns:
+        昇順のビン境界 (ビン数 + 1 個)
+    """
+    span = hi - lo
+    if span <= 0:
+        return np.array([lo, lo + 1.0])
+    level = math.ceil(math.log10(maxbins))
+    step = 10.0 ** (round(math.log10(span)) - level)
+    while math.ceil(span / step) > maxbins:
+        step *= 10
+    for div in (5, 2):
+        if span / (step / div) <= maxbins:
+            step /= div
+            break
+    start = math.floor(lo / step) * step
+    stop = math.ceil(hi / step) * step
+    n_bins = max(round((stop - start) / step), 1)
+    return start + step * np.arange(n_bins + 1)
+
+
+def histogram(s: Series, maxbins: int = HIST_MAX_BINS) -> DataFrame:
+    """数値列のヒストグラムを集計する
+
+    Args:
+        s: 集計対象の数値列
+        maxbins: 最大ビン数
+
+    Returns:
+        bin_start / bin_end / count 列を持つビンごとの集計結果
+    """
+    values = s.to_numpy(dtype=np.float64, na_value=np.nan)
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return pd.DataFrame({"bin_start": [], "bin_end": [], "count": []})
+    edges = nice_bin_edges(float(values.min()), float(values.max()), maxbins)
+    counts, _ = np.histogram(values, bins=edges)
+    return pd.DataFrame({"bin_start": edges[:-1], "bin_end": edges[1:], "count": counts})
+
+
+def column_sum(s: Series) -> int | float:
+    """数値列の合計。float32 列でも精度が落ちないよう 64bit で累積する
+
+    Args:
+        s: 集計対象の数値列
+
+    Returns:
+        欠損を除いた合計
+    """
+    if pd.api.types.is_integer_dtype(s) or pd.api.types.is_bool_dtype(s):
+        return int(np.sum(s.to_numpy(dtype=np.int64, na_value=0), dtype=np.int64))
+    return float(np.nansum(s.to_numpy(dtype=np.float64, na_value=np.nan)))
+
+
+def _segment_argext(values: np.ndarray, starts: np.ndarray, *, largest: bool) -> np.ndarray:
+    """連続した区間 (starts[i] から次の区間の開始まで) ごとに、最大 (最小) 値の最初の位置を返す"""
+    extremes = (np.maximum if largest else np.minimum).reduceat(values, starts)
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(values))))
+    hits = np.flatnonzero(values == extremes[segment])
+    # hits は区間の順に並んでいるので、区間が変わる位置が各区間の最初の該当位置
+    positions: np.ndarray = hits[np.flatnonzero(np.diff(segment[hits], prepend=-1))]
+    return positions
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets で n_out 点を選ぶ
+
+    先頭・末尾の点を残し、残りを等件数の n_out - 2 個のバケットに分けて、前のバケットの代表点・
+    次のバケットの平均点と作る三角形の面積が最大の点を各バケットから 1 点ずつ選ぶ。
+    本来の LTTB は前のバケットの選択結果に依存して逐次的に決まるが、ここでは前のバケットの平均点で
+    1 度選んだ後、その選択結果を前の代表点として選び直す 2 回の一括計算で近似する。
+
+    Args:
+        x: 昇順の x 座標 (欠損なし)
+        y: y 座標 (欠損なし)
+        n_out: 残す点数
+
+    Returns:
+        残す点の位置 (昇順)
+    """
+    n = len(x)
+    # 先頭・末尾の 2 点とバケット 1 つ分に満たなければ間引かない
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # 内側の点 x[1:-1] をバケットに分ける (各バケットは 1 点以上になる)
+    starts = np.linspace(0, n - 2, n_out - 1).astype(np.int64)
+    counts = np.diff(starts)
+    starts = starts[:-1]
+    inner_x, inner_y = x[1:-1], y[1:-1]
+    mean_x = np.add.reduceat(inner_x, starts) / counts
+    mean_y = np.add.reduceat(inner_y, starts) / counts
+    # 次のバケットの平均点 C (最後のバケットの次は末尾の点)
+    next_x, next_y = np.append(mean_x[1:], x[-1]), np.append(mean_y[1:], y[-1])
+    # 前のバケットの代表点 A (1 回目は平均点、最初のバケットの前は先頭の点)
+    prev_x, prev_y = np.append(x[0], mean_x[:-1]), np.append(y[0], mean_y[:-1])
+    chosen = starts
+    for _ in range(2):
+        # 三角形 ABC の面積 (の 2 倍) は点 B の座標の 1 次式 |a * y + b * x + c| なので、係数をバケットごとに求める
+        a = prev_x - next_x
+        b = next_y - prev_y
+        c = -a * prev_y - b * prev_x
+        area = np.repeat(a, counts) * inner_y
+        area += np.repeat(b, counts) * inner_x
+        area += np.repeat(c, counts)
+        chosen = _segment_argext(np.abs(area), starts, largest=True)
+        prev_x, prev_y = np.append(x[0], inner_x[chosen[:-1]]), np.append(y[0], inner_y[chosen[:-1]])
+    return np.concatenate([[0], chosen + 1, [n - 1]])
+
+
+def minmax(x: np.ndarray, y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """x の範囲を等幅の n_buckets 個の区間 (チャートの横方向のピクセル相当) に分け、区間ごとの最小・最大の点を選ぶ
+
+    Args:
+        x: 昇順の x 座標 (欠損なし)
+        y: y 座標 (欠損なし)
+        n_buckets: 区間の数 (残す点数はその 2 倍以下)
+
+    Returns:
+        残す点の位置 (昇順)
+    """
+    n = len(x)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+    span = float(x[-1] - x[0])
+    if span <= 0:
+        bucket = np.zeros(n, dtype=np.int64)
+    else:
+        bucket = np.minimum(((x - x[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+    # x は昇順なので同じ区間の点は連続している
+    starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+    lows = _segment_argext(y, starts, largest=False)
+    highs = _segment_argext(y, starts, largest=True)
+    return np.union1d(lows, highs)
+
+
+def downsample(x: np.ndarray, y: np.ndarray, budget: int, method: DownsampleMethod) -> tuple[np.ndarray, np.ndarray]:
+    """x の昇順に並んだ系列から y の欠損を除き、budget 点以下に間引く
+
+    Args:
+        x: 昇順の x 座標 (日時はエポック値)
+        y: y 座標 (欠損は NaN)
+        budget: 残す点数の上限
+        method: 間引き方式
+
+    Returns:
+        間引いた (x, y)
+    """
+    valid = np.isfinite(y)
+    x, y = x[valid], y[valid]
+    if len(x) <= budget:
+        return x, y
+    # 大きなエポック値の差を float で正確に扱えるよう先頭からの差にする
+    offsets = (x - x[0]).astype(np.float64)
+    keep = lttb(offsets, y, budget) if method == "lttb" else minmax(offsets, y, budget // 2)
+    return x[keep], y[keep]
+
+
+def time_order(col: RangeColumn, mask: np.ndarray | None) -> tuple[np.ndarray, np.ndarray]:
+    """フィルター後の行を日時の昇順に並べた (エポック値, 行位置)
+
+    フィルター用インデックスのソート済み配列を絞り込むだけで、並べ替えはしない。
+
+    Args:
+        col: 日時列のインデックス
+        mask: フィルターのマスク (絞り込み不要ならNone)
+
+    Returns:
+        欠損を除いた昇順のエポック値と、その元の行位置
+    """
+    if mask is None:
+        return col.sorted_values, col.order
+    keep = mask[col.order]
+    return col.sorted_values[keep], col.order[keep]
+
+
+def timeseries_frame(x: np.ndarray, y: np.ndarray, names: tuple[str, str], unit: str) -> DataFrame:
+    """間引いた系列を Vega-Lite に渡す表にする
+
+    Args:
+        x: unit 単位のエポック値
+        y: 値
+        names: (日時列の名前, 値の列の名前)
+        unit: x の分解能 (s / ms / us / ns)
+
+    Returns:
+        日時列と値の列を持つ表
+    """
+    return pd.DataFrame({names[0]: x.astype(f"datetime64[{unit}]"), names[1]: y})
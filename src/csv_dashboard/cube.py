@@ -0,0 +1,309 @@
+"""
+集計キューブ : カテゴリ × 時間バケットの全組み合わせについて、数値列の合計と件数をデータセットごとに 1 度だけ集計する
+
+ピボット表の集計と、キューブの次元に対するサイドバーのフィルターは、行を走査し直さずにキューブのセルを
+足し合わせて求める。カテゴリ次元は FilterIndex の値選択列のコードをそのまま使い、np.bincount で集計する。
+"""
+
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from typing import Literal, Self, cast
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from src.csv_dashboard.filter_index import CategoryColumn, FilterIndex, FilterValue, RangeColumn
+
+type TimeGrain = Literal["day", "week", "month", "quarter", "year"]
+type Aggregation = Literal["sum", "mean", "count"]
+
+# キューブのセル数 (各次元のメンバー数 + 欠損 1 の積) の上限。超える次元はキューブに含めない
+CUBE_MAX_CELLS = 250_000
+# 時間次元を日単位で持つ期間の上限 (日数)。これより長ければ月単位で持つ
+CUBE_MAX_DAYS = 1_100
+# 時間の粒度の表示名
+GRAINS: dict[TimeGrain, str] = {"day": "日", "week": "週", "month": "月", "quarter": "四半期", "year": "年"}
+# 集計方法の表示名
+AGGREGATIONS: dict[Aggregation, str] = {"sum": "合計", "mean": "平均", "count": "件数"}
+# 欠損のメンバーの表示名
+MISSING_LABEL = "(欠損)"
+# 集計結果の値の列名
+VALUE_COLUMN = "value"
+
+_UNITS_PER_SECOND = {"s": 1, "ms": 10**3, "us": 10**6, "ns": 10**9}
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def bucket_labels(starts: np.ndarray, grain: TimeGrain) -> np.ndarray:
+    """日付 (datetime64[D]) を grain のバケットの表示名にする (辞書順が時系列順になる)
+
+    Args:
+        starts: 日付の配列 (欠損は NaT)
+        grain: 時間の粒度
+
+    Returns:
+        表示名の配列
+    """
+    days = starts.astype("datetime64[D]")
+    if grain == "week":
+        # 1970-01-01 は木曜日なので、3 日ずらして月曜始まりの週にそろえる
+        offsets = (days.astype(np.int64) + 3) % 7
+        labels = (days - offsets.astype("timedelta64[D]")).astype(str)
+    elif grain == "month":
+        labels = days.astype("datetime64[M]").astype(str)
+    elif grain == "quarter":
+        months = days.astype("datetime64[M]").astype(np.int64)
+        labels = np.array([f"{1970 + m // 12}-Q{m % 12 // 3 + 1}" for m in months.tolist()], dtype=object)
+    elif grain == "year":
+        labels = days.astype("datetime64[Y]").astype(str)
+    else:
+        labels = days.astype(str)
+    result: np.ndarray = labels.astype(object)
+    result[np.isnat(days)] = MISSING_LABEL
+    return result
+
+
+@dataclass(frozen=True, slots=True)
+class CubeDimension:
+    """キューブの次元 (末尾のメンバーは欠損用)"""
+
+    name: str
+    kind: Literal["category", "time"]
+    # カテゴリ次元のメンバー (FilterIndex の選択肢と同じ順)
+    options: tuple[str, ...] = ()
+    # 時間次元の粒度と、各バケットの開始日 (datetime64[D])
+    grain: TimeGrain = "day"
+    starts: np.ndarray | None = None
+    # 時間次元のバケット境界 (列の unit 単位のエポック値、バケット数 + 1 個)
+    edges: np.ndarray | None = None
+
+    @property
+    def size(self) -> int:
+        """欠損を含めたメンバー数"""
+        return len(self.options) + 1 if self.kind == "category" else len(cast("np.ndarray", self.starts)) + 1
+
+    @property
+    def grains(self) -> list[TimeGrain]:
+        """集計できる時間の粒度 (キューブの粒度とそれより粗いもの)"""
+        names = list(GRAINS)
+        return names[names.index(self.grain) :]
+
+    def labels(self, grain: TimeGrain | None = None) -> np.ndarray:
+        """メンバーの表示名。時間次元は grain のバケット名 (同じ名前のメンバーは後で合算する)"""
+        if self.kind == "category":
+            return np.array([*self.options, MISSING_LABEL], dtype=object)
+        starts = np.append(cast("np.ndarray", self.starts), np.datetime64("NaT", "D"))
+        return bucket_labels(starts, grain or self.grain)
+
+    def selection(self, value: FilterValue) -> np.ndarray:
+        """フィルターの値に該当するメンバーの bool 配列 (欠損のメンバーは常に False)"""
+        if self.kind == "category":
+            selected = np.append(pd.Index(self.options).isin(cast("tuple[str, ...]", value)), False)
+            return cast("np.ndarray", selected)
+        lo, hi = cast("tuple[float, float]", value)
+        edges = cast("np.ndarray", self.edges)
+        return np.append((edges[:-1] >= lo) & (edges[1:] <= hi + 1), False)
+
+    def aligned(self, value: FilterValue) -> bool:
+        """フィルターの値をメンバー単位で表せるか (時間次元は範囲の両端がバケット境界に一致するか)"""
+        if self.kind == "category":
+            return True
+        lo, hi = cast("tuple[float, float]", value)
+        edges = cast("np.ndarray", self.edges)
+        return bool((lo <= edges[0] or lo in edges) and (hi + 1 >= edges[-1] or hi + 1 in edges))
+
+
+@dataclass(frozen=True, slots=True)
+class RollupCube:
+    """次元のメンバーの全組み合わせごとの行数と、数値列の合計・件数 (欠損を除く)"""
+
+    dimensions: tuple[CubeDimension, ...]
+    # shape は各次元の size
+    rows: np.ndarray
+    sums: dict[str, np.ndarray]
+    counts: dict[str, np.ndarray]
+
+    @classmethod
+    def build(cls, df: DataFrame, index: FilterIndex) -> Self | None:
+        """値選択列と最初の日時列を次元、数値列を集計値としてキューブを作る
+
+        セル数が CUBE_MAX_CELLS を超えない範囲で、列の順に次元へ加える。
+
+        Args:
+            df: 対象のDataFrame
+            index: df から構築したフィルター用インデックス
+
+        Returns:
+            構築したキューブ。次元にできる列が無ければNone
+        """
+        dimensions: list[CubeDimension] = []
+        n_cells = 1
+        time_col = next(
+            (c for c, ci in index.columns.items() if isinstance(ci, RangeColumn) and ci.kind == "datetime"), None
+        )
+        if time_col is not None:
+            time_dim = _time_dimension(df[time_col])
+            if time_dim.size <= CUBE_MAX_CELLS:
+                dimensions.append(time_dim)
+                n_cells *= time_dim.size
+        for col, col_index in index.columns.items():
+            if isinstance(col_index, CategoryColumn) and n_cells * (len(col_index.options) + 1) <= CUBE_MAX_CELLS:
+                dimensions.append(CubeDimension(col, "category", options=tuple(col_index.options)))
+                n_cells *= len(col_index.options) + 1
+        if not dimensions:
+            return None
+        measures = [c for c, ci in index.columns.items() if isinstance(ci, RangeColumn) and ci.kind == "numeric"]
+        return cls._aggregate(df, index, tuple(dimensions), measures, None)
+
+    @classmethod
+    def _aggregate(
+        cls,
+        df: DataFrame,
+        index: FilterIndex,
+        dimensions: tuple[CubeDimension, ...],
+        measures: list[str],
+        positions: np.ndarray | None,
+    ) -> Self:
+        """positions の行 (None なら全行) を集計する"""
+        shape = tuple(d.size for d in dimensions)
+        codes = [_member_codes(df, index, d, positions) for d in dimensions]
+        cells = np.ravel_multi_index(codes, shape) if len(codes) > 1 else codes[0]
+        n_cells = int(np.prod(shape))
+        rows = np.bincount(cells, minlength=n_cells).reshape(shape)
+        sums: dict[str, np.ndarray] = {}
+        counts: dict[str, np.ndarray] = {}
+        for col in measures:
+            values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            if positions is not None:
+                values = values[positions]
+            valid = np.isfinite(values)
+            sums[col] = np.bincount(cells, weights=np.where(valid, values, 0.0), minlength=n_cells).reshape(shape)
+            counts[col] = np.bincount(cells[valid], minlength=n_cells).reshape(shape)
+        return cls(dimensions=dimensions, rows=rows, sums=sums, counts=counts)
+
+    def restrict(self, df: DataFrame, index: FilterIndex, positions: np.ndarray) -> Self:
+        """同じ次元・集計値で positions の行だけを集計し直したキューブ (キューブで表せないフィルターの後に使う)
+
+        Args:
+            df: キューブを作ったDataFrame
+            index: df から構築したフィルター用インデックス
+            positions: 集計する行位置
+
+        Returns:
+            positions の行だけのキューブ
+        """
+        return self._aggregate(df, index, self.dimensions, list(self.sums), positions)
+
+    @property
+    def measures(self) -> list[str]:
+        """集計値にできる数値列"""
+        return list(self.sums)
+
+    @property
+    def time_dimension(self) -> CubeDimension | None:
+        """時間次元 (無ければNone)"""
+        return next((d for d in self.dimensions if d.kind == "time"), None)
+
+    def supports(self, filters: Mapping[str, FilterValue]) -> bool:
+        """絞り込みをキューブのメンバー単位で表せるか (全フィルターがキューブの次元に対するものか)
+
+        Args:
+            filters: 絞り込みが効いている列 → ウィジェット値
+
+        Returns:
+            キューブだけで集計できるならTrue
+        """
+        dims = {d.name: d for d in self.dimensions}
+        return all(col in dims and dims[col].aligned(value) for col, value in filters.items())
+
+    def query(
+        self,
+        group_by: Sequence[str],
+        *,
+        grain: TimeGrain,
+        measure: str | None,
+        agg: Aggregation,
+        filters: Mapping[str, FilterValue],
+    ) -> DataFrame:
+        """group_by の次元ごとに measure を agg で集計する。行を走査せずキューブのセルだけを足し合わせる
+
+        Args:
+            group_by: 集計の単位にする次元
+            grain: 時間次元の粒度
+            measure: 集計する数値列 (None なら行数)
+            agg: 集計方法
+            filters: キューブの次元に対するフィルター (supports で確認済みのもの)
+
+        Returns:
+            group_by の列と VALUE_COLUMN 列を持つ表 (該当行の無い組み合わせは含めない)
+        """
+        rows = self.rows
+        sums = self.sums[measure] if measure is not None else rows
+        counts = self.counts[measure] if measure is not None else rows
+        labels: list[np.ndarray] = []
+        for axis, dim in enumerate(self.dimensions):
+            dim_labels = dim.labels(grain if dim.name in group_by else None)
+            if dim.name in filters:
+                selected = dim.selection(filters[dim.name])
+                rows, sums, counts = (a.compress(selected, axis=axis) for a in (rows, sums, counts))
+                dim_labels = dim_labels[selected]
+            labels.append(dim_labels)
+
+        # group_by に無い次元は合計し、同じ表示名のメンバー (粗い粒度の時間バケット) は 1 つにまとめる
+        others = tuple(i for i, d in enumerate(self.dimensions) if d.name not in group_by)
+        rows, sums, counts = (a.sum(axis=others) for a in (rows, sums, counts))
+        kept = [(d.name, labels[i]) for i, d in enumerate(self.dimensions) if d.name in group_by]
+        names: list[str] = []
+        members: list[np.ndarray] = []
+        for axis, (name, axis_labels) in enumerate(kept):
+            uniques, inverse = np.unique(axis_labels.astype(str), return_inverse=True)
+            if len(uniques) < len(axis_labels):
+                onehot = np.zeros((len(axis_labels), len(uniques)))
+                onehot[np.arange(len(axis_labels)), inverse] = 1
+                rows, sums, counts = (
+                    np.moveaxis(np.tensordot(a, onehot, axes=([axis], [0])), -1, axis) for a in (rows, sums, counts)
+                )
+            names.append(name)
+            members.append(np.asarray(uniques if len(uniques) < len(axis_labels) else axis_labels, dtype=object))
+
+        cells = np.nonzero(rows > 0)
+        result = pd.DataFrame({name: m[i] for name, m, i in zip(names, members, cells, strict=True)})
+        total, n = sums[cells].astype(np.float64), counts[cells].astype(np.float64)
+        if agg == "count":
+            result[VALUE_COLUMN] = n.astype(np.int64)
+        else:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                value = total / n if agg == "mean" else total
+            # SQL と同じく、有効な値が 1 つも無い組み合わせは欠損にする
+            result[VALUE_COLUMN] = np.where(n > 0, value, np.nan)
+        return result[[*group_by, VALUE_COLUMN]].sort_values(list(group_by), kind="stable", ignore_index=True)
+
+
+def _time_dimension(s: pd.Series) -> CubeDimension:
+    """日時列から時間次元を作る (期間が CUBE_MAX_DAYS 日を超えれば月単位)"""
+    per_day = _SECONDS_PER_DAY * _UNITS_PER_SECOND[s.dt.unit]
+    days = s.array.asi8[s.notna().to_numpy()] // per_day
+    first, last = (int(days.min()), int(days.max())) if len(days) else (0, 0)
+    if last - first + 1 <= CUBE_MAX_DAYS:
+        starts = np.arange(first, last + 2).astype("datetime64[D]")
+        grain: TimeGrain = "day"
+    else:
+        months = np.array([first, last]).astype("datetime64[D]").astype("datetime64[M]")
+        starts = np.arange(months[0], months[1] + 2).astype("datetime64[D]")
+        grain = "month"
+    return CubeDimension(str(s.name), "time", grain=grain, starts=starts[:-1], edges=starts.astype(np.int64) * per_day)
+
+
+def _member_codes(df: DataFrame, index: FilterIndex, dim: CubeDimension, positions: np.ndarray | None) -> np.ndarray:
+    """各行の次元 dim のメンバー番号 (欠損は末尾の番号)"""
+    if dim.kind == "category":
+        codes = cast("CategoryColumn", index.columns[dim.name]).codes
+        if positions is not None:
+            codes = codes[positions]
+        return np.where(codes < 0, dim.size - 1, codes).astype(np.intp)
+    s = df[dim.name] if positions is None else df[dim.name].iloc[positions]
+    edges = cast("np.ndarray", dim.edges)
+    member: np.ndarray = np.searchsorted(edges, s.array.asi8, side="right") - 1
+    member[s.isna().to_numpy()] = dim.size - 1
+    return member.astype(np.intp)
@@ -0,0 +1,293 @@
+"""
+フィルター用インデックス : データセットごとに一度だけ列統計と検索用配列を構築し、フィルターを差分で適用する
+"""
+
+import math
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Literal, cast
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from src.csv_dashboard.profile import ColumnProfile, profile_frame
+
+type RangeValue = tuple[float, float]
+type FilterValue = RangeValue | tuple[str, ...] | str
+type TimeUnit = Literal["s", "ms", "us", "ns"]
+
+
+@dataclass(frozen=True, slots=True)
+class RangeColumn:
+    """範囲フィルター (数値・日時) 用の列インデックス"""
+
+    kind: Literal["numeric", "datetime"]
+    # 欠損を除いた値の昇順ソート (数値は元の dtype、日時は unit 単位の int64 エポック値)
+    sorted_values: np.ndarray
+    # sorted_values[i] の元の行位置
+    order: np.ndarray
+    # 欠損値の行位置
+    missing: np.ndarray
+    # 欠損を含めた行数
+    n_rows: int
+    # 日時列の分解能 (pandas 3 では列ごとに s / ms / us / ns が異なる)
+    unit: TimeUnit = "ns"
+
+    @property
+    def min(self) -> float:
+        """最小値"""
+        return float(self.sorted_values[0])
+
+    @property
+    def max(self) -> float:
+        """最大値"""
+        return float(self.sorted_values[-1])
+
+    def to_timestamp(self, value: float) -> pd.Timestamp:
+        """日時列のエポック値を Timestamp に変換する"""
+        return pd.Timestamp(int(value), unit=self.unit)
+
+    def from_timestamp(self, ts: date) -> int:
+        """日付・日時を日時列のエポック値に変換する"""
+        return int(pd.Timestamp(ts).as_unit(self.unit).asm8.astype(np.int64))
+
+    def mask(self, lo: float, hi: float) -> np.ndarray | None:
+        """lo <= 値 <= hi の行を True とするマスク。全行が該当する場合はNone
+
+        Series.between と同じく欠損値の行は含めない。
+
+        Args:
+            lo: 下限 (日時は from_timestamp で変換したエポック値)
+            hi: 上限 (日時は from_timestamp で変換したエポック値)
+
+        Returns:
+            行数分の bool 配列、絞り込み不要ならNone
+        """
+        lo_v, hi_v = _bounds_for(self.sorted_values.dtype, lo, hi)
+        i = int(np.searchsorted(self.sorted_values, lo_v, side="left"))
+        j = int(np.searchsorted(self.sorted_values, hi_v, side="right"))
+        if i == 0 and j == self.n_rows:
+            return None
+        # 欠損が無く該当行が多い場合は、除外する行に False を書き込む方が速い
+        n_valid = len(self.order)
+        if n_valid == self.n_rows and j - i > n_valid // 2:
+            mask = np.ones(self.n_rows, dtype=bool)
+            mask[self.order[:i]] = False
+            mask[self.order[j:]] = False
+        else:
+            mask = np.zeros(self.n_rows, dtype=bool)
+            mask[self.order[i:j]] = True
+        return mask
+
+
+@dataclass(frozen=True, slots=True)
+class CategoryColumn:
+    """値選択フィルター用の列インデックス"""
+
+    # 選択肢 (出現順)
+    options: list[str]
+    # 各行の options 内の位置。欠損は -1
+    codes: np.ndarray
+
+    def mask(self, selected: tuple[str, ...]) -> np.ndarray | None:
+        """選択された値の行を True とするマスク。未選択ならNone
+
+        Args:
+            selected: 選択された値
+
+        Returns:
+            行数分の bool 配列、絞り込み不要ならNone
+        """
+        if not selected:
+            return None
+        # 末尾の要素は欠損 (-1) 用で常に False
+        lut = np.zeros(len(self.options) + 1, dtype=bool)
+        lut[pd.Index(self.options).get_indexer(pd.Index(selected))] = True
+        lut[-1] = False
+        mask: np.ndarray = lut[self.codes]
+        return mask
+
+
+@dataclass(frozen=True, slots=True)
+class SearchColumn:
+    """前方一致検索フィルター用の列 (ユニーク数が多く選択肢を列挙できない列)
+
+    選択肢を作らず、検索語が変わったときだけ列を走査する。
+    """
+
+    series: Series
+    profile: ColumnProfile
+
+    def mask(self, prefix: str) -> np.ndarray | None:
+        """prefix で始まる値の行を True とするマスク。検索語が空ならNone
+
+        Args:
+            prefix: 検索語
+
+        Returns:
+            行数分の bool 配列、絞り込み不要ならNone
+        """
+        if not prefix:
+            return None
+        # category 列はカテゴリごとに 1 度だけ判定される
+        mask: np.ndarray = self.series.str.startswith(prefix, na=False).to_numpy(dtype=bool)
+        return mask
+
+
+type ColumnIndex = RangeColumn | CategoryColumn | SearchColumn
+
+
+@dataclass(frozen=True, slots=True)
+class FilterIndex:
+    """データセットごとに一度だけ構築するフィルター用インデックス"""
+
+    columns: dict[str, ColumnIndex]
+    n_rows: int
+
+    @classmethod
+    def build(cls, df: DataFrame, profiles: dict[str, ColumnProfile] | None = None) -> "FilterIndex":
+        """DataFrame から列ごとのインデックスを構築する
+
+        ユニーク数 (推定) の多い文字列・カテゴリ列は、選択肢を作らず前方一致検索の列にする。
+
+        Args:
+            df: 対象のDataFrame
+            profiles: profile_frame で求めた列プロファイル (省略時はここで求める)
+
+        Returns:
+            構築したFilterIndex
+        """
+        if profiles is None:
+            profiles = profile_frame(df)
+        columns: dict[str, ColumnIndex] = {}
+        for col in df.columns:
+            s = df[col]
+            if pd.api.types.is_numeric_dtype(s) or pd.api.types.is_datetime64_any_dtype(s):
+                range_col = _build_range(s)
+                if range_col is not None:
+                    columns[col] = range_col
+            elif profiles[col].searchable:
+                columns[col] = SearchColumn(series=s, profile=profiles[col])
+            else:
+                columns[col] = _build_category(s)
+        return cls(columns=columns, n_rows=len(df))
+
+    def mask(self, col: str, value: FilterValue) -> np.ndarray | None:
+        """列 col にウィジェット値 value を適用したマスク"""
+        index = self.columns[col]
+        if isinstance(index, RangeColumn):
+            lo, hi = cast("RangeValue", value)
+            return index.mask(lo, hi)
+        if isinstance(index, SearchColumn):
+            return index.mask(cast("str", value))
+        return index.mask(cast("tuple[str, ...]", value))
+
+
+@dataclass(slots=True)
+class IncrementalFilter:
+    """セッションごとのフィルター状態
+
+    列ごとに直前のウィジェット値とマスクを保持し、値が変わった列のマスクだけを再計算する。
+    """
+
+    index: FilterIndex
+    _masks: dict[str, tuple[FilterValue, np.ndarray | None]] = field(default_factory=dict)
+    _combined: np.ndarray | None = None
+    _dirty: bool = True
+    # 直近の update で再計算した列 (計測・表示用)
+    recomputed: list[str] = field(default_factory=list)
+    # フィルター結果が変わるたびに増える番号 (派生結果のキャッシュキー用)
+    version: int = 0
+
+    def begin(self) -> None:
+        """再実行の開始時に呼ぶ"""
+        self.recomputed = []
+
+    def update(self, col: str, value: FilterValue) -> None:
+        """列 col のウィジェット値を反映する。前回と同じ値なら何もしない"""
+        cached = self._masks.get(col)
+        if cached is not None and cached[0] == value:
+            return
+        self._masks[col] = (value, self.index.mask(col, value))
+        self.recomputed.append(col)
+        self._dirty = True
+        self.version += 1
+
+    def active(self) -> dict[str, FilterValue]:
+        """絞り込みが効いている列のウィジェット値 (全行が該当する列は含めない)"""
+        return {col: value for col, (value, mask) in self._masks.items() if mask is not None}
+
+    def mask(self) -> np.ndarray | None:
+        """全列のマスクの論理積。絞り込み不要ならNone"""
+        if self._dirty:
+            masks = [m for _, m in self._masks.values() if m is not None]
+            if not masks:
+                self._combined = None
+            elif len(masks) == 1:
+                self._combined = masks[0]
+            else:
+                self._combined = np.logical_and.reduce(masks)
+            self._dirty = False
+        return self._combined
+
+    def positions(self) -> np.ndarray:
+        """フィルター後の行位置"""
+        combined = self.mask()
+        return np.arange(self.index.n_rows) if combined is None else np.flatnonzero(combined)
+
+    def select(self, df: DataFrame) -> DataFrame:
+        """df にフィルターを適用する。絞り込み不要ならコピーせずにそのまま返す"""
+        combined = self.mask()
+        return df if combined is None else df[combined]
+
+
+def _build_range(s: Series) -> RangeColumn | None:
+    """数値・日時列の範囲インデックスを構築する。有効な値が無ければNone"""
+    unit: TimeUnit = "ns"
+    if pd.api.types.is_datetime64_any_dtype(s):
+        kind: Literal["numeric", "datetime"] = "datetime"
+        values = s.array.asi8
+        unit = s.dt.unit
+    else:
+        kind = "numeric"
+        values = s.to_numpy(dtype=np.int8) if pd.api.types.is_bool_dtype(s) else s.to_numpy()
+    valid = s.notna().to_numpy()
+    if not valid.any():
+        return None
+    index_dtype = np.int32 if len(s) < np.iinfo(np.int32).max else np.int64
+    if valid.all():
+        order = np.argsort(values, kind="stable").astype(index_dtype, copy=False)
+        missing = np.empty(0, dtype=index_dtype)
+    else:
+        positions = np.flatnonzero(valid).astype(index_dtype, copy=False)
+        order = positions[np.argsort(values[valid], kind="stable")]
+        missing = np.flatnonzero(~valid).astype(index_dtype, copy=False)
+    return RangeColumn(kind=kind, sorted_values=values[order], order=order, missing=missing, n_rows=len(s), unit=unit)
+
+
+def _build_category(s: Series) -> CategoryColumn:
+    """値選択列のインデックスを構築する。category 列は既存のコードをそのまま使う"""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return CategoryColumn(options=s.cat.categories.astype(str).tolist(), codes=s.cat.codes.to_numpy())
+    codes, uniques = pd.factorize(s)
+    return CategoryColumn(options=pd.Index(uniques).astype(str).tolist(), codes=codes)
+
+
+def _bounds_for(dtype: np.dtype, lo: float, hi: float) -> tuple[np.generic, np.generic]:
+    """検索境界をソート済み配列と同じ dtype に変換する (異なる dtype で検索すると全体がコピーされるため)"""
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        lo_i = min(max(math.ceil(lo), info.min), info.max)
+        hi_i = min(max(math.floor(hi), info.min), info.max)
+        # 範囲外の境界はクリップ後も空集合になるよう調整する
+        if lo > info.max or hi < info.min or lo_i > hi_i:
+            return dtype.type(info.max), dtype.type(info.min)
+        return dtype.type(lo_i), dtype.type(hi_i)
+    lo_f, hi_f = dtype.type(lo), dtype.type(hi)
+    # 精度の低い float32 へ丸めた結果、範囲が広がらないよう 1 ulp 内側へ寄せる
+    if lo_f < lo:
+        lo_f = np.nextafter(lo_f, dtype.type(np.inf))
+    if hi_f > hi:
+        hi_f = np.nextafter(hi_f, dtype.type(-np.inf))
+    return lo_f, hi_f
@@ -0,0 +1,228 @@
+"""
+CSV 取り込みエンジン : 先頭サンプルから省メモリな dtype を推定し、pyarrow でチャンク単位に読み込む
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from pathlib import Path
+from typing import IO, Literal
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from pandas import DataFrame, Series
+
+from src.libs.metrics import peak_rss_bytes
+
+type ColumnKind = Literal["bool", "int", "float", "datetime", "category", "string"]
+
+# dtype 推定に使う先頭行数
+SAMPLE_ROWS = 10_000
+# pyarrow が一度に処理するブロックサイズ (= チャンクの大きさ)
+BLOCK_BYTES = 32 * 1024 * 1024
+# ユニーク率がこれ以下の文字列列は category にする
+CATEGORY_MAX_RATIO = 0.5
+# ユニーク数がこれを超える文字列列は category にしない (ID・URL 等)
+CATEGORY_MAX_UNIQUE = 50_000
+
+_ARROW_TYPES: dict[ColumnKind, pa.DataType] = {
+    "bool": pa.bool_(),
+    "int": pa.int64(),
+    "float": pa.float64(),
+    "datetime": pa.timestamp("ns"),
+    "category": pa.dictionary(pa.int32(), pa.string()),
+    "string": pa.string(),
+}
+
+
+@dataclass(frozen=True, slots=True)
+class IngestReport:
+    """取り込み結果のメモリ統計"""
+
+    rows: int
+    # 省メモリ dtype で保持した DataFrame のメモリ使用量
+    memory_bytes: int
+    # 従来の pd.read_csv 経路で保持した場合の推定メモリ使用量 (サンプルから外挿)
+    baseline_bytes: int
+    # 取り込み完了時点のプロセス最大 RSS
+    peak_rss_bytes: int
+    engine: Literal["pyarrow", "pandas"]
+
+    @property
+    def saved_bytes(self) -> int:
+        """従来経路と比べて削減できたメモリ量"""
+        return max(self.baseline_bytes - self.memory_bytes, 0)
+
+
+def infer_kinds(sample: DataFrame) -> dict[str, ColumnKind]:
+    """サンプルから各列の格納形式を推定する
+
+    Args:
+        sample: 先頭行を pd.read_csv で読み込んだDataFrame
+
+    Returns:
+        列名 → 格納形式の辞書
+    """
+    kinds: dict[str, ColumnKind] = {}
+    for col in sample.columns:
+        s = sample[col]
+        if pd.api.types.is_bool_dtype(s):
+            kinds[col] = "bool"
+        elif pd.api.types.is_integer_dtype(s):
+            kinds[col] = "int"
+        elif pd.api.types.is_float_dtype(s):
+            kinds[col] = "float"
+        elif _looks_like_datetime(s):
+            kinds[col] = "datetime"
+        else:
+            n_unique = s.nunique()
+            is_low_cardinality = n_unique <= CATEGORY_MAX_RATIO * max(len(s), 1) and n_unique <= CATEGORY_MAX_UNIQUE
+            kinds[col] = "category" if is_low_cardinality else "string"
+    return kinds
+
+
+def _looks_like_datetime(s: Series) -> bool:
+    """文字列列が ISO 8601 形式の日時として解釈できるか判定"""
+    values = s.dropna()
+    if values.empty or not pd.api.types.is_string_dtype(values):
+        return False
+    try:
+        pd.to_datetime(values, format="ISO8601")
+    except (ValueError, TypeError, OverflowError):
+        return False
+    return True
+
+
+def _downcast_float(s: Series) -> Series:
+    """精度を失わない場合のみ float32 へ縮小する"""
+    narrowed = s.astype(np.float32)
+    if np.array_equal(narrowed.to_numpy(np.float64), s.to_numpy(np.float64), equal_nan=True):
+        return narrowed
+    return s
+
+
+def compact_frame(df: DataFrame, kinds: dict[str, ColumnKind]) -> DataFrame:
+    """推定した格納形式に従って dtype を縮小する
+
+    Args:
+        df: 変換対象のDataFrame (チャンク単位で呼ばれる)
+        kinds: 列名 → 格納形式の辞書
+
+    Returns:
+        dtype を縮小したDataFrame
+    """
+    for col, kind in kinds.items():
+        if col not in df.columns:
+            continue
+        if kind == "int":
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+        elif kind == "float":
+            df[col] = _downcast_float(df[col])
+        elif kind == "datetime" and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], format="ISO8601")
+        elif kind == "category" and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def _concat_chunks(chunks: list[DataFrame], kinds: dict[str, ColumnKind]) -> DataFrame:
+    """チャンクを結合する。category 列はカテゴリを揃えてから結合し object 化を防ぐ"""
+    if len(chunks) == 1:
+        return chunks[0]
+    for col, kind in kinds.items():
+        if kind != "category":
+            continue
+        categories = pd.Index(
+            pd.unique(np.concatenate([chunk[col].cat.categories.to_numpy(dtype=object) for chunk in chunks]))
+        )
+        for chunk in chunks:
+            chunk[col] = chunk[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _read_chunked(file: IO[bytes], kinds: dict[str, ColumnKind]) -> DataFrame:
+    """pyarrow のストリーミングリーダーでブロックごとに読み込み、都度 dtype を縮小する"""
+    reader = pa_csv.open_csv(
+        file,
+        read_options=pa_csv.ReadOptions(block_size=BLOCK_BYTES),
+        convert_options=pa_csv.ConvertOptions(column_types={col: _ARROW_TYPES[kind] for col, kind in kinds.items()}),
+    )
+    chunks = [compact_frame(batch.to_pandas(), kinds) for batch in reader]
+    if not chunks:
+        return pd.DataFrame(columns=list(kinds))
+    return _concat_chunks(chunks, kinds)
+
+
+def read_csv_compact(file: IO[bytes]) -> tuple[DataFrame, IngestReport]:
+    """CSV を省メモリな dtype で読み込む
+
+    先頭 SAMPLE_ROWS 行から列ごとの格納形式を推定し、残りは pyarrow でチャンク単位に読み込む。
+    サンプルと矛盾する値が後半に現れた場合は従来の pd.read_csv にフォールバックし、全行から格納形式を推定し直す。
+
+    Args:
+        file: CSVファイルのバイトストリーム (seek 可能であること)
+
+    Returns:
+        読み込んだDataFrameと取り込み統計
+    """
+    sample = pd.read_csv(file, nrows=SAMPLE_ROWS)
+    kinds = infer_kinds(sample)
+    baseline_per_row = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+
+    engine: Literal["pyarrow", "pandas"] = "pyarrow"
+    file.seek(0)
+    try:
+        df = _read_chunked(file, kinds)
+    except pa.ArrowInvalid:
+        # サンプルから推定した格納形式は後半の値と矛盾しているため、全行から推定し直す
+        engine = "pandas"
+        file.seek(0)
+        df = pd.read_csv(file)
+        df = compact_frame(df, infer_kinds(df))
+
+    report = IngestReport(
+        rows=len(df),
+        memory_bytes=int(df.memory_usage(deep=True).sum()),
+        baseline_bytes=int(baseline_per_row * len(df)),
+        peak_rss_bytes=peak_rss_bytes(),
+        engine=engine,
+    )
+    return df, report
+
+
+# ────────────────────────────────
+#   従来経路との比較 (python -m src.csv_dashboard.ingest FILE)
+# ────────────────────────────────
+def _measure(path: str, *, compact: bool) -> tuple[int, int]:
+    """新しいプロセス内で読み込み、(DataFrame のメモリ, 最大 RSS) を返す"""
+    with Path(path).open("rb") as f:
+        df = read_csv_compact(f)[0] if compact else pd.read_csv(f)
+    return int(df.memory_usage(deep=True).sum()), peak_rss_bytes()
+
+
+def main() -> None:
+    """従来の pd.read_csv と省メモリ取り込みのメモリ使用量を別プロセスで計測して比較する"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("path", help="計測対象の CSV ファイル")
+    args = parser.parse_args()
+
+    # 最大 RSS はプロセス単位の値なので、経路ごとにまっさらなプロセスで計測する
+    results: dict[str, tuple[int, int]] = {}
+    for label, compact in (("pd.read_csv", False), ("read_csv_compact", True)):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            results[label] = pool.submit(_measure, args.path, compact=compact).result()
+
+    mib = 1024 * 1024
+    for label, (mem, rss) in results.items():
+        print(f"{label:<18} memory {mem / mib:>10,.1f} MiB   peak RSS {rss / mib:>10,.1f} MiB")
+    (base_mem, base_rss), (new_mem, new_rss) = results.values()
+    print(
+        f"{'saved':<18} memory {(base_mem - new_mem) / mib:>10,.1f} MiB   peak RSS {(base_rss - new_rss) / mib:>10,.1f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
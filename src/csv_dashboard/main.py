@@ -2,13 +2,57 @@
 Streamlit sample : generic CSV explorer / BI dashboard
 """
 
+import datetime
 import io
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from typing import cast
 
 import altair as alt
 import numpy as np
 import pandas as pd
 import streamlit as st
 from pandas import DataFrame
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from src.csv_dashboard.cache import ColumnarCache, content_key
+from src.csv_dashboard.charts import (
+    DOWNSAMPLE_METHODS,
+    HIST_MAX_BINS,
+    RAW_CHART_MAX_ROWS,
+    TIMESERIES_MAX_POINTS,
+    TIMESERIES_MIN_POINTS,
+    DownsampleMethod,
+    column_sum,
+    downsample,
+    histogram,
+    time_order,
+    timeseries_frame,
+)
+from src.csv_dashboard.cube import AGGREGATIONS, GRAINS, VALUE_COLUMN, Aggregation, RollupCube, TimeGrain
+from src.csv_dashboard.filter_index import CategoryColumn, FilterIndex, IncrementalFilter, RangeColumn, SearchColumn
+from src.csv_dashboard.ingest import IngestReport, read_csv_compact
+from src.csv_dashboard.pager import PAGE_SIZES, page_count, page_frame, sorted_positions
+from src.csv_dashboard.profile import ColumnProfile, profile_frame, profile_table
+from src.csv_dashboard.query import LazyTable, ParquetCache, SqlFilterValue, duckdb_available
+from src.csv_dashboard.registry import Dataset, DatasetRegistry
+from src.libs.export import EXPORT_FORMATS, ExportFormat, export_file
+from src.libs.metrics import StageTimer, metrics, start_exporters
+from src.libs.settings import CsvEngine, settings
+
+MIB = 1024 * 1024
+ENGINE_LABELS: dict[CsvEngine, str] = {"pandas": "pandas (メモリ上)", "duckdb": "DuckDB (メモリより大きなファイル向け)"}
+
+# (集計の単位にする列, 日時列の粒度, 集計値, 集計方法) → (集計結果の表, 集計方法の説明)
+type Rollup = Callable[[list[str], TimeGrain, str | None, Aggregation], tuple[DataFrame, str]]
+# 表示期間 (開始, 終了)
+type Period = tuple[datetime.datetime, datetime.datetime]
+# 日時列 → フィルター後の最初と最後の日時 (該当行が無ければNone)
+type TimeBounds = Callable[[str], Period | None]
+# (日時列, 値の列, 表示期間, 点数の上限, 間引き方式) → (間引いた系列の表, 表示期間内の行数)
+type TimeSeriesQuery = Callable[[str, str, Period, int, DownsampleMethod], tuple[DataFrame, int]]
 
 
 def setup_page() -> None:
@@ -17,17 +61,181 @@ def setup_page() -> None:
     st.title("📊 CSV Explorer")
 
 
-@st.cache_data(show_spinner="CSV 解析中…")
-def load_data(file: io.BytesIO) -> DataFrame:
-    """CSVファイルを読み込みDataFrameを返す
+@contextmanager
+def stage(name: str) -> Iterator[StageTimer]:
+    """処理段階の所要時間を metrics と、セッションに保持する再実行ごとの内訳の両方に記録する
 
     Args:
+        name: 処理段階の名前
+
+    Yields:
+        処理行数を設定するためのオブジェクト
+    """
+    with metrics.timer(f"csv_dashboard.{name}") as t:
+        yield t
+    st.session_state.setdefault("run_timings", {})[name] = t.seconds
+
+
+def session_memo[T](name: str, signature: object, compute: Callable[[], T]) -> T:
+    """signature が前回と同じならセッションに残した結果を返し、変わっていれば compute で作り直す
+
+    フィルター結果・並べ替え結果・集計値など、入力が変わらない限り再実行で使い回せる中間結果に使う。
+
+    Args:
+        name: セッションに保持する際の名前
+        signature: 結果を決める入力 (等価比較できること)
+        compute: 結果を計算する関数
+
+    Returns:
+        計算済みまたは新たに計算した結果
+    """
+    cached: tuple[object, T] | None = st.session_state.get(name)
+    if cached is None or cached[0] != signature:
+        cached = (signature, compute())
+        st.session_state[name] = cached
+        # セッションごとのメモリ使用量としてレジストリに記録する
+        get_registry().record_session(session_id(), name, cached[1])
+    return cached[1]
+
+
+def fragment_timing(name: str) -> None:
+    """フラグメントだけが再実行された場合に、その所要時間をページ全体の前回の再実行と並べて表示する"""
+    seen: dict[str, int] = st.session_state.setdefault("fragment_runs", {})
+    run_id: int = st.session_state.get("run_id", 0)
+    # ページ全体の実行中に呼ばれたのでなければ、フラグメント単独の再実行
+    standalone = seen.get(name) == run_id
+    seen[name] = run_id
+    if standalone:
+        seconds = st.session_state["run_timings"][name]
+        full = st.session_state.get("full_run_seconds", 0.0)
+        st.caption(f"⏱ この部分だけ再実行 {seconds * 1e3:,.1f} ms (ページ全体の前回の実行 {full * 1e3:,.1f} ms)")
+
+
+def display_timings(seconds: float) -> None:
+    """今回のページ全体の実行について、処理段階ごとの所要時間を表示する"""
+    timings: dict[str, float] = st.session_state.get("run_timings", {})
+    with st.expander(f"⏱ 実行時間の内訳 (合計 {seconds * 1e3:,.1f} ms)"):
+        st.dataframe(
+            pd.DataFrame({"処理": list(timings), "ms": [v * 1e3 for v in timings.values()]}),
+            hide_index=True,
+            use_container_width=True,
+        )
+        st.caption("チャート・表・ダウンロード形式の操作は、その部分だけを再実行します")
+
+
+@st.cache_resource
+def start_metrics() -> None:
+    """計測値のサイドカー HTTP サーバー・ログ出力をプロセスごとに 1 度だけ起動する"""
+    start_exporters(settings.metrics_port, settings.metrics_log_interval_seconds)
+
+
+@st.cache_resource
+def get_columnar_cache() -> ColumnarCache:
+    """プロセス内で共有する列指向キャッシュを返す"""
+    cache = ColumnarCache(settings.cache_dir / "csv", max_bytes=settings.csv_cache_max_bytes)
+    metrics.register_cache("csv_columnar", cache.stats)
+    return cache
+
+
+def session_id() -> str:
+    """現在のセッションの ID (スクリプトの実行外では空文字列)"""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else ""
+
+
+def is_active_session(session: str) -> bool:
+    """セッションがまだ接続しているか (Streamlit サーバーの外で実行している場合は常に True)"""
+    return not Runtime.exists() or Runtime.instance().is_active_session(session)
+
+
+@st.cache_resource
+def get_registry() -> DatasetRegistry:
+    """プロセス内で共有するデータセットレジストリを返す (メモリ上限を超えたら列指向キャッシュへ退避する)"""
+    registry = DatasetRegistry(
+        budget_bytes=settings.csv_memory_budget_bytes,
+        ttl=settings.csv_dataset_ttl_seconds,
+        spill=get_columnar_cache().spill,
+        is_active_session=is_active_session,
+    )
+    metrics.register_cache("csv_datasets", registry.stats)
+    return registry
+
+
+@st.cache_resource
+def get_parquet_cache() -> ParquetCache:
+    """プロセス内で共有する DuckDB エンジン用の Parquet キャッシュを返す"""
+    cache = ParquetCache(
+        settings.cache_dir / "csv_parquet",
+        max_bytes=settings.csv_cache_max_bytes,
+        memory_limit=settings.csv_duckdb_memory_limit,
+    )
+    metrics.register_cache("csv_parquet", cache.stats)
+    return cache
+
+
+def upload_key(file: io.BytesIO) -> str:
+    """アップロード内容のキャッシュキーを返す
+
+    同じアップロードを再実行のたびにハッシュし直さないよう、file_id ごとにセッションへ記憶する。
+
+    Args:
+        file: CSVファイルのバイトストリーム
+
+    Returns:
+        内容から決まるキャッシュキー
+    """
+    file_id = getattr(file, "file_id", None)
+    if file_id is None:
+        return content_key(file)
+    keys: dict[str, str] = st.session_state.setdefault("upload_keys", {})
+    if file_id not in keys:
+        keys[file_id] = content_key(file)
+    return keys[file_id]
+
+
+def load_data(key: str, file: io.BytesIO) -> Dataset:
+    """CSVファイルを省メモリな dtype で読み込み、セッション間で共有するデータセットとして返す
+
+    同じ内容のアップロードはセッションをまたいで 1 つのコピーを共有する。メモリ上に無ければ列指向キャッシュから
+    メモリマップで読み込み、それも無ければ解析してキャッシュに保存する。
+    返す DataFrame はセッション間で共有されるため、呼び出し側で破壊的に変更しないこと。
+
+    Args:
+        key: アップロード内容のキャッシュキー
         file: CSVファイルのバイトストリーム
 
     Returns:
-        読み込んだデータのDataFrame
+        DataFrameと取り込み統計を保持したデータセット
     """
-    return pd.read_csv(file)
+
+    def load() -> tuple[DataFrame, IngestReport]:
+        cache = get_columnar_cache()
+        if (cached := cache.load(key)) is not None:
+            return cached
+        with st.spinner("CSV 解析中…"), metrics.timer("csv_dashboard.read_csv") as t:
+            df, report = read_csv_compact(file)
+            t.rows = len(df)
+        return cache.store(key, df, report)
+
+    return get_registry().get(key, session_id(), load)
+
+
+@st.cache_resource(
+    show_spinner="DuckDB で取り込み中…",
+    max_entries=settings.csv_duckdb_max_tables,
+    ttl=settings.csv_dataset_ttl_seconds,
+)
+def load_lazy_table(key: str, _file: io.BytesIO) -> LazyTable:
+    """CSV を Parquet に変換して (キャッシュ済みならそのまま) DuckDB のビューとして開く
+
+    Args:
+        key: アップロード内容のキャッシュキー
+        _file: CSVファイルのバイトストリーム (キャッシュキーの計算対象から除外)
+
+    Returns:
+        Parquet ファイルを参照するLazyTable
+    """
+    return get_parquet_cache().open(key, _file)
 
 
 def create_sample_data() -> io.BytesIO:
@@ -39,13 +247,31 @@ def create_sample_data() -> io.BytesIO:
     sample_df = pd.DataFrame(
         {
             "date": pd.date_range("2025-01-01", periods=50, freq="D"),
-            "category": ["A", "B", "C", "D"] * 13 + ["A", "B"],
+            "category": ["A", "B", "C", "D"] * 12 + ["A", "B"],
             "value": np.random.default_rng().integers(0, 100, 50),
         }
     )
     return io.BytesIO(sample_df.to_csv(index=False).encode())
 
 
+def select_engine() -> CsvEngine:
+    """サイドバーで処理エンジンを選ぶ (duckdb が無ければ pandas のみ)
+
+    Returns:
+        選ばれたエンジン
+    """
+    engines: list[CsvEngine] = ["pandas", "duckdb"] if duckdb_available() else ["pandas"]
+    default = settings.csv_engine if settings.csv_engine in engines else "pandas"
+    engine: CsvEngine = st.sidebar.radio(
+        "⚙️ エンジン",
+        engines,
+        index=engines.index(default),
+        format_func=ENGINE_LABELS.__getitem__,
+        help="DuckDB はファイルを Parquet として保存し、フィルター・集計を SQL で実行して結果だけを読み込みます",
+    )
+    return engine
+
+
 def upload_csv() -> io.BytesIO | None:
     """CSVファイルのアップロード処理
 
@@ -60,82 +286,650 @@ def upload_csv() -> io.BytesIO | None:
     return csv_file
 
 
-def apply_filters(df: DataFrame) -> DataFrame:
+def get_profile(dataset: Dataset) -> dict[str, ColumnProfile]:
+    """データセットごとに一度だけ、ユニーク数・分位点・頻出値を近似した列プロファイルを作る
+
+    Args:
+        dataset: 対象のデータセット
+
+    Returns:
+        列名 → 列プロファイル
+    """
+
+    def compute(d: Dataset) -> dict[str, ColumnProfile]:
+        with st.spinner("列プロファイル作成中…"):
+            return profile_frame(d.df)
+
+    return get_registry().derived(dataset, "profile", compute)
+
+
+@st.cache_resource(
+    show_spinner="列プロファイル作成中…",
+    max_entries=settings.csv_duckdb_max_tables,
+    ttl=settings.csv_dataset_ttl_seconds,
+)
+def get_lazy_profile(key: str, _table: LazyTable) -> dict[str, ColumnProfile]:  # noqa: ARG001 (key はキャッシュキー専用)
+    """データセットごとに一度だけ、DuckDB の近似集約で列プロファイルを作る
+
+    Args:
+        key: アップロード内容のキャッシュキー
+        _table: 対象のLazyTable (キャッシュキーの計算対象から除外)
+
+    Returns:
+        列名 → 列プロファイル
+    """
+    return _table.profile()
+
+
+def get_filter_index(dataset: Dataset) -> FilterIndex:
+    """データセットごとに一度だけフィルター用インデックスを構築する
+
+    Args:
+        dataset: 対象のデータセット
+
+    Returns:
+        列統計と検索用配列を保持したFilterIndex
+    """
+
+    def compute(d: Dataset) -> FilterIndex:
+        profiles = get_profile(d)
+        with st.spinner("フィルター用インデックス構築中…"):
+            return FilterIndex.build(d.df, profiles)
+
+    return get_registry().derived(dataset, "filter_index", compute)
+
+
+def get_cube(dataset: Dataset) -> RollupCube | None:
+    """データセットごとに一度だけ、値選択列 × 日時列の集計キューブを構築する
+
+    Args:
+        dataset: 対象のデータセット
+
+    Returns:
+        集計キューブ。次元にできる列が無ければNone
+    """
+
+    def compute(d: Dataset) -> RollupCube | None:
+        index = get_filter_index(d)
+        with st.spinner("集計キューブ構築中…"):
+            return RollupCube.build(d.df, index)
+
+    return get_registry().derived(dataset, "cube", compute)
+
+
+def display_memory_usage() -> None:
+    """共有データセットとセッションごとの派生結果のメモリ使用量 (プロセス全体) を表示する"""
+    usage = get_registry().usage()
+    with st.expander(f"🗄 メモリ使用量 {usage.total_bytes / MIB:,.1f} / 上限 {usage.budget_bytes / MIB:,.0f} MiB"):
+        st.dataframe(
+            pd.DataFrame(
+                {
+                    "データセット": [d.key[:12] for d in usage.datasets],
+                    "行数": [d.rows for d in usage.datasets],
+                    "MiB": [d.bytes / MIB for d in usage.datasets],
+                    "セッション数": [d.sessions for d in usage.datasets],
+                    "未使用 (秒)": [d.idle_seconds for d in usage.datasets],
+                }
+            ),
+            hide_index=True,
+            use_container_width=True,
+        )
+        sessions = sum(usage.sessions.values())
+        st.caption(
+            f"このセッションの派生結果 {usage.sessions.get(session_id(), 0) / MIB:,.1f} MiB"
+            f" / 全 {len(usage.sessions)} セッション {sessions / MIB:,.1f} MiB"
+            f" / 共有 hit {usage.hits} / 読み込み {usage.loads} (うち退避後の再読み込み {usage.reloads})"
+            f" / 退避 {usage.evictions}"
+        )
+
+
+def search_help(profile: ColumnProfile) -> str:
+    """前方一致検索の入力欄に添える説明 (推定ユニーク数と頻出値)"""
+    text = f"約 {profile.distinct:,} 種類の値があるため、先頭の文字列で絞り込みます。"
+    return text + f"頻出値: {', '.join(v for v, _ in profile.top)}" if profile.top else text
+
+
+def display_profile(profiles: dict[str, ColumnProfile]) -> None:
+    """列プロファイル (近似統計) を表示する"""
+    with st.expander("🧬 列プロファイル (近似)"):
+        st.dataframe(profile_table(profiles), hide_index=True, use_container_width=True)
+        st.caption("ユニーク数・分位点・頻出値は読み込み時に 1 度だけスケッチで近似しています")
+
+
+def apply_filters(index: FilterIndex) -> IncrementalFilter:
     """サイドバーフィルターを適用
 
+    列ごとのマスクはセッションに保持し、ウィジェット値が変わった列だけ再計算する。
+
     Args:
-        df: 元のDataFrame
+        index: 元データから構築したフィルター用インデックス
 
     Returns:
-        フィルター適用後のDataFrame
+        フィルター状態 (select で DataFrame に適用する)
     """
     st.sidebar.header("🔍 フィルター")
-    sel = pd.Series(data=True, index=df.index)
-
-    for col in df.columns:
-        if pd.api.types.is_numeric_dtype(df[col]):
+    state: IncrementalFilter | None = st.session_state.get("incremental_filter")
+    if state is None or state.index is not index:
+        state = IncrementalFilter(index)
+        st.session_state["incremental_filter"] = state
+    state.begin()
+
+    for col, col_index in index.columns.items():
+        if isinstance(col_index, CategoryColumn):
+            opts: list[str] = st.sidebar.multiselect(f"{col} (値選択)", col_index.options)
+            state.update(col, tuple(opts))
+        elif isinstance(col_index, SearchColumn):
+            prefix = st.sidebar.text_input(f"{col} (前方一致検索)", help=search_help(col_index.profile))
+            state.update(col, prefix)
+        elif col_index.kind == "datetime":
+            period = st.sidebar.date_input(
+                f"{col} (期間)",
+                (col_index.to_timestamp(col_index.min), col_index.to_timestamp(col_index.max)),
+            )
+            # 期間の片側だけ選択している間は前回の値を維持する
+            if isinstance(period, tuple) and len(period) == 2:
+                start, end = period
+                # 終了日はその日の終わりまで含める
+                end_exclusive = col_index.from_timestamp(end + datetime.timedelta(days=1))
+                state.update(col, (col_index.from_timestamp(start), end_exclusive - 1))
+        else:
             min_v, max_v = st.sidebar.slider(
                 f"{col} (range)",
-                float(df[col].min()),
-                float(df[col].max()),
-                (float(df[col].min()), float(df[col].max())),
+                col_index.min,
+                col_index.max,
+                (col_index.min, col_index.max),
             )
-            sel &= df[col].between(min_v, max_v)
-        elif pd.api.types.is_datetime64_any_dtype(df[col]):
-            start, end = st.sidebar.date_input(f"{col} (期間)", (df[col].min(), df[col].max()))  # type: ignore[misc]
-            sel &= df[col].between(pd.to_datetime(start), pd.to_datetime(end))
-        else:
-            opts: list[str] = st.sidebar.multiselect(f"{col} (値選択)", df[col].unique().tolist())
-            if opts:
-                sel &= df[col].isin(opts)
+            state.update(col, (min_v, max_v))
 
-    return df[sel]
+    return state
 
 
-def display_kpi_and_charts(df: DataFrame) -> None:
+def apply_lazy_filters(table: LazyTable, profiles: dict[str, ColumnProfile]) -> dict[str, SqlFilterValue]:
+    """サイドバーフィルターのウィジェット値を集める (DuckDB エンジン用)
+
+    Args:
+        table: 対象のLazyTable
+        profiles: 列プロファイル (前方一致検索の説明に使う)
+
+    Returns:
+        列名 → フィルター値 (SQL の WHERE 句に変換する)
+    """
+    st.sidebar.header("🔍 フィルター")
+    filters: dict[str, SqlFilterValue] = {}
+    for col, info in table.columns.items():
+        if info.kind == "category":
+            filters[col] = tuple(st.sidebar.multiselect(f"{col} (値選択)", info.options))
+        elif info.kind == "string":
+            filters[col] = st.sidebar.text_input(f"{col} (前方一致検索)", help=search_help(profiles[col]))
+        elif info.kind == "datetime" and isinstance(info.min, datetime.date) and isinstance(info.max, datetime.date):
+            period = st.sidebar.date_input(f"{col} (期間)", (info.min, info.max))
+            # 期間の片側だけ選択している間は絞り込まない
+            if isinstance(period, tuple) and len(period) == 2:
+                filters[col] = (period[0], period[1])
+        elif info.kind == "numeric" and isinstance(info.min, float) and isinstance(info.max, float):
+            filters[col] = st.sidebar.slider(f"{col} (range)", info.min, info.max, (info.min, info.max))
+    return filters
+
+
+@st.fragment
+def display_grid(df: DataFrame, state: IncrementalFilter) -> None:
+    """フィルター後のデータをページ単位で表示・編集する
+
+    並べ替えとページ分割はサーバー側で行い、表示中のページだけをブラウザに送る。
+    フラグメントなので、並べ替え・ページの操作ではこの関数だけが再実行される。
+
+    Args:
+        df: 元のDataFrame
+        state: フィルター状態
+    """
+    with stage("display_grid"):
+        sort_c, order_c, size_c, page_c = st.columns([3, 1, 1, 1])
+        # インデックスの無い列 (値がすべて欠損の数値列など) は並べ替えても順序が変わらないため選ばせない
+        sort_col = sort_c.selectbox(
+            "並べ替え", [None, *state.index.columns], format_func=lambda c: "(元の順序)" if c is None else c
+        )
+        ascending = order_c.toggle("昇順", value=True)
+        page_size = size_c.selectbox("表示件数", PAGE_SIZES)
+
+        # 並べ替え結果はフィルター・並べ替え条件が変わるまで使い回す
+        signature = (id(state.index), state.version, sort_col, ascending)
+        positions = session_memo(
+            "grid_positions",
+            signature,
+            lambda: sorted_positions(state.index, state.mask(), sort_col, ascending=ascending),
+        )
+
+        n_pages = page_count(len(positions), page_size)
+        page = page_c.number_input(f"ページ (/ {n_pages:,})", min_value=1, max_value=n_pages, value=1)
+        # 編集内容はページ・並べ替え条件ごとのウィジェット状態として保持する
+        st.data_editor(
+            page_frame(df, positions, page, page_size),
+            use_container_width=True,
+            key=f"grid_{hash(signature)}_{page_size}_{page}",
+        )
+    fragment_timing("display_grid")
+
+
+def binned_chart(hist: DataFrame, title: str) -> alt.Chart:
+    """サーバー側で集計したヒストグラム (bin_start / bin_end / count) の棒グラフ"""
+    chart: alt.Chart = (
+        alt.Chart(hist)
+        .mark_bar()
+        .encode(
+            x=alt.X("bin_start:Q", bin="binned", title=title),
+            x2="bin_end:Q",
+            y=alt.Y("count:Q", title="Count of Records"),
+        )
+        .properties(height=300)
+    )
+    return chart
+
+
+@st.fragment
+def display_kpi_and_charts(df: DataFrame, signature: object) -> None:
     """KPIとチャートを表示
 
+    行数が RAW_CHART_MAX_ROWS を超える場合は、ヒストグラムをサーバー側で集計して
+    ビン境界と件数だけをブラウザに送る。フラグメントなので、チャート対象列の変更ではこの関数だけが再実行される。
+
     Args:
         df: 表示対象のDataFrame
+        signature: df を決める入力 (フィルターの版)。同じ間は集計結果を使い回す
     """
     numeric_cols = df.select_dtypes("number").columns.tolist()
     if not numeric_cols:
         return
 
-    # KPI表示
-    kpi1, kpi2, kpi3 = st.columns(3)
-    kpi1.metric("行数", len(df))
-    kpi2.metric("数値列", len(numeric_cols))
-    kpi3.metric("合計", df[numeric_cols[0]].sum())
+    with stage("display_kpi_and_charts") as t:
+        # KPI表示 (合計はフィルター結果が変わるまで使い回す)
+        kpi1, kpi2, kpi3 = st.columns(3)
+        kpi1.metric("行数", len(df))
+        kpi2.metric("数値列", len(numeric_cols))
+        kpi3.metric("合計", session_memo("kpi_sum", signature, lambda: column_sum(df[numeric_cols[0]])))
+
+        # チャート表示
+        chart_col = st.selectbox("チャート対象列", numeric_cols)
+        if len(df) <= RAW_CHART_MAX_ROWS:
+            chart = (
+                alt.Chart(df)
+                .mark_bar()
+                .encode(
+                    x=alt.X(f"{chart_col}:Q", bin=alt.Bin(maxbins=HIST_MAX_BINS)),
+                    y="count()",
+                )
+                .properties(height=300)
+            )
+        else:
+            hist = session_memo("chart_histogram", (signature, chart_col), lambda: histogram(df[chart_col]))
+            chart = binned_chart(hist, chart_col)
+            st.caption(f"{len(df):,} 行をサーバー側で集計して表示しています")
+
+        st.altair_chart(chart, use_container_width=True)
+        t.rows = len(df)
+    fragment_timing("display_kpi_and_charts")
 
-    # チャート表示
-    chart_col = st.selectbox("チャート対象列", numeric_cols)
-    chart = (
-        alt.Chart(df)
-        .mark_bar()
-        .encode(
-            x=alt.X(f"{chart_col}:Q", bin=alt.Bin(maxbins=30)),
-            y="count()",
+
+@st.fragment
+def display_pivot(
+    dimensions: list[str], time_dims: list[str], grains: list[TimeGrain], measures: list[str], rollup: Rollup
+) -> None:
+    """ピボット集計 (行 × 列 の次元ごとに数値列を集計した表) を表示する
+
+    フラグメントなので、次元・集計方法の変更ではこの関数だけが再実行される。
+
+    Args:
+        dimensions: 次元にできる列
+        time_dims: dimensions のうち日時列
+        grains: 日時列で選べる粒度
+        measures: 集計値にできる数値列
+        rollup: 集計結果の表を返す関数
+    """
+    if not dimensions:
+        return
+    with stage("display_pivot") as t:
+        st.subheader("🧮 ピボット集計")
+        row_c, col_c, grain_c, measure_c, agg_c = st.columns(5)
+        row_dim: str = row_c.selectbox("行", dimensions)
+        col_dim: str | None = col_c.selectbox(
+            "列", [None, *(d for d in dimensions if d != row_dim)], format_func=lambda d: "(なし)" if d is None else d
         )
-        .properties(height=300)
+        group_by = [row_dim] if col_dim is None else [row_dim, col_dim]
+        grain: TimeGrain = grain_c.selectbox(
+            "時間の粒度", grains, format_func=GRAINS.__getitem__, disabled=not set(group_by) & set(time_dims)
+        )
+        measure: str | None = measure_c.selectbox(
+            "集計値", [None, *measures], index=1 if measures else 0, format_func=lambda m: "(行数)" if m is None else m
+        )
+        agg: Aggregation = agg_c.selectbox(
+            "集計方法", list(AGGREGATIONS) if measure else ["count"], format_func=AGGREGATIONS.__getitem__
+        )
+        long, note = rollup(group_by, grain, measure, agg)
+        if col_dim is None:
+            table = long.set_index(row_dim)
+        else:
+            # 組み合わせごとに 1 行なので集計はせず並べ替えるだけ
+            table = long.pivot_table(VALUE_COLUMN, index=row_dim, columns=col_dim, aggfunc="first", dropna=False)
+        st.dataframe(table, use_container_width=True)
+        st.caption(note)
+        t.rows = len(long)
+    fragment_timing("display_pivot")
+
+
+def display_cube_pivot(cube: RollupCube, df: DataFrame, state: IncrementalFilter, signature: object) -> None:
+    """集計キューブからピボット集計を表示する
+
+    サイドバーのフィルターがすべてキューブの次元 (値選択列・日単位などバケット境界にそろった期間) に対する
+    ものなら、行を走査せずキューブのセルだけを集計する。それ以外のフィルターがある場合は、フィルター後の行で
+    同じ次元のキューブを作り直し (フィルターが変わるまで使い回す)、そこから集計する。
+
+    Args:
+        cube: データセット全体の集計キューブ
+        df: 元のDataFrame
+        state: フィルター状態
+        signature: フィルター結果を決める入力 (フィルターの版)
+    """
+
+    def rollup(group_by: list[str], grain: TimeGrain, measure: str | None, agg: Aggregation) -> tuple[DataFrame, str]:
+        filters = state.active()
+        if cube.supports(filters):
+            result = cube.query(group_by, grain=grain, measure=measure, agg=agg, filters=filters)
+            return result, f"集計キューブ ({cube.rows.size:,} セル) から集計しています (行は走査していません)"
+        filtered = session_memo("filtered_cube", signature, lambda: cube.restrict(df, state.index, state.positions()))
+        result = filtered.query(group_by, grain=grain, measure=measure, agg=agg, filters={})
+        return result, (
+            "キューブの次元以外のフィルター (欠損を除く範囲指定を含む) があるため、"
+            "フィルター後の行でキューブを作り直して集計しています"
+        )
+
+    time_dim = cube.time_dimension
+    display_pivot(
+        [d.name for d in cube.dimensions],
+        [time_dim.name] if time_dim else [],
+        time_dim.grains if time_dim else ["day"],
+        cube.measures,
+        rollup,
     )
 
-    st.altair_chart(chart, use_container_width=True)
 
+def slider_period(start: pd.Timestamp, end: pd.Timestamp) -> Period:
+    """最初と最後の日時を、秒単位に丸めた日時スライダーの両端にする (範囲を狭めない向きに丸める)"""
+    return start.floor("s").to_pydatetime(), end.ceil("s").to_pydatetime()
+
+
+@st.fragment
+def display_timeseries(time_cols: list[str], value_cols: list[str], bounds: TimeBounds, query: TimeSeriesQuery) -> None:
+    """日時列 × 数値列の時系列チャートを表示する
+
+    点数の上限を超える系列はサーバー側で間引き、表示期間を狭めると同じ点数でその期間を細かく描き直す。
+    フラグメントなので、列・期間・間引き方式の変更ではこの関数だけが再実行される。
+
+    Args:
+        time_cols: 日時列
+        value_cols: 数値列
+        bounds: フィルター後の日時の範囲を返す関数
+        query: 間引いた系列を返す関数
+    """
+    if not time_cols or not value_cols:
+        return
+    with stage("display_timeseries") as t:
+        st.subheader("📉 時系列")
+        x_c, y_c, method_c, budget_c = st.columns(4)
+        x_col: str = x_c.selectbox("日時列", time_cols)
+        y_col: str = y_c.selectbox("値の列", value_cols)
+        method: DownsampleMethod = method_c.selectbox(
+            "間引き方式", list(DOWNSAMPLE_METHODS), format_func=DOWNSAMPLE_METHODS.__getitem__
+        )
+        budget = int(
+            budget_c.number_input(
+                "点数の上限",
+                min_value=TIMESERIES_MIN_POINTS,
+                max_value=TIMESERIES_MAX_POINTS,
+                value=min(max(settings.csv_timeseries_max_points, TIMESERIES_MIN_POINTS), TIMESERIES_MAX_POINTS),
+                step=TIMESERIES_MIN_POINTS,
+            )
+        )
+        span = bounds(x_col)
+        if span is None:
+            st.info("フィルター後の行に日時がありません")
+            return
+        start, end = span
+        period = span
+        if start < end:
+            # 表示範囲が変わったら (フィルター・列の変更) 期間の選択をリセットする
+            period = st.slider(
+                "表示期間 (狭めるほど細かく表示します)",
+                min_value=start,
+                max_value=end,
+                value=span,
+                step=max((end - start) / 1_000, datetime.timedelta(seconds=1)),
+                key=f"timeseries_period_{x_col}_{start}_{end}",
+            )
+        points, n_rows = query(x_col, y_col, period, budget, method)
+        chart = (
+            alt.Chart(points)
+            .mark_line()
+            .encode(x=alt.X(f"{x_col}:T", title=x_col), y=alt.Y(f"{y_col}:Q", title=y_col), tooltip=[x_col, y_col])
+            .properties(height=300)
+        )
+        st.altair_chart(chart, use_container_width=True)
+        st.caption(
+            f"表示期間内の {n_rows:,} 行を {len(points):,} 点に間引いて表示しています ({DOWNSAMPLE_METHODS[method]})"
+        )
+        t.rows = n_rows
+    fragment_timing("display_timeseries")
+
+
+def display_frame_timeseries(df: DataFrame, state: IncrementalFilter, signature: object) -> None:
+    """フィルター後の行から時系列チャートを表示する (pandas エンジン用)
+
+    日時の順序はフィルター用インデックスのソート済み配列から取り出すため、行を並べ替えない。
+    日時順の行位置はフィルターが変わるまで、間引いた系列はフィルター・列・期間・点数・方式が変わるまで使い回す。
 
-def enable_download(df: DataFrame) -> None:
+    Args:
+        df: 元のDataFrame
+        state: フィルター状態
+        signature: フィルター結果を決める入力 (フィルターの版)
+    """
+    index = state.index
+    time_cols = [c for c, i in index.columns.items() if isinstance(i, RangeColumn) and i.kind == "datetime"]
+    value_cols = df.select_dtypes("number").columns.tolist()
+
+    def ordered(x_col: str) -> tuple[RangeColumn, np.ndarray, np.ndarray]:
+        col = cast("RangeColumn", index.columns[x_col])
+        x, positions = session_memo("timeseries_order", (signature, x_col), lambda: time_order(col, state.mask()))
+        return col, x, positions
+
+    def bounds(x_col: str) -> Period | None:
+        col, x, _ = ordered(x_col)
+        return slider_period(col.to_timestamp(x[0]), col.to_timestamp(x[-1])) if len(x) else None
+
+    def compute(x_col: str, y_col: str, period: Period, budget: int, method: DownsampleMethod) -> tuple[DataFrame, int]:
+        col, x, positions = ordered(x_col)
+        i = int(np.searchsorted(x, col.from_timestamp(period[0]), side="left"))
+        j = int(np.searchsorted(x, col.from_timestamp(period[1]), side="right"))
+        y = df[y_col].iloc[positions[i:j]].to_numpy(dtype=np.float64, na_value=np.nan)
+        xs, ys = downsample(x[i:j], y, budget, method)
+        return timeseries_frame(xs, ys, (x_col, y_col), col.unit), j - i
+
+    def query(x_col: str, y_col: str, period: Period, budget: int, method: DownsampleMethod) -> tuple[DataFrame, int]:
+        key = (signature, x_col, y_col, period, budget, method)
+        return session_memo("timeseries", key, lambda: compute(x_col, y_col, period, budget, method))
+
+    display_timeseries(time_cols, value_cols, bounds, query)
+
+
+@st.fragment
+def display_lazy_grid(table: LazyTable, filters: dict[str, SqlFilterValue], n_rows: int) -> None:
+    """フィルター後のデータをページ単位で表示・編集する (DuckDB エンジン用)
+
+    並べ替えとページ分割は SQL の ORDER BY / LIMIT で行い、表示中のページだけを読み込む。
+    フラグメントなので、並べ替え・ページの操作ではこの関数だけが再実行される。
+
+    Args:
+        table: 対象のLazyTable
+        filters: 列名 → フィルター値
+        n_rows: フィルター後の行数
+    """
+    with stage("duckdb.display_grid"):
+        sort_c, order_c, size_c, page_c = st.columns([3, 1, 1, 1])
+        columns = list(table.columns)
+        sort_col = sort_c.selectbox(
+            "並べ替え", [None, *columns], format_func=lambda c: "(元の順序)" if c is None else c
+        )
+        ascending = order_c.toggle("昇順", value=True)
+        page_size = size_c.selectbox("表示件数", PAGE_SIZES)
+        n_pages = page_count(n_rows, page_size)
+        page = page_c.number_input(f"ページ (/ {n_pages:,})", min_value=1, max_value=n_pages, value=1)
+        signature = (tuple(filters.items()), sort_col, ascending)
+        st.data_editor(
+            table.page(filters, sort_col, ascending=ascending, page=page, page_size=page_size),
+            use_container_width=True,
+            key=f"lazy_grid_{hash(signature)}_{page_size}_{page}",
+        )
+    fragment_timing("duckdb.display_grid")
+
+
+@st.fragment
+def display_lazy_kpi_and_charts(
+    table: LazyTable, filters: dict[str, SqlFilterValue], n_rows: int, total: float
+) -> None:
+    """KPIとチャートを表示 (DuckDB エンジン用。ヒストグラムは常に SQL で集計する)
+
+    フラグメントなので、チャート対象列の変更ではこの関数だけが再実行される。
+
+    Args:
+        table: 対象のLazyTable
+        filters: 列名 → フィルター値
+        n_rows: フィルター後の行数
+        total: フィルター後の先頭の数値列の合計
+    """
+    numeric_cols = table.numeric_columns
+    if not numeric_cols:
+        return
+    with stage("duckdb.display_kpi_and_charts") as t:
+        kpi1, kpi2, kpi3 = st.columns(3)
+        kpi1.metric("行数", n_rows)
+        kpi2.metric("数値列", len(numeric_cols))
+        kpi3.metric("合計", total)
+        chart_col = st.selectbox("チャート対象列", numeric_cols)
+        signature = (table.path, tuple(filters.items()), chart_col)
+        hist = session_memo("lazy_chart_histogram", signature, lambda: table.histogram(chart_col, filters))
+        st.altair_chart(binned_chart(hist, chart_col), use_container_width=True)
+        st.caption(f"{n_rows:,} 行を DuckDB で集計して表示しています")
+        t.rows = n_rows
+    fragment_timing("duckdb.display_kpi_and_charts")
+
+
+def explore_lazy(key: str, csv_file: io.BytesIO) -> None:
+    """DuckDB エンジンで読み込み・フィルター・表示を行う
+
+    DataFrame 全体は作らず、ページ・集計結果・ダウンロード時のフィルター結果だけをメモリに読み込む。
+
+    Args:
+        key: アップロード内容のキャッシュキー
+        csv_file: CSVファイルのバイトストリーム
+    """
+    with stage("duckdb.load_data") as t:
+        table = load_lazy_table(key, csv_file)
+        if not table.path.exists():
+            # 開いている間は pin しているが、キャッシュを共有する別プロセスに消されていたら変換し直す
+            load_lazy_table.clear(key, csv_file)
+            table = load_lazy_table(key, csv_file)
+        t.rows = table.n_rows
+    st.success(f"✅ 読込完了 - {table.n_rows:,} rows * {len(table.columns)} cols")
+    cache_stats = get_parquet_cache().stats()
+    st.caption(
+        f"Parquet キャッシュ: hit {cache_stats.hits} / miss {cache_stats.misses}"
+        f" ({cache_stats.entries} files, {cache_stats.bytes / MIB:,.1f} MiB) / engine: duckdb"
+    )
+    st.dataframe(table.head())
+    with stage("duckdb.profile"):
+        profiles = get_lazy_profile(key, table)
+    display_profile(profiles)
+
+    with stage("duckdb.apply_filters") as t:
+        filters = apply_lazy_filters(table, profiles)
+        numeric_cols = table.numeric_columns
+        n_rows, total = session_memo(
+            "lazy_summary",
+            (table.path, tuple(filters.items())),
+            lambda: table.summary(filters, numeric_cols[0] if numeric_cols else None),
+        )
+        t.rows = n_rows
+    st.subheader(f"📈 フィルタ後 {n_rows:,} rows")
+    display_lazy_grid(table, filters, n_rows)
+    display_lazy_kpi_and_charts(table, filters, n_rows, total)
+
+    # ピボット集計 (DuckDB が GROUP BY でフィルター後の行から集計する)
+    def rollup(group_by: list[str], grain: TimeGrain, measure: str | None, agg: Aggregation) -> tuple[DataFrame, str]:
+        signature = (table.path, tuple(filters.items()), tuple(group_by), grain, measure, agg)
+        result = session_memo(
+            "lazy_pivot", signature, lambda: table.rollup(filters, group_by, grain=grain, measure=measure, agg=agg)
+        )
+        return result, "DuckDB の GROUP BY でフィルター後の行から集計しています"
+
+    dimensions = table.rollup_dimensions
+    time_dims = [d for d in dimensions if table.columns[d].kind == "datetime"]
+    display_pivot(dimensions, time_dims, list(GRAINS), table.numeric_columns, rollup)
+
+    # 時系列チャート (DuckDB が区間ごとに 4 点へ縮めた系列を、さらに点数の上限まで間引く)
+    def bounds(x_col: str) -> Period | None:
+        span = session_memo(
+            "lazy_timeseries_bounds",
+            (table.path, tuple(filters.items()), x_col),
+            lambda: table.time_range(filters, x_col),
+        )
+        return slider_period(pd.Timestamp(span[0]), pd.Timestamp(span[1])) if span else None
+
+    def compute(x_col: str, y_col: str, period: Period, budget: int, method: DownsampleMethod) -> tuple[DataFrame, int]:
+        x, y, n_rows = table.timeseries(filters, x_col, y_col, period, n_buckets=budget)
+        xs, ys = downsample(x, y, budget, method)
+        return timeseries_frame(xs, ys, (x_col, y_col), "us"), n_rows
+
+    def query(x_col: str, y_col: str, period: Period, budget: int, method: DownsampleMethod) -> tuple[DataFrame, int]:
+        key = (table.path, tuple(filters.items()), x_col, y_col, period, budget, method)
+        return session_memo("lazy_timeseries", key, lambda: compute(x_col, y_col, period, budget, method))
+
+    display_timeseries(time_dims, table.numeric_columns, bounds, query)
+    # フィルター結果はボタンが押されたときにだけ、チャンク単位で読み出す
+    enable_download(lambda: table.iter_frames(filters))
+
+
+@st.fragment
+def enable_download(fetch: Callable[[], DataFrame | Iterable[DataFrame]]) -> None:
     """フィルター後のデータをダウンロード可能にする
 
+    ファイルはボタンが押されたときにだけ、チャンク単位で生成する。
+    フラグメントなので、形式の変更ではこの関数だけが再実行される。
+
     Args:
-        df: ダウンロード対象のDataFrame
+        fetch: ダウンロード対象のDataFrame (またはそのチャンク列) を返す関数
     """
-    csv = df.to_csv(index=False).encode()
-    st.download_button("⬇️ フィルタ後 CSV をダウンロード", csv, "filtered.csv", "text/csv")
+    fmt: ExportFormat = st.selectbox(
+        "ダウンロード形式", list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f].label
+    )
+    spec = EXPORT_FORMATS[fmt]
+    st.download_button(
+        f"⬇️ フィルタ後 {spec.label} をダウンロード",
+        metrics.timed("csv_dashboard.export")(lambda: export_file(fetch(), fmt)),
+        f"filtered{spec.suffix}",
+        spec.mime,
+        on_click="ignore",
+    )
 
 
 def main() -> None:
-    """メイン処理"""
+    """メイン処理
+
+    フィルターの変更はページ全体を再実行し、表・チャート・ダウンロードの操作はそれぞれのフラグメントだけを再実行する。
+    """
+    start = time.perf_counter()
     setup_page()
+    start_metrics()
+    # ページ全体の実行ごとに内訳をリセットする (フラグメント単独の再実行ではここを通らない)
+    st.session_state["run_id"] = st.session_state.get("run_id", 0) + 1
+    st.session_state["run_timings"] = {}
+    engine = select_engine()
 
     # CSVファイルの読み込み
     csv_file = upload_csv()
@@ -143,20 +937,70 @@ def main() -> None:
         return
 
     # データの読み込みと表示
-    raw_df = load_data(csv_file)
+    key = upload_key(csv_file)
+    if engine == "duckdb":
+        explore_lazy(key, csv_file)
+    else:
+        explore(key, csv_file)
+    seconds = time.perf_counter() - start
+    st.session_state["full_run_seconds"] = seconds
+    display_timings(seconds)
+
+
+def explore(key: str, csv_file: io.BytesIO) -> None:
+    """pandas エンジンで読み込み・フィルター・表示を行う
+
+    Args:
+        key: アップロード内容のキャッシュキー
+        csv_file: CSVファイルのバイトストリーム
+    """
+    # キャッシュ済みなら即座に返るため、ここでの所要時間はキャッシュ込みの読み込み時間になる
+    with stage("load_data") as t:
+        dataset = load_data(key, csv_file)
+        raw_df, report = dataset.df, dataset.report
+        t.rows = len(raw_df)
     st.success(f"✅ 読込完了 - {len(raw_df):,} rows * {len(raw_df.columns)} cols")
+    st.caption(
+        f"メモリ {report.memory_bytes / MIB:,.1f} MiB"
+        f" (従来比 -{report.saved_bytes / MIB:,.1f} MiB) / ピーク RSS {report.peak_rss_bytes / MIB:,.1f} MiB"
+        f" / engine: {report.engine}"
+    )
+    cache_stats = get_columnar_cache().stats()
+    st.caption(
+        f"列指向キャッシュ: hit {cache_stats.hits} / miss {cache_stats.misses}"
+        f" ({cache_stats.entries} files, {cache_stats.bytes / MIB:,.1f} MiB)"
+    )
     st.dataframe(raw_df.head())
-
-    # フィルター適用
-    filtered_df = apply_filters(raw_df)
+    with stage("profile") as t:
+        profiles = get_profile(dataset)
+        t.rows = len(raw_df)
+    display_profile(profiles)
+
+    # フィルター適用 (フィルター結果は値が変わった場合だけ作り直す)
+    with stage("apply_filters") as t:
+        state = apply_filters(get_filter_index(dataset))
+        signature = (id(state.index), state.version)
+        filtered_df = session_memo("filtered_df", signature, lambda: state.select(raw_df))
+        t.rows = len(filtered_df)
     st.subheader(f"📈 フィルタ後 {len(filtered_df):,} rows")
-    st.data_editor(filtered_df, use_container_width=True)
+    display_grid(raw_df, state)
 
     # KPIとチャートの表示
-    display_kpi_and_charts(filtered_df)
+    display_kpi_and_charts(filtered_df, signature)
+
+    # ピボット集計 (データセットごとの集計キューブから求める)
+    with stage("cube") as t:
+        cube = get_cube(dataset)
+        t.rows = len(raw_df)
+    if cube is not None:
+        display_cube_pivot(cube, raw_df, state, signature)
+
+    # 時系列チャート (フィルター後の行を点数の上限まで間引く)
+    display_frame_timeseries(raw_df, state, signature)
 
     # ダウンロード機能
-    enable_download(filtered_df)
+    enable_download(lambda: filtered_df)
+    display_memory_usage()
 
 
 if __name__ == "__main__":
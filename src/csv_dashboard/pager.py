@@ -0,0 +1,107 @@
+"""
+ページング表示 : フィルター済みの行位置をサーバー側で並べ替え、表示中のページだけを切り出す
+"""
+
+import math
+
+import numpy as np
+from pandas import DataFrame
+
+from src.csv_dashboard.filter_index import CategoryColumn, FilterIndex, SearchColumn
+
+# 1 ページあたりの行数の選択肢
+PAGE_SIZES = (50, 100, 500, 1_000)
+
+
+def sorted_positions(
+    index: FilterIndex, mask: np.ndarray | None, sort_col: str | None, *, ascending: bool
+) -> np.ndarray:
+    """フィルター後の行位置を sort_col の順に並べて返す
+
+    範囲列はインデックス構築時のソート順を mask で間引くだけなので並べ替え自体は行わない
+    (降順では同じ値が続く区間だけを反転し直し、同じ値の行は元の行順のまま残す)。
+    値選択列は選択肢の辞書順に対応した小さな整数コードを安定ソートする。
+    前方一致検索の列 (高カーディナリティの文字列) はフィルター後の行の値をそのまま並べ替える。欠損は常に末尾に置く。
+
+    Args:
+        index: 元データのフィルター用インデックス
+        mask: フィルター結果のマスク (絞り込み無しならNone)
+        sort_col: 並べ替える列 (None なら元の行順)
+        ascending: 昇順かどうか
+
+    Returns:
+        並べ替えた元データ上の行位置
+    """
+    if sort_col is None or sort_col not in index.columns:
+        return np.arange(index.n_rows) if mask is None else np.flatnonzero(mask)
+
+    col_index = index.columns[sort_col]
+    if isinstance(col_index, CategoryColumn):
+        positions = np.arange(index.n_rows) if mask is None else np.flatnonzero(mask)
+        # コード → 辞書順の順位。末尾の要素は欠損 (-1) 用で常に最後
+        n_options = len(col_index.options)
+        rank = np.empty(n_options + 1, dtype=np.int64)
+        rank[np.argsort(col_index.options, kind="stable")] = np.arange(n_options)
+        rank[-1] = n_options
+        if not ascending:
+            rank[:-1] = n_options - 1 - rank[:-1]
+        keys = rank[col_index.codes[positions]]
+        return positions[np.argsort(keys, kind="stable")]
+
+    if isinstance(col_index, SearchColumn):
+        positions = np.arange(index.n_rows) if mask is None else np.flatnonzero(mask)
+        values = col_index.series.iloc[positions].reset_index(drop=True)
+        ranks = values.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+        result: np.ndarray = positions[ranks]
+        return result
+
+    order, missing, sorted_values = col_index.order, col_index.missing, col_index.sorted_values
+    if mask is not None:
+        kept = mask[order]
+        order, missing, sorted_values = order[kept], missing[mask[missing]], sorted_values[kept]
+    if not ascending:
+        order = _reverse_keeping_ties(order, sorted_values)
+    return np.concatenate([order, missing])
+
+
+def _reverse_keeping_ties(order: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """昇順の order を降順にする。同じ値の行は元の行順のまま残す (安定な降順ソート)
+
+    Args:
+        order: 値の昇順 (同じ値の中では元の行順) に並んだ行位置
+        values: order に対応する値 (昇順)
+
+    Returns:
+        降順に並べた行位置
+    """
+    reversed_order, reversed_values = order[::-1], values[::-1]
+    n = len(reversed_order)
+    if n == 0:
+        return reversed_order
+    # 同じ値が続く区間 [starts, ends) ごとに、区間内の並びだけをもう一度反転する
+    starts = np.flatnonzero(np.r_[True, reversed_values[1:] != reversed_values[:-1]])
+    ends = np.r_[starts[1:], n]
+    run = np.repeat(np.arange(len(starts)), ends - starts)
+    result: np.ndarray = reversed_order[starts[run] + ends[run] - 1 - np.arange(n)]
+    return result
+
+
+def page_count(n_rows: int, page_size: int) -> int:
+    """ページ数 (0 行でも 1 ページとする)"""
+    return max(math.ceil(n_rows / page_size), 1)
+
+
+def page_frame(df: DataFrame, positions: np.ndarray, page: int, page_size: int) -> DataFrame:
+    """positions のうち page ページ目 (1 始まり) の行だけを切り出す
+
+    Args:
+        df: 元のDataFrame
+        positions: 表示順に並べた行位置
+        page: ページ番号 (1 始まり)
+        page_size: 1 ページあたりの行数
+
+    Returns:
+        表示するページのDataFrame (元の行ラベルを保持)
+    """
+    start = (page - 1) * page_size
+    return df.iloc[positions[start : start + page_size]]
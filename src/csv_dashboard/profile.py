@@ -0,0 +1,143 @@
+"""
+列プロファイル : 読み込み時に 1 パスでユニーク数・分位点・頻出値を近似し、フィルターのウィジェットの種類を決める
+
+ユニーク集合を作らずにスケッチ (src.libs.sketches) で近似するため、ID・URL のような
+高カーディナリティの列でも時間とメモリが列の件数に比例する程度で済む。
+"""
+
+from dataclasses import dataclass
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from src.libs.sketches import HeavyHitters, HyperLogLog, QuantileSketch
+
+type ProfileKind = Literal["numeric", "datetime", "text"]
+
+# 1 回にスケッチへ渡す行数
+CHUNK_ROWS = 1_000_000
+# ユニーク数 (推定) がこれを超える列は、値選択ではなく前方一致検索で絞り込む
+SEARCH_MIN_DISTINCT = 1_000
+# プロファイルに表示する分位
+QUANTILES = (0.0, 0.25, 0.5, 0.75, 1.0)
+# プロファイルに表示する頻出値の件数
+TOP_K = 5
+
+
+@dataclass(frozen=True, slots=True)
+class ColumnProfile:
+    """列ごとの近似統計"""
+
+    name: str
+    kind: ProfileKind
+    dtype: str
+    count: int
+    nulls: int
+    # ユニーク数の推定値
+    distinct: int
+    # 数値・日時列の QUANTILES の推定値 (日時列は unit 単位のエポック値)
+    quantiles: tuple[float, ...] = ()
+    # 文字列・カテゴリ列の 2 回以上出現した頻出値と推定回数 (回数は実際より少なく出ることがある)
+    top: tuple[tuple[str, int], ...] = ()
+    unit: str = "ns"
+
+    @property
+    def searchable(self) -> bool:
+        """選択肢を列挙せず前方一致検索で絞り込む列か"""
+        return self.kind == "text" and self.distinct > SEARCH_MIN_DISTINCT
+
+    @property
+    def filter_label(self) -> str:
+        """サイドバーでの絞り込み方法"""
+        if self.kind == "text":
+            return "前方一致検索" if self.searchable else "値選択"
+        return "期間" if self.kind == "datetime" else "範囲"
+
+    def quantile_labels(self) -> list[str]:
+        """分位点の表示用文字列"""
+        if self.kind == "datetime":
+            return [str(pd.Timestamp(int(v), unit=self.unit).floor("s")) for v in self.quantiles if not np.isnan(v)]
+        return [f"{v:,.4g}" for v in self.quantiles if not np.isnan(v)]
+
+
+def _kind(s: Series) -> ProfileKind:
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return "datetime"
+    # 真偽値はフィルター (FilterIndex) と同じく 0 / 1 の数値として扱う
+    if pd.api.types.is_numeric_dtype(s):
+        return "numeric"
+    return "text"
+
+
+def _numeric_values(s: Series) -> np.ndarray:
+    """分位点スケッチに渡す float 配列 (日時はエポック値、欠損は NaN)"""
+    if pd.api.types.is_datetime64_any_dtype(s):
+        values: np.ndarray = s.array.asi8.astype(np.float64)
+        values[s.isna().to_numpy()] = np.nan
+        return values
+    return s.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def profile_frame(df: DataFrame, chunk_rows: int = CHUNK_ROWS) -> dict[str, ColumnProfile]:
+    """DataFrame を chunk_rows 行ずつ 1 度だけ走査し、列ごとの近似統計を求める
+
+    Args:
+        df: 対象のDataFrame
+        chunk_rows: 1 回にスケッチへ渡す行数
+
+    Returns:
+        列名 → 列プロファイル
+    """
+    profiles: dict[str, ColumnProfile] = {}
+    for col in df.columns:
+        s = df[col]
+        kind = _kind(s)
+        distinct = HyperLogLog()
+        quantiles = QuantileSketch() if kind != "text" else None
+        top = HeavyHitters() if kind == "text" else None
+        nulls = 0
+        for start in range(0, len(s), chunk_rows):
+            chunk = s.iloc[start : start + chunk_rows]
+            nulls += int(chunk.isna().sum())
+            distinct.update(chunk)
+            if quantiles is not None:
+                quantiles.update(_numeric_values(chunk))
+            if top is not None:
+                top.update(chunk)
+        profiles[col] = ColumnProfile(
+            name=col,
+            kind=kind,
+            dtype=str(s.dtype),
+            count=len(s) - nulls,
+            nulls=nulls,
+            # 推定誤差でユニーク数が件数を超えないようにする
+            distinct=min(distinct.estimate(), len(s) - nulls),
+            quantiles=quantiles.quantiles(QUANTILES) if quantiles is not None else (),
+            top=tuple((v, n) for v, n in top.top(TOP_K) if n > 1) if top is not None else (),
+            unit=s.dt.unit if kind == "datetime" else "ns",
+        )
+    return profiles
+
+
+def profile_table(profiles: dict[str, ColumnProfile]) -> DataFrame:
+    """プロファイルを表示用の表にする
+
+    Args:
+        profiles: 列名 → 列プロファイル
+
+    Returns:
+        1 列 1 行の表
+    """
+    return pd.DataFrame(
+        {
+            "列": [p.name for p in profiles.values()],
+            "型": [p.dtype for p in profiles.values()],
+            "欠損": [p.nulls for p in profiles.values()],
+            "ユニーク数 (推定)": [p.distinct for p in profiles.values()],
+            "最小 / 四分位 / 最大 (推定)": [" / ".join(p.quantile_labels()) for p in profiles.values()],
+            "頻出値 (推定回数)": [", ".join(f"{v} ({n:,})" for v, n in p.top) for p in profiles.values()],
+            "絞り込み": [p.filter_label for p in profiles.values()],
+        }
+    )
@@ -0,0 +1,556 @@
+"""
+DuckDB エンジン : 取り込んだ CSV を Parquet で保存し、フィルター・集計・ページングを SQL で実行して結果だけを取り出す
+
+DataFrame 全体をメモリに載せず、DuckDB が Parquet を列・行グループ単位で読みながらマルチスレッドで処理する。
+メモリ上限を超える中間結果は一時ディレクトリへ書き出されるため、メモリより大きなファイルも扱える。
+duckdb は任意依存 (``uv sync --extra duckdb``) で、インストールされていなければ pandas エンジンだけを使う。
+"""
+
+import datetime
+import importlib.util
+import shutil
+import tempfile
+import weakref
+from collections.abc import Iterator, Mapping, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Literal, cast
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from src.csv_dashboard.charts import HIST_MAX_BINS, nice_bin_edges
+from src.csv_dashboard.cube import MISSING_LABEL, VALUE_COLUMN, Aggregation, TimeGrain
+from src.csv_dashboard.ingest import CATEGORY_MAX_RATIO, CATEGORY_MAX_UNIQUE
+from src.csv_dashboard.profile import QUANTILES, SEARCH_MIN_DISTINCT, TOP_K, ColumnProfile, ProfileKind
+from src.libs.disk_cache import CacheStats, DiskCache
+from src.libs.export import CHUNK_ROWS
+
+if TYPE_CHECKING:
+    import duckdb
+
+type LazyKind = Literal["numeric", "datetime", "category", "string"]
+# 数値列は (下限, 上限)、日時列は (開始日, 終了日)、値選択列は選択された値、文字列列は前方一致の検索語
+type SqlFilterValue = tuple[float, float] | tuple[datetime.date, datetime.date] | tuple[str, ...] | str
+
+# DuckDB の型名の接頭辞で列の種類を判定する
+_NUMERIC_TYPES = (
+    *("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT"),
+    *("UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT", "UHUGEINT"),
+    *("FLOAT", "DOUBLE", "DECIMAL"),
+)
+_DATETIME_TYPES = ("DATE", "TIMESTAMP")
+
+
+def duckdb_available() -> bool:
+    """duckdb がインストールされているか"""
+    return importlib.util.find_spec("duckdb") is not None
+
+
+def _ident(name: str) -> str:
+    """列名を SQL の識別子として引用符で囲む"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(path: Path) -> str:
+    """パスを SQL の文字列リテラルにする (COPY・テーブル関数の引数はパラメーターにできないため)"""
+    return "'" + str(path).replace("'", "''") + "'"
+
+
+def _connect(memory_limit: str | None, temp_dir: Path) -> "duckdb.DuckDBPyConnection":
+    """インメモリの DuckDB に接続する。メモリ上限を超えた中間結果は temp_dir に書き出す"""
+    import duckdb  # 任意依存のため、使うときにだけ読み込む
+
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    config: dict[str, str | bool | int | float | list[str]] = {"temp_directory": str(temp_dir)}
+    if memory_limit:
+        config["memory_limit"] = memory_limit
+    return duckdb.connect(config=config)
+
+
+def convert_csv(file: IO[bytes], dest: Path, *, memory_limit: str | None, temp_dir: Path) -> None:
+    """CSV を DuckDB で型推定しながら読み込み、zstd 圧縮の Parquet として dest に書き出す
+
+    DuckDB はファイルを並列にストリーミングで読むため、CSV 全体をメモリに載せない。
+
+    Args:
+        file: CSVファイルのバイトストリーム (読み終えたら先頭に戻す)
+        dest: 書き出し先
+        memory_limit: DuckDB のメモリ上限 (例: "4GB"。None なら DuckDB の既定)
+        temp_dir: 一時ファイルの保存先
+    """
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    # アップロードはメモリ上のバイト列なので、DuckDB が並列に読めるよう一時ファイルへ書き出す
+    with tempfile.NamedTemporaryFile(dir=temp_dir, suffix=".csv") as tmp:
+        file.seek(0)
+        shutil.copyfileobj(file, tmp)
+        tmp.flush()
+        file.seek(0)
+        with _connect(memory_limit, temp_dir) as con:
+            source, target = _literal(Path(tmp.name)), _literal(dest)
+            sql = f"COPY (SELECT * FROM read_csv({source})) TO {target} (FORMAT parquet, COMPRESSION zstd)"  # noqa: S608 (パスはリテラルとしてエスケープ済み)
+            con.execute(sql)
+
+
+class ParquetCache:
+    """DuckDB エンジン用に、取り込んだ CSV を Parquet ファイルとして保持するキャッシュ"""
+
+    def __init__(self, root: Path, *, max_bytes: int, memory_limit: str | None = None) -> None:
+        self._store = DiskCache(root, suffix=".parquet", max_bytes=max_bytes)
+        self._memory_limit = memory_limit
+        self._temp_dir = root / "tmp"
+
+    def path(self, key: str, file: IO[bytes]) -> Path:
+        """キャッシュ済みの Parquet ファイルを返す。無ければ file を変換して保存する
+
+        Args:
+            key: content_key で求めたキー
+            file: CSVファイルのバイトストリーム
+
+        Returns:
+            Parquet ファイルのパス
+        """
+        path = self._store.get(key)
+        if path is None:
+            path = self._store.put(
+                key, lambda dest: convert_csv(file, dest, memory_limit=self._memory_limit, temp_dir=self._temp_dir)
+            )
+        return path
+
+    def open(self, key: str, file: IO[bytes]) -> "LazyTable":
+        """キーの Parquet ファイルを (無ければ file を変換して) LazyTable として開く
+
+        開いた LazyTable が参照されている間はファイルを pin し、容量上限による追い出しで
+        問い合わせ中のファイルが消えないようにする。
+
+        Args:
+            key: content_key で求めたキー
+            file: CSVファイルのバイトストリーム
+
+        Returns:
+            Parquet ファイルを参照するLazyTable
+        """
+        # 変換直後の追い出しで自身が消えないよう、保存より前に pin する
+        self._store.pin(key)
+        try:
+            table = LazyTable(self.path(key, file), memory_limit=self._memory_limit, temp_dir=self._temp_dir)
+        except Exception:
+            self._store.unpin(key)
+            raise
+        weakref.finalize(table, self._store.unpin, key)
+        return table
+
+    def stats(self) -> CacheStats:
+        """ヒット・ミス回数と使用容量を返す"""
+        return self._store.stats()
+
+
+@dataclass(frozen=True, slots=True)
+class LazyColumn:
+    """列の種類と、フィルターのウィジェットに使う統計"""
+
+    name: str
+    kind: LazyKind
+    has_nulls: bool
+    # 数値列は float、日時列は日付 (値が無ければNone)
+    min: float | datetime.date | None = None
+    max: float | datetime.date | None = None
+    # 値選択列の選択肢 (辞書順)
+    options: tuple[str, ...] = ()
+    # DuckDB の型名
+    dtype: str = ""
+
+
+class LazyTable:
+    """Parquet ファイルを参照するビュー。問い合わせのたびに必要な列・行だけを読む
+
+    接続はセッション間で共有し、問い合わせごとに cursor を作るためスレッドから同時に呼んでよい。
+    """
+
+    def __init__(self, path: Path, *, memory_limit: str | None, temp_dir: Path) -> None:
+        self.path = path
+        self._con = _connect(memory_limit, temp_dir)
+        self._con.execute(f"CREATE VIEW data AS SELECT * FROM read_parquet({_literal(path)})")  # noqa: S608 (パスはリテラルとしてエスケープ済み)
+        self.n_rows, self.columns = self._describe()
+
+    def _describe(self) -> tuple[int, dict[str, LazyColumn]]:
+        """列ごとの種類・最小値・最大値・選択肢を 1 度だけ集計する"""
+        with self._con.cursor() as cur:
+            schema = [(str(row[0]), str(row[1])) for row in cur.execute("DESCRIBE data").fetchall()]
+            exprs = ["count(*)"]
+            for name, dtype in schema:
+                col = _ident(name)
+                exprs.append(f"count({col})")
+                if dtype.startswith(_NUMERIC_TYPES + _DATETIME_TYPES):
+                    exprs.extend([f"min({col})", f"max({col})"])
+                else:
+                    exprs.append(f"approx_count_distinct({col})")
+            stats = cur.execute(f"SELECT {', '.join(exprs)} FROM data").fetchone()  # noqa: S608 (列名は引用符で囲む)
+            assert stats is not None  # noqa: S101 (集約の結果は必ず 1 行)
+            n_rows = int(stats[0])
+            columns: dict[str, LazyColumn] = {}
+            i = 1
+            for name, dtype in schema:
+                has_nulls = int(stats[i]) < n_rows
+                if dtype.startswith(_NUMERIC_TYPES):
+                    lo, hi = stats[i + 1], stats[i + 2]
+                    columns[name] = LazyColumn(
+                        name,
+                        "numeric",
+                        has_nulls,
+                        None if lo is None else float(lo),
+                        None if hi is None else float(hi),
+                        dtype=dtype,
+                    )
+                    i += 3
+                elif dtype.startswith(_DATETIME_TYPES):
+                    lo, hi = stats[i + 1], stats[i + 2]
+                    columns[name] = LazyColumn(name, "datetime", has_nulls, _to_date(lo), _to_date(hi), dtype=dtype)
+                    i += 3
+                else:
+                    n_unique = int(stats[i + 1])
+                    is_low_cardinality = n_unique <= CATEGORY_MAX_RATIO * max(n_rows, 1)
+                    # 選択肢が多すぎる列は前方一致検索 (string) で絞り込む
+                    if is_low_cardinality and n_unique <= min(CATEGORY_MAX_UNIQUE, SEARCH_MIN_DISTINCT):
+                        col = _ident(name)
+                        sql = f"SELECT DISTINCT CAST({col} AS VARCHAR) FROM data WHERE {col} IS NOT NULL ORDER BY 1"  # noqa: S608 (列名は引用符で囲む)
+                        options = tuple(str(row[0]) for row in cur.execute(sql).fetchall())
+                        columns[name] = LazyColumn(name, "category", has_nulls, options=options, dtype=dtype)
+                    else:
+                        columns[name] = LazyColumn(name, "string", has_nulls, dtype=dtype)
+                    i += 2
+        return n_rows, columns
+
+    @property
+    def numeric_columns(self) -> list[str]:
+        """数値列の列名"""
+        return [name for name, c in self.columns.items() if c.kind == "numeric"]
+
+    def _where(self, filters: Mapping[str, SqlFilterValue]) -> tuple[str, list[object]]:
+        """フィルターを WHERE 句とパラメーターに変換する
+
+        pandas エンジン (FilterIndex) と同じく、範囲フィルターは欠損値の行を含めない。
+        欠損が無く全範囲が選ばれている列と、何も選ばれていない値選択列・検索語が空の文字列列は条件に加えない。
+        """
+        clauses: list[str] = []
+        params: list[object] = []
+        for name, value in filters.items():
+            info = self.columns[name]
+            col = _ident(name)
+            if info.kind == "category":
+                if value:
+                    clauses.append(f"CAST({col} AS VARCHAR) IN ({', '.join(['?'] * len(value))})")
+                    params.extend(value)
+                continue
+            if info.kind == "string":
+                if value:
+                    clauses.append(f"starts_with(CAST({col} AS VARCHAR), ?)")
+                    params.append(value)
+                continue
+            if info.kind == "datetime":
+                start, end = cast("tuple[datetime.date, datetime.date]", value)
+                if (
+                    not info.has_nulls
+                    and isinstance(info.min, datetime.date)
+                    and isinstance(info.max, datetime.date)
+                    and start <= info.min
+                    and end >= info.max
+                ):
+                    continue
+                # 終了日はその日の終わりまで含める
+                clauses.append(f"{col} >= ? AND {col} < ?")
+                params.extend([start, end + datetime.timedelta(days=1)])
+            else:
+                lo, hi = cast("tuple[float, float]", value)
+                if (
+                    not info.has_nulls
+                    and isinstance(info.min, float)
+                    and isinstance(info.max, float)
+                    and lo <= info.min
+                    and hi >= info.max
+                ):
+                    continue
+                clauses.append(f"{col} BETWEEN ? AND ?")
+                params.extend([lo, hi])
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def profile(self) -> dict[str, ColumnProfile]:
+        """列ごとの近似統計 (profile_frame と同じ項目) を DuckDB の近似集約で求める
+
+        ユニーク数は HyperLogLog (approx_count_distinct)、分位点は T-Digest (approx_quantile)、
+        頻出値は approx_top_k で 1 度の走査で求め、頻出値の件数だけは候補の値に絞って数え直す。
+
+        Returns:
+            列名 → 列プロファイル
+        """
+        exprs: list[str] = []
+        for name, info in self.columns.items():
+            col = _ident(name)
+            exprs.extend([f"count({col})", f"approx_count_distinct({col})"])
+            if info.kind in {"numeric", "datetime"}:
+                value = f"CAST({col} AS DOUBLE)" if info.kind == "numeric" else f"epoch_us({col})"
+                # 両端は近似ではなく正確な最小値・最大値にする
+                quantiles = [
+                    f"min({value})" if q <= 0 else f"max({value})" if q >= 1 else f"approx_quantile({value}, {q})"
+                    for q in QUANTILES
+                ]
+                exprs.append(f"[{', '.join(quantiles)}]")
+            else:
+                exprs.append(f"approx_top_k(CAST({col} AS VARCHAR), {TOP_K})")
+        profiles: dict[str, ColumnProfile] = {}
+        with self._con.cursor() as cur:
+            stats = cur.execute(f"SELECT {', '.join(exprs)} FROM data").fetchone()  # noqa: S608 (列名は引用符で囲む)
+            assert stats is not None  # noqa: S101 (集約の結果は必ず 1 行)
+            for i, (name, info) in enumerate(self.columns.items()):
+                count, distinct, values = int(stats[3 * i]), int(stats[3 * i + 1]), stats[3 * i + 2] or []
+                kind: ProfileKind = info.kind if info.kind in {"numeric", "datetime"} else "text"
+                top: tuple[tuple[str, int], ...] = ()
+                if kind == "text" and values:
+                    # approx_top_k は候補の値だけを返すため、件数は候補に絞って数え直す
+                    col = f"CAST({_ident(name)} AS VARCHAR)"
+                    placeholders = ", ".join(["?"] * len(values))
+                    sql = f"SELECT {col}, count(*) FROM data WHERE {col} IN ({placeholders}) GROUP BY 1"  # noqa: S608 (列名は引用符で囲み、値はパラメーターで渡す)
+                    counts = dict(cur.execute(sql, values).fetchall())
+                    top = tuple(
+                        sorted(
+                            ((str(v), int(counts[v])) for v in values if counts.get(v, 0) > 1), key=lambda vn: -vn[1]
+                        )
+                    )
+                profiles[name] = ColumnProfile(
+                    name=name,
+                    kind=kind,
+                    dtype=info.dtype,
+                    count=count,
+                    nulls=self.n_rows - count,
+                    distinct=min(distinct, count),
+                    quantiles=() if kind == "text" else tuple(float(v) for v in values),
+                    top=top,
+                    # 日時列の分位点は epoch_us で求める
+                    unit="us",
+                )
+        return profiles
+
+    def _fetch_df(self, sql: str, params: Sequence[object]) -> DataFrame:
+        with self._con.cursor() as cur:
+            return cur.execute(sql, params).fetch_arrow_table().to_pandas()  # type: ignore[no-any-return]
+
+    def summary(self, filters: Mapping[str, SqlFilterValue], sum_col: str | None) -> tuple[int, int | float]:
+        """フィルター後の行数と sum_col の合計 (sum_col が None なら 0)
+
+        Args:
+            filters: 列名 → フィルター値
+            sum_col: 合計する数値列
+
+        Returns:
+            (行数, 合計)
+        """
+        where, params = self._where(filters)
+        total = f"sum({_ident(sum_col)})" if sum_col else "0"
+        with self._con.cursor() as cur:
+            row = cur.execute(f"SELECT count(*), {total} FROM data{where}", params).fetchone()  # noqa: S608 (列名は引用符で囲み、値はパラメーターで渡す)
+        assert row is not None  # noqa: S101 (集約の結果は必ず 1 行)
+        value = row[1] or 0
+        return int(row[0]), int(value) if isinstance(value, int) else float(value)
+
+    def histogram(self, col: str, filters: Mapping[str, SqlFilterValue], maxbins: int = HIST_MAX_BINS) -> DataFrame:
+        """フィルター後の数値列のヒストグラム (charts.histogram と同じビン境界・列)
+
+        Args:
+            col: 集計対象の数値列
+            filters: 列名 → フィルター値
+            maxbins: 最大ビン数
+
+        Returns:
+            bin_start / bin_end / count 列を持つビンごとの集計結果
+        """
+        where, params = self._where(filters)
+        value = f"CAST({_ident(col)} AS DOUBLE)"
+        valid = f"{' AND' if where else ' WHERE'} isfinite({value})"
+        with self._con.cursor() as cur:
+            row = cur.execute(f"SELECT min({value}), max({value}) FROM data{where}{valid}", params).fetchone()  # noqa: S608 (列名は引用符で囲み、値はパラメーターで渡す)
+            if row is None or row[0] is None:
+                return pd.DataFrame({"bin_start": [], "bin_end": [], "count": []})
+            edges = nice_bin_edges(float(row[0]), float(row[1]), maxbins)
+            n_bins = len(edges) - 1
+            # 最後のビンだけは右端を含める (np.histogram と同じ)
+            bucket = f"least(CAST(floor(({value} - ?) / ?) AS BIGINT), {n_bins - 1})"
+            sql = f"SELECT {bucket} AS b, count(*) FROM data{where}{valid} GROUP BY b"  # noqa: S608 (列名は引用符で囲み、値はパラメーターで渡す)
+            counts = [0] * n_bins
+            step = float(edges[1] - edges[0])
+            for b, n in cur.execute(sql, [float(edges[0]), step, *params]).fetchall():
+                counts[int(b)] = int(n)
+        return pd.DataFrame({"bin_start": edges[:-1], "bin_end": edges[1:], "count": counts})
+
+    def page(
+        self,
+        filters: Mapping[str, SqlFilterValue],
+        sort_col: str | None,
+        *,
+        ascending: bool,
+        page: int,
+        page_size: int,
+    ) -> DataFrame:
+        """フィルター後の行を sort_col の順に並べた page ページ目 (1 始まり) だけを取り出す
+
+        Args:
+            filters: 列名 → フィルター値
+            sort_col: 並べ替える列 (None なら元の行順)
+            ascending: 昇順かどうか
+            page: ページ番号 (1 始まり)
+            page_size: 1 ページあたりの行数
+
+        Returns:
+            表示するページのDataFrame
+        """
+        where, params = self._where(filters)
+        order = f" ORDER BY {_ident(sort_col)} {'ASC' if ascending else 'DESC'} NULLS LAST" if sort_col else ""
+        sql = f"SELECT * FROM data{where}{order} LIMIT ? OFFSET ?"  # noqa: S608 (列名は引用符で囲み、値はパラメーターで渡す)
+        return self._fetch_df(sql, [*params, page_size, (page - 1) * page_size])
+
+    @property
+    def rollup_dimensions(self) -> list[str]:
+        """ピボット集計の次元にできる列 (値選択列と日時列)"""
+        return [name for name, c in self.columns.items() if c.kind in {"category", "datetime"}]
+
+    def rollup(
+        self,
+        filters: Mapping[str, SqlFilterValue],
+        group_by: Sequence[str],
+        *,
+        grain: TimeGrain,
+        measure: str | None,
+        agg: Aggregation,
+    ) -> DataFrame:
+        """フィルター後の行を group_by の列ごとに GROUP BY で集計する (RollupCube.query と同じ表を返す)
+
+        Args:
+            filters: 列名 → フィルター値
+            group_by: 集計の単位にする列
+            grain: 日時列の粒度
+            measure: 集計する数値列 (None なら行数)
+            agg: 集計方法
+
+        Returns:
+            group_by の列と VALUE_COLUMN 列を持つ表
+        """
+        where, params = self._where(filters)
+        keys: list[str] = []
+        for name in group_by:
+            col = _ident(name)
+            key = _bucket_sql(col, grain) if self.columns[name].kind == "datetime" else f"CAST({col} AS VARCHAR)"
+            keys.append(f"coalesce({key}, ?) AS {col}")
+        if measure is None:
+            value = "count(*)"
+        else:
+            value = {"sum": "sum", "mean": "avg", "count": "count"}[agg] + f"({_ident(measure)})"
+        sql = f"SELECT {', '.join(keys)}, {value} AS {_ident(VALUE_COLUMN)} FROM data{where} GROUP BY ALL ORDER BY ALL"  # noqa: S608 (列名は引用符で囲み、値はパラメーターで渡す)
+        return self._fetch_df(sql, [*[MISSING_LABEL] * len(keys), *params])
+
+    def time_range(
+        self, filters: Mapping[str, SqlFilterValue], col: str
+    ) -> tuple[datetime.datetime, datetime.datetime] | None:
+        """フィルター後の日時列の最初と最後の日時。該当行が無ければNone"""
+        where, params = self._where(filters)
+        x = f"CAST({_ident(col)} AS TIMESTAMP)"
+        with self._con.cursor() as cur:
+            row = cur.execute(f"SELECT min({x}), max({x}) FROM data{where}", params).fetchone()  # noqa: S608 (列名は引用符で囲み、値はパラメーターで渡す)
+        if row is None or row[0] is None:
+            return None
+        return row[0], row[1]
+
+    def timeseries(
+        self,
+        filters: Mapping[str, SqlFilterValue],
+        x_col: str,
+        y_col: str,
+        period: tuple[datetime.datetime, datetime.datetime],
+        n_buckets: int,
+    ) -> tuple[np.ndarray, np.ndarray, int]:
+        """フィルター後・period 内の (日時, 値) の系列を、等幅の n_buckets 個の区間ごとに 4 点へ縮めて取り出す
+
+        区間ごとに最初・最後・最小・最大の点 (M4) だけを返すため、折れ線の形を保ったまま
+        読み込む点数が 4 * n_buckets 以下に収まる。値が欠損の行は含めない。
+
+        Args:
+            filters: 列名 → フィルター値
+            x_col: 日時列
+            y_col: 数値列
+            period: 表示期間 (両端を含む)
+            n_buckets: 区間の数
+
+        Returns:
+            (日時昇順のマイクロ秒単位のエポック値, 値, period 内の行数)
+        """
+        where, params = self._where(filters)
+        x, y = f"epoch_us(CAST({_ident(x_col)} AS TIMESTAMP))", f"CAST({_ident(y_col)} AS DOUBLE)"
+        valid = f"{' AND' if where else ' WHERE'} CAST({_ident(x_col)} AS TIMESTAMP) BETWEEN ? AND ? AND isfinite({y})"
+        start, end = (int(pd.Timestamp(p).as_unit("us").asm8.astype(np.int64)) for p in period)
+        width = max((end - start) / n_buckets, 1.0)
+        bucket = f"least(CAST(floor(({x} - ?) / ?) AS BIGINT), {n_buckets - 1})"
+        m4 = (
+            "min(tx) AS x0, arg_min(ty, tx) AS y0, arg_min(tx, ty) AS x1, min(ty) AS y1,"
+            " arg_max(tx, ty) AS x2, max(ty) AS y2, max(tx) AS x3, arg_max(ty, tx) AS y3"
+        )
+        source = f"SELECT {x} AS tx, {y} AS ty, {bucket} AS b FROM data{where}{valid}"  # noqa: S608 (列名は引用符で囲み、値はパラメーターで渡す)
+        sql = f"SELECT count(*) AS n, {m4} FROM ({source}) GROUP BY b"  # noqa: S608 (列名を含む部分は上で組み立て済み)
+        with self._con.cursor() as cur:
+            result = cur.execute(sql, [start, width, *params, *period]).fetchnumpy()
+        n_rows = int(np.sum(result["n"]))
+        xs = np.concatenate([np.asarray(result[f"x{i}"], dtype=np.int64) for i in range(4)])
+        ys = np.concatenate([np.asarray(result[f"y{i}"], dtype=np.float64) for i in range(4)])
+        order = np.lexsort((ys, xs))
+        xs, ys = xs[order], ys[order]
+        # 同じ点 (区間の最初の点が最小値でもある場合など) は 1 つにする
+        keep = np.ones(len(xs), dtype=bool)
+        keep[1:] = (xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1])
+        return xs[keep], ys[keep], n_rows
+
+    def head(self, n: int = 5) -> DataFrame:
+        """先頭 n 行"""
+        return self._fetch_df("SELECT * FROM data LIMIT ?", [n])
+
+    def iter_frames(self, filters: Mapping[str, SqlFilterValue], chunk_rows: int = CHUNK_ROWS) -> Iterator[DataFrame]:
+        """フィルター後の全行を chunk_rows 行ずつの DataFrame として順に取り出す (ダウンロード時だけ呼ぶ)
+
+        DuckDB の結果をレコードバッチ単位で読むため、結果全体をメモリに載せない。
+
+        Args:
+            filters: 列名 → フィルター値
+            chunk_rows: 1 チャンクあたりの行数
+
+        Yields:
+            結果のチャンク (結果が空でも列名だけの DataFrame を 1 つ返す)
+        """
+        where, params = self._where(filters)
+        with self._con.cursor() as cur:
+            reader = cur.execute(f"SELECT * FROM data{where}", params).fetch_record_batch(chunk_rows)  # noqa: S608 (値はパラメーターで渡す)
+            empty = True
+            for batch in reader:
+                if batch.num_rows == 0:
+                    continue
+                empty = False
+                yield batch.to_pandas()
+            if empty:
+                yield reader.schema.empty_table().to_pandas()
+
+    def close(self) -> None:
+        """接続を閉じる"""
+        self._con.close()
+
+
+def _bucket_sql(col: str, grain: TimeGrain) -> str:
+    """日時列を grain のバケットの表示名 (cube.bucket_labels と同じ書式) にする SQL 式"""
+    if grain == "quarter":
+        return f"strftime({col}, '%Y') || '-Q' || quarter({col})"
+    fmt = {"day": "%Y-%m-%d", "week": "%Y-%m-%d", "month": "%Y-%m", "year": "%Y"}[grain]
+    return f"strftime(date_trunc('{grain}', {col}), '{fmt}')"
+
+
+def _to_date(value: object) -> datetime.date | None:
+    """DuckDB の日付・日時を日付にする"""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return None
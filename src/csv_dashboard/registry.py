@@ -0,0 +1,331 @@
+"""
+データセットレジストリ : 同じ内容のアップロードをセッション間で 1 つの読み取り専用のコピーにまとめ、プロセス全体のメモリ上限を守る
+
+データセット (DataFrame と、プロファイル・フィルター用インデックス・集計キューブなどの派生結果) と
+セッションごとのフィルター結果などの使用量を合計し、上限を超えたら最後に使われたのが古いデータセットから
+メモリ上の参照を手放す。手放したデータセットは列指向キャッシュ (ディスク) に残しておき、次に使われたときに
+読み込み直す。
+"""
+
+import dataclasses
+import logging
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+import numpy as np
+from pandas import DataFrame, Series
+
+from src.csv_dashboard.ingest import IngestReport
+from src.libs.disk_cache import CacheStats
+
+logger = logging.getLogger(__name__)
+
+# データセットを (再) 読み込みする関数
+type Loader = Callable[[], tuple[DataFrame, IngestReport]]
+# 追い出すデータセットをディスクへ書き出す関数 (キー, DataFrame, 取り込み統計)
+type Spill = Callable[[str, DataFrame, IngestReport], None]
+
+
+def estimate_bytes(value: object, *, frames: bool = True) -> int:
+    """オブジェクトが保持する配列のおおよそのバイト数
+
+    NumPy 配列は自前でメモリを持つもの (他の配列のビューでないもの) だけを数える。
+
+    Args:
+        value: 対象 (配列・DataFrame・dataclass・dict・list・tuple を再帰的にたどる)
+        frames: DataFrame / Series も数えるか (データセットの列を参照する派生結果では False にする)
+
+    Returns:
+        推定バイト数
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes if value.base is None else 0
+    if isinstance(value, DataFrame):
+        return int(value.memory_usage(deep=True).sum()) if frames else 0
+    if isinstance(value, Series):
+        return int(value.memory_usage(deep=True)) if frames else 0
+    if isinstance(value, dict):
+        return sum(estimate_bytes(v, frames=frames) for v in value.values())
+    if isinstance(value, list | tuple):
+        return sum(estimate_bytes(v, frames=frames) for v in value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return sum(estimate_bytes(getattr(value, f.name), frames=frames) for f in dataclasses.fields(value))
+    return 0
+
+
+@dataclass(slots=True)
+class Dataset:
+    """レジストリに載っている 1 つのデータセット (セッション間で共有するため、破壊的に変更しないこと)"""
+
+    key: str
+    df: DataFrame
+    report: IngestReport
+    # 派生結果の名前 → 値
+    derived: dict[str, object] = field(default_factory=dict)
+    # DataFrame と派生結果のバイト数
+    bytes: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    # このデータセットを使ったセッション
+    sessions: set[str] = field(default_factory=set)
+
+
+@dataclass(frozen=True, slots=True)
+class DatasetUsage:
+    """データセットごとの使用量"""
+
+    key: str
+    rows: int
+    bytes: int
+    sessions: int
+    idle_seconds: float
+
+
+@dataclass(frozen=True, slots=True)
+class RegistryUsage:
+    """レジストリ全体の使用量 (監視用)"""
+
+    budget_bytes: int
+    datasets: tuple[DatasetUsage, ...]
+    # セッション ID → そのセッションだけが保持している派生結果のバイト数
+    sessions: dict[str, int]
+    hits: int
+    loads: int
+    # 追い出した後に読み込み直した回数
+    reloads: int
+    evictions: int
+
+    @property
+    def dataset_bytes(self) -> int:
+        """メモリ上のデータセットの合計バイト数"""
+        return sum(d.bytes for d in self.datasets)
+
+    @property
+    def total_bytes(self) -> int:
+        """データセットとセッションごとの派生結果の合計バイト数"""
+        return self.dataset_bytes + sum(self.sessions.values())
+
+
+class DatasetRegistry:
+    """内容のハッシュをキーに、データセットをプロセス内で 1 つだけ保持するレジストリ (スレッドセーフ)
+
+    - 同じキーの読み込みが複数のセッションから同時に来ても、読み込みは 1 度だけ行う
+    - データセットとセッションごとの派生結果の合計が budget_bytes を超えたら、最後に使われたのが古い
+      データセットから追い出す (LRU)。ttl を指定すると、最後の利用から ttl 秒を過ぎたものも追い出す
+    - 追い出したデータセットは spill でディスクへ書き出し、次に使われたときに loader で読み込み直す
+
+    追い出したデータセットを参照しているセッションがあれば、そのメモリはセッションが次に再実行される
+    (新しいデータセットを受け取る) か終了するまで解放されない。
+    """
+
+    def __init__(
+        self,
+        *,
+        budget_bytes: int,
+        ttl: float | None = None,
+        spill: Spill | None = None,
+        is_active_session: Callable[[str], bool] | None = None,
+    ) -> None:
+        self.budget_bytes = budget_bytes
+        self.ttl = ttl
+        self._spill = spill
+        self._is_active_session = is_active_session
+        self._datasets: dict[str, Dataset] = {}
+        self._sessions: dict[str, dict[str, int]] = {}
+        self._evicted: set[str] = set()
+        self._load_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._loads = 0
+        self._reloads = 0
+        self._evictions = 0
+
+    def get(self, key: str, session: str, loader: Loader) -> Dataset:
+        """キーのデータセットを返す。メモリ上に無ければ loader で読み込んで登録する
+
+        Args:
+            key: アップロード内容のキャッシュキー
+            session: 呼び出したセッションの ID
+            loader: データセットを読み込む関数
+
+        Returns:
+            共有のデータセット
+        """
+        with self._lock:
+            dataset = self._touch(key, session)
+            if dataset is not None:
+                self._hits += 1
+                return dataset
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        # 同じキーの読み込みは直列にし、待っていた側は先に読み込まれたものを使う
+        with load_lock:
+            with self._lock:
+                dataset = self._touch(key, session)
+                if dataset is not None:
+                    self._hits += 1
+                    return dataset
+            try:
+                df, report = loader()
+                dataset = Dataset(key, df, report, bytes=estimate_bytes(df))
+            except Exception:
+                with self._lock:
+                    self._drop_load_lock(key, load_lock)
+                raise
+            dataset.sessions.add(session)
+            with self._lock:
+                # 登録と同時にロックを外す (以降の呼び出しはメモリ上のデータセットを見つける)
+                self._datasets[key] = dataset
+                self._drop_load_lock(key, load_lock)
+                self._loads += 1
+                if key in self._evicted:
+                    self._evicted.discard(key)
+                    self._reloads += 1
+                evicted = self._select_evictions(protect=key)
+        if dataset.bytes > self.budget_bytes:
+            logger.warning(
+                "dataset %s (%d bytes) is larger than the budget of %d bytes", key, dataset.bytes, self.budget_bytes
+            )
+        self._release(evicted)
+        return dataset
+
+    def derived[T](self, dataset: Dataset, name: str, compute: Callable[[Dataset], T]) -> T:
+        """データセットの派生結果 (プロファイル・インデックス等) を 1 度だけ計算して共有する
+
+        派生結果はデータセットと一緒に数え、一緒に追い出す。
+
+        Args:
+            dataset: get で受け取ったデータセット
+            name: 派生結果の名前
+            compute: 派生結果を計算する関数
+
+        Returns:
+            計算済みまたは新たに計算した派生結果
+        """
+        with self._lock:
+            if name in dataset.derived:
+                return dataset.derived[name]  # type: ignore[return-value]
+        value = compute(dataset)
+        with self._lock:
+            if name in dataset.derived:
+                return dataset.derived[name]  # type: ignore[return-value]
+            dataset.derived[name] = value
+            # データセットの列を参照するだけの Series 等は数えない
+            dataset.bytes += estimate_bytes(value, frames=False)
+            evicted = self._select_evictions(protect=dataset.key)
+        self._release(evicted)
+        return value
+
+    def record_session(self, session: str, name: str, value: object) -> None:
+        """セッションが保持する派生結果 (フィルター結果など) の使用量を記録する
+
+        データセットの DataFrame そのもの (絞り込み無しのフィルター結果など) は数えない。
+        ここでは追い出さず、次にデータセットを読み込む・派生結果を計算するときに上限の判定に含める。
+
+        Args:
+            session: セッション ID
+            name: 派生結果の名前 (同じ名前は上書きする)
+            value: 派生結果
+        """
+        with self._lock:
+            shared = any(value is d.df for d in self._datasets.values())
+        nbytes = 0 if shared else estimate_bytes(value)
+        with self._lock:
+            self._sessions.setdefault(session, {})[name] = nbytes
+
+    def usage(self) -> RegistryUsage:
+        """現在の使用量を返す (終了したセッションの記録と、期限切れで使われていないデータセットはここで捨てる)"""
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._select_evictions(protect=None, budget=False)
+            datasets = tuple(
+                DatasetUsage(d.key, len(d.df), d.bytes, len(d.sessions), now - d.last_used)
+                for d in sorted(self._datasets.values(), key=lambda d: d.last_used, reverse=True)
+            )
+            sessions = {s: sum(names.values()) for s, names in self._sessions.items()}
+            usage = RegistryUsage(
+                budget_bytes=self.budget_bytes,
+                datasets=datasets,
+                sessions=sessions,
+                hits=self._hits,
+                loads=self._loads,
+                reloads=self._reloads,
+                evictions=self._evictions,
+            )
+        self._release(evicted)
+        return usage
+
+    def stats(self) -> CacheStats:
+        """ヒット・読み込み回数とメモリ上のデータセットの数・バイト数 (metrics.register_cache 用)
+
+        監視から定期的に呼ばれるため、アクセスが途絶えても期限切れのデータセットはここで追い出す
+        (上限による追い出しは読み込み・派生結果の計算時だけ行い、監視の呼び出しでは使用中のデータを手放さない)。
+        """
+        with self._lock:
+            evicted = self._select_evictions(protect=None, budget=False)
+            stats = CacheStats(
+                hits=self._hits,
+                misses=self._loads,
+                entries=len(self._datasets),
+                bytes=sum(d.bytes for d in self._datasets.values()),
+            )
+        self._release(evicted)
+        return stats
+
+    def _touch(self, key: str, session: str) -> Dataset | None:
+        """メモリ上のデータセットの最終利用時刻を更新して返す。無ければNone (ロック内で呼ぶ)"""
+        dataset = self._datasets.get(key)
+        if dataset is not None:
+            dataset.last_used = time.monotonic()
+            dataset.sessions.add(session)
+        return dataset
+
+    def _prune_sessions(self) -> None:
+        """終了したセッションの記録を捨てる (ロック内で呼ぶ)"""
+        if self._is_active_session is None:
+            return
+        for session in [s for s in self._sessions if not self._is_active_session(s)]:
+            del self._sessions[session]
+        for dataset in self._datasets.values():
+            dataset.sessions = {s for s in dataset.sessions if self._is_active_session(s)}
+
+    def _drop_load_lock(self, key: str, load_lock: threading.Lock) -> None:
+        """読み込みが終わったキーのロックを外す (ロック内で呼ぶ)"""
+        if self._load_locks.get(key) is load_lock:
+            del self._load_locks[key]
+
+    def _select_evictions(self, protect: str | None, *, budget: bool = True) -> list[Dataset]:
+        """期限切れと、上限を超えた分のデータセットを古い順に登録から外す (ロック内で呼ぶ)
+
+        Args:
+            protect: 追い出さないデータセットのキー (今まさに使っているもの)
+            budget: 上限による追い出しも行うか。False なら期限切れで、どの (生きている) セッションも
+                使っていないものだけを外す (監視からの呼び出し用)
+
+        Returns:
+            登録から外したデータセット (ロックの外で _release に渡す)
+        """
+        self._prune_sessions()
+        now = time.monotonic()
+        total = sum(d.bytes for d in self._datasets.values()) + sum(sum(s.values()) for s in self._sessions.values())
+        evicted: list[Dataset] = []
+        for dataset in sorted(self._datasets.values(), key=lambda d: d.last_used):
+            expired = self.ttl is not None and now - dataset.last_used > self.ttl
+            if budget:
+                if dataset.key == protect or (total <= self.budget_bytes and not expired):
+                    continue
+            elif not expired or dataset.sessions:
+                continue
+            del self._datasets[dataset.key]
+            self._evicted.add(dataset.key)
+            self._evictions += 1
+            total -= dataset.bytes
+            evicted.append(dataset)
+        return evicted
+
+    def _release(self, evicted: list[Dataset]) -> None:
+        """登録から外したデータセットをディスクへ書き出してから手放す"""
+        for dataset in evicted:
+            logger.info("evicting dataset %s (%d bytes)", dataset.key, dataset.bytes)
+            if self._spill is not None:
+                self._spill(dataset.key, dataset.df, dataset.report)
@@ -0,0 +1,216 @@
+"""
+ディレクトリ上のファイルを容量上限付き LRU で管理する永続キャッシュ
+"""
+
+import os
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass(frozen=True, slots=True)
+class CacheStats:
+    """キャッシュの利用統計"""
+
+    hits: int
+    misses: int
+    entries: int
+    bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        """ヒット率 (問い合わせが無ければ 0)"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class DiskCache:
+    """キーごとに 1 ファイルを保存する永続キャッシュ
+
+    - 書き込みは一時ファイル経由のアトミックな rename で行うため、複数プロセス・レプリカから共有できる
+    - ヒットのたびに mtime を更新し、容量上限を超えたら mtime の古い順 (LRU) に削除する
+    - エントリ数と合計バイト数は書き込み・削除のたびに加減して保持し、ディレクトリを走査するのは
+      開いたとき・上限を超えたとき・集計のずれ (他のプロセスによる削除など) に気づいたときだけにする
+    - ttl を指定すると、最終利用から ttl 秒を過ぎたエントリはミス扱いにして削除する
+    - pin したキーは unpin されるまで削除しない (このプロセスで開いているファイルを守る)
+    """
+
+    def __init__(self, root: Path, *, suffix: str, max_bytes: int, ttl: float | None = None) -> None:
+        self.root = root
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._hits = 0
+        self._misses = 0
+        # キー → pin された回数
+        self._pins: dict[str, int] = {}
+        # このプロセスから見たエントリ数と合計バイト数 (None は数え直しが必要)
+        self._count_entries: int | None = None
+        self._bytes: int | None = None
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._rescan()
+
+    def path_for(self, key: str) -> Path:
+        """キーに対応する保存先パス"""
+        return self.root / f"{key}{self.suffix}"
+
+    def get(self, key: str) -> Path | None:
+        """キーに対応するファイルを返す。無い・期限切れならNone
+
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            キャッシュファイルのパス、なければNone
+        """
+        path = self.path_for(key)
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+        if self.ttl is not None and time.time() - mtime > self.ttl and not self._pinned(key):
+            self._remove(path)
+            self._count(hit=False)
+            return None
+        # LRU のために最終利用時刻を更新 (atime は noatime マウントで当てにならない)
+        os.utime(path)
+        self._count(hit=True)
+        return path
+
+    def put(self, key: str, write: Callable[[Path], None]) -> Path:
+        """write で一時ファイルを書き出してからキャッシュに登録する
+
+        Args:
+            key: キャッシュキー
+            write: 渡されたパスにデータを書き出す関数
+
+        Returns:
+            登録したキャッシュファイルのパス
+        """
+        path = self.path_for(key)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            write(tmp)
+            size = tmp.stat().st_size
+            replaced = _file_size(path)
+            tmp.replace(path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        with self._lock:
+            if self._bytes is not None and self._count_entries is not None:
+                self._bytes += size - (replaced or 0)
+                self._count_entries += replaced is None
+            over = self._bytes is None or self._bytes > self.max_bytes
+        if over:
+            self.evict()
+        return path
+
+    def discard(self, key: str) -> None:
+        """キーに対応するエントリを削除する"""
+        self._remove(self.path_for(key))
+
+    def pin(self, key: str) -> None:
+        """unpin されるまで、キーのエントリを容量上限・期限切れで削除しないようにする
+
+        pin したエントリも容量には数えるため、pin が多いと一時的に上限を超えることがある。
+        """
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, key: str) -> None:
+        """pin を 1 回分解除する"""
+        with self._lock:
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+            else:
+                self._pins.pop(key, None)
+
+    def evict(self) -> None:
+        """ディレクトリを走査し、容量上限を超えている間、最終利用の古いエントリから削除する
+
+        pin されたエントリは残す。走査結果でエントリ数・合計バイト数を数え直す。
+        """
+        entries = self._entries()
+        count, total = len(entries), sum(size for _, _, size in entries)
+        for path, _, size in sorted(entries, key=lambda e: e[1]):
+            if total <= self.max_bytes:
+                break
+            if self._pinned(path.name.removesuffix(self.suffix)):
+                continue
+            path.unlink(missing_ok=True)
+            count -= 1
+            total -= size
+        with self._lock:
+            self._count_entries, self._bytes = count, total
+
+    def stats(self) -> CacheStats:
+        """現在の利用統計を返す (保持している集計を返し、ずれに気づいていたときだけ数え直す)"""
+        with self._lock:
+            stale = self._bytes is None or self._count_entries is None
+        if stale:
+            self._rescan()
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                entries=self._count_entries or 0,
+                bytes=self._bytes or 0,
+            )
+
+    def _rescan(self) -> None:
+        """ディレクトリを走査してエントリ数・合計バイト数を数え直す"""
+        entries = self._entries()
+        with self._lock:
+            self._count_entries, self._bytes = len(entries), sum(size for _, _, size in entries)
+
+    def _entries(self) -> list[tuple[Path, float, int]]:
+        """(パス, mtime, サイズ) の一覧。列挙中に他プロセスが消したファイルは無視する"""
+        entries = []
+        for path in self.root.glob(f"*{self.suffix}"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((path, st.st_mtime, st.st_size))
+        return entries
+
+    def _remove(self, path: Path) -> None:
+        """エントリを削除し、エントリ数・合計バイト数から差し引く"""
+        size = _file_size(path)
+        if size is None:
+            return
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            size = None
+        with self._lock:
+            if size is None or self._bytes is None or self._count_entries is None or size > self._bytes:
+                # 直前に他のプロセスが消していた・集計が合わない : 次の stats / put で数え直す
+                self._count_entries = self._bytes = None
+            else:
+                self._count_entries -= 1
+                self._bytes -= size
+
+    def _pinned(self, key: str) -> bool:
+        with self._lock:
+            return key in self._pins
+
+    def _count(self, *, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+
+def _file_size(path: Path) -> int | None:
+    """ファイルのバイト数 (無ければNone)"""
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,157 @@
+"""
+DataFrame のエクスポート : CSV / 圧縮 CSV / Parquet をチャンク単位で生成し、ピークメモリを抑える
+"""
+
+import io
+import tempfile
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from typing import BinaryIO, Literal, cast
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas import DataFrame
+
+type ExportFormat = Literal["csv", "csv.gz", "csv.zst", "parquet"]
+
+# 1 チャンクあたりの行数
+CHUNK_ROWS = 100_000
+# export_file がメモリ上に保持する上限。超えた分は一時ファイルへ書き出す
+SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
+
+@dataclass(frozen=True, slots=True)
+class ExportSpec:
+    """エクスポート形式ごとの表示名・拡張子・MIME タイプ"""
+
+    label: str
+    suffix: str
+    mime: str
+
+
+EXPORT_FORMATS: dict[ExportFormat, ExportSpec] = {
+    "csv": ExportSpec("CSV", ".csv", "text/csv"),
+    "csv.gz": ExportSpec("CSV (gzip)", ".csv.gz", "application/gzip"),
+    "csv.zst": ExportSpec("CSV (zstd)", ".csv.zst", "application/zstd"),
+    "parquet": ExportSpec("Parquet", ".parquet", "application/vnd.apache.parquet"),
+}
+
+
+class _DrainSink(io.RawIOBase):
+    """書き込まれたバイト列を溜めておき、drain で取り出せる出力先"""
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: bytes | bytearray | memoryview) -> int:  # type: ignore[override]
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        out = b"".join(self._chunks)
+        self._chunks.clear()
+        return out
+
+
+def _slices(df: DataFrame, chunk_rows: int) -> Iterator[DataFrame]:
+    """df を chunk_rows 行ずつに分ける (空の df は列名だけを返す)"""
+    if df.empty:
+        yield df
+        return
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start : start + chunk_rows]
+
+
+def _csv_chunks(frames: Iterable[DataFrame]) -> Iterator[bytes]:
+    """ヘッダー付き CSV をチャンクごとにエンコードして返す"""
+    header = True
+    for frame in frames:
+        if frame.empty and not header:
+            continue
+        yield frame.to_csv(index=False, header=header).encode()
+        header = False
+
+
+def iter_export_frames(frames: Iterable[DataFrame], fmt: ExportFormat) -> Iterator[bytes]:
+    """DataFrame のチャンク列を fmt 形式のバイト列としてチャンクごとに生成する
+
+    チャンクは 1 つずつ読んで捨てるため、ピークメモリは 1 チャンク分 (+ 圧縮器のバッファ) に収まる。
+    DuckDB の結果のように、全体をメモリに載せずに順に取り出せるデータをそのままエクスポートできる。
+
+    Args:
+        frames: 同じ列を持つ DataFrame のチャンク (最初のチャンクから列と型を決める。空でも 1 つは渡すこと)
+        fmt: 出力形式
+
+    Yields:
+        出力ファイルの断片 (順に連結すると完全なファイルになる)
+    """
+    if fmt == "csv":
+        yield from _csv_chunks(frames)
+        return
+
+    sink = _DrainSink()
+    if fmt == "parquet":
+        writer: pq.ParquetWriter | None = None
+        try:
+            # 各チャンクを 1 つの row group として書き出す
+            for frame in frames:
+                if writer is None:
+                    schema = pa.Table.from_pandas(frame.iloc[:0], preserve_index=False).schema
+                    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+                if frame.empty:
+                    continue
+                writer.write_table(pa.Table.from_pandas(frame, schema=writer.schema, preserve_index=False))
+                if data := sink.drain():
+                    yield data
+        finally:
+            if writer is not None:
+                writer.close()
+        yield sink.drain()
+        return
+
+    codec = "gzip" if fmt == "csv.gz" else "zstd"
+    with pa.CompressedOutputStream(sink, codec) as stream:
+        for encoded in _csv_chunks(frames):
+            stream.write(encoded)
+            if data := sink.drain():
+                yield data
+    yield sink.drain()
+
+
+def iter_export(df: DataFrame, fmt: ExportFormat, chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """df を fmt 形式のバイト列としてチャンクごとに生成する
+
+    全体を一度に文字列化しないため、ピークメモリは 1 チャンク分 (+ 圧縮器のバッファ) に収まる。
+
+    Args:
+        df: エクスポート対象のDataFrame
+        fmt: 出力形式
+        chunk_rows: 1 チャンクあたりの行数
+
+    Yields:
+        出力ファイルの断片 (順に連結すると完全なファイルになる)
+    """
+    yield from iter_export_frames(_slices(df, chunk_rows), fmt)
+
+
+def export_file(data: DataFrame | Iterable[DataFrame], fmt: ExportFormat) -> BinaryIO:
+    """iter_export / iter_export_frames の出力をファイルオブジェクトにまとめて返す
+
+    SPOOL_MAX_BYTES を超えると一時ファイルに書き出すため、大きな出力でもメモリを圧迫しない。
+
+    Args:
+        data: エクスポート対象のDataFrame、または DataFrame のチャンク列
+        fmt: 出力形式
+
+    Returns:
+        先頭にシーク済みのファイルオブジェクト
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)  # noqa: SIM115 (呼び出し側で読み終えたら閉じる)
+    chunks = iter_export(data, fmt) if isinstance(data, DataFrame) else iter_export_frames(data, fmt)
+    for chunk in chunks:
+        out.write(chunk)
+    out.seek(0)
+    return cast("BinaryIO", out)
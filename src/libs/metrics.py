@@ -0,0 +1,321 @@
+"""
+計測 : 処理段階ごとのレイテンシ・行数・RSS とキャッシュのヒット率を集計し、Prometheus のテキスト形式で出力する
+
+Shiny (Starlette) アプリは /metrics ルートで、Streamlit アプリは start_exporters で起動する
+HTTP サーバー (サイドカー) または定期的なログ出力で公開する。
+"""
+
+import functools
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.libs.disk_cache import CacheStats
+
+logger = logging.getLogger(__name__)
+
+# レイテンシのヒストグラムのバケット上限 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Prometheus のテキスト形式の Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def peak_rss_bytes() -> int:
+    """プロセスの最大 RSS をバイト単位で返す (Linux は KiB 単位で返るため換算する)"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def rss_bytes() -> int:
+    """プロセスの現在の RSS をバイト単位で返す (/proc が無い環境では最大 RSS で代用する)"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:  # noqa: PTH123 (頻繁に呼ぶため Path を作らない)
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+@dataclass(slots=True)
+class Histogram:
+    """累積バケット付きのヒストグラム"""
+
+    buckets: tuple[float, ...]
+    counts: list[int] = field(default_factory=list)
+    sum: float = 0.0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        if not self.counts:
+            self.counts = [0] * len(self.buckets)
+
+    def observe(self, value: float) -> None:
+        """値を 1 つ記録する"""
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+@dataclass(slots=True)
+class StageTimer:
+    """timer の中で処理した行数を記録するためのオブジェクト (抜けた後は所要時間も参照できる)"""
+
+    rows: int | None = None
+    seconds: float = 0.0
+
+
+@dataclass(slots=True)
+class _Stage:
+    latency: Histogram
+    rows: int = 0
+    rss_bytes: int = 0
+
+    def copy(self) -> "_Stage":
+        latency = Histogram(self.latency.buckets, self.latency.counts.copy(), self.latency.sum, self.latency.count)
+        return _Stage(latency, self.rows, self.rss_bytes)
+
+
+class Metrics:
+    """処理段階 (stage) ごとの計測値とキャッシュの統計を保持するレジストリ (スレッドセーフ)"""
+
+    def __init__(self, namespace: str = "app", buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.namespace = namespace
+        self.buckets = buckets
+        self._stages: dict[str, _Stage] = {}
+        self._cache_counts: dict[str, list[int]] = {}
+        self._cache_sources: dict[str, Callable[[], CacheStats]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, *, rows: int | None = None) -> None:
+        """stage の 1 回分のレイテンシ (と処理行数) を記録する。直後の RSS も合わせて記録する
+
+        Args:
+            stage: 処理段階の名前
+            seconds: 所要時間 (秒)
+            rows: 処理した行数 (不明ならNone)
+        """
+        rss = rss_bytes()
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = _Stage(Histogram(self.buckets))
+            entry.latency.observe(seconds)
+            if rows is not None:
+                entry.rows += rows
+            entry.rss_bytes = rss
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[StageTimer]:
+        """with ブロックの所要時間を stage のレイテンシとして記録する
+
+        ブロック内で ``t.rows = ...`` とすると処理行数も記録する。例外で抜けた場合も記録する。
+        ブロックを抜けた後は ``t.seconds`` で所要時間を参照できる。
+
+        Args:
+            stage: 処理段階の名前
+
+        Yields:
+            処理行数を設定するためのオブジェクト
+        """
+        t = StageTimer()
+        start = time.perf_counter()
+        try:
+            yield t
+        finally:
+            t.seconds = time.perf_counter() - start
+            self.observe(stage, t.seconds, rows=t.rows)
+
+    def timed[**P, R](self, stage: str) -> Callable[[Callable[P, R]], Callable[P, R]]:
+        """関数の呼び出しごとの所要時間を stage のレイテンシとして記録するデコレーター
+
+        Args:
+            stage: 処理段階の名前
+
+        Returns:
+            デコレーター
+        """
+
+        def decorator(func: Callable[P, R]) -> Callable[P, R]:
+            @functools.wraps(func)
+            def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def record_cache(self, cache: str, *, hit: bool) -> None:
+        """キャッシュの問い合わせ結果を 1 回分記録する"""
+        with self._lock:
+            counts = self._cache_counts.setdefault(cache, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def register_cache(self, cache: str, stats: Callable[[], CacheStats]) -> None:
+        """自前でヒット・ミス数を数えているキャッシュを登録する (出力のたびに stats を呼ぶ)"""
+        with self._lock:
+            self._cache_sources[cache] = stats
+
+    def cache_stats(self) -> dict[str, tuple[int, int]]:
+        """キャッシュごとの (ヒット数, ミス数)"""
+        counts, _ = self._collect_caches()
+        return counts
+
+    def _collect_caches(self) -> tuple[dict[str, tuple[int, int]], dict[str, CacheStats]]:
+        """キャッシュごとの (ヒット数, ミス数) と、登録済みキャッシュの統計 (各 stats は 1 回だけ呼ぶ)"""
+        with self._lock:
+            counts = {name: (hits, misses) for name, (hits, misses) in self._cache_counts.items()}
+            sources = dict(self._cache_sources)
+        sizes = {name: stats() for name, stats in sources.items()}
+        counts.update({name: (s.hits, s.misses) for name, s in sizes.items()})
+        return counts, sizes
+
+    def snapshot(self) -> dict[str, object]:
+        """現在の計測値を JSON に変換できる辞書で返す (ログ出力用)"""
+        with self._lock:
+            stages = {
+                name: {
+                    "count": s.latency.count,
+                    "mean_seconds": s.latency.sum / s.latency.count if s.latency.count else 0.0,
+                    "rows": s.rows,
+                    "rss_bytes": s.rss_bytes,
+                }
+                for name, s in self._stages.items()
+            }
+        caches = {
+            name: {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+            for name, (hits, misses) in self.cache_stats().items()
+        }
+        return {"rss_bytes": rss_bytes(), "peak_rss_bytes": peak_rss_bytes(), "stages": stages, "caches": caches}
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式で出力する"""
+        ns = self.namespace
+        with self._lock:
+            stages = {name: s.copy() for name, s in self._stages.items()}
+        lines = [f"# TYPE {ns}_stage_seconds histogram"]
+        for name, s in stages.items():
+            label = f'stage="{_escape(name)}"'
+            lines.extend(
+                f'{ns}_stage_seconds_bucket{{{label},le="{upper}"}} {n}'
+                for upper, n in zip(s.latency.buckets, s.latency.counts, strict=True)
+            )
+            lines.append(f'{ns}_stage_seconds_bucket{{{label},le="+Inf"}} {s.latency.count}')
+            lines.append(f"{ns}_stage_seconds_sum{{{label}}} {s.latency.sum}")
+            lines.append(f"{ns}_stage_seconds_count{{{label}}} {s.latency.count}")
+        lines.append(f"# TYPE {ns}_stage_rows_total counter")
+        lines.extend(f'{ns}_stage_rows_total{{stage="{_escape(name)}"}} {s.rows}' for name, s in stages.items())
+        lines.append(f"# TYPE {ns}_stage_rss_bytes gauge")
+        lines.extend(f'{ns}_stage_rss_bytes{{stage="{_escape(name)}"}} {s.rss_bytes}' for name, s in stages.items())
+
+        caches, sizes = self._collect_caches()
+        for metric, index in (("hits", 0), ("misses", 1)):
+            lines.append(f"# TYPE {ns}_cache_{metric}_total counter")
+            lines.extend(
+                f'{ns}_cache_{metric}_total{{cache="{_escape(name)}"}} {c[index]}' for name, c in caches.items()
+            )
+        for metric in ("entries", "bytes"):
+            lines.append(f"# TYPE {ns}_cache_{metric} gauge")
+            lines.extend(
+                f'{ns}_cache_{metric}{{cache="{_escape(name)}"}} {getattr(s, metric)}' for name, s in sizes.items()
+            )
+        lines.append(f"# TYPE {ns}_cache_hit_ratio gauge")
+        lines.extend(
+            f'{ns}_cache_hit_ratio{{cache="{_escape(name)}"}} {hits / (hits + misses) if hits + misses else 0.0}'
+            for name, (hits, misses) in caches.items()
+        )
+
+        lines.append(f"# TYPE {ns}_process_rss_bytes gauge")
+        lines.append(f"{ns}_process_rss_bytes {rss_bytes()}")
+        lines.append(f"# TYPE {ns}_process_peak_rss_bytes gauge")
+        lines.append(f"{ns}_process_peak_rss_bytes {peak_rss_bytes()}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    """ラベル値のエスケープ"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# アプリ全体で共有するレジストリ
+metrics = Metrics()
+
+
+def start_http_server(port: int, host: str = "0.0.0.0", registry: Metrics = metrics) -> ThreadingHTTPServer:  # noqa: S104 (コンテナ外からスクレイプするため)
+    """/metrics を返す HTTP サーバーをデーモンスレッドで起動する (Streamlit アプリのサイドカー用)
+
+    Args:
+        port: 待ち受けるポート
+        host: 待ち受けるアドレス
+        registry: 出力するレジストリ
+
+    Returns:
+        起動したサーバー
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # noqa: N802 (BaseHTTPRequestHandler の規約)
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: object) -> None:  # noqa: A002 (基底クラスの引数名)
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("metrics server listening on %s:%d", host, port)
+    return server
+
+
+def start_log_export(interval: float, registry: Metrics = metrics) -> threading.Thread:
+    """interval 秒ごとに計測値を JSON 1 行でログに出力するデーモンスレッドを起動する
+
+    Args:
+        interval: 出力間隔 (秒)
+        registry: 出力するレジストリ
+
+    Returns:
+        起動したスレッド
+    """
+
+    def run() -> None:
+        while True:
+            time.sleep(interval)
+            logger.info("metrics %s", json.dumps(registry.snapshot()))
+
+    thread = threading.Thread(target=run, name="metrics-log", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_exporters(port: int | None, log_interval: float | None) -> None:
+    """設定に応じてサイドカーの HTTP サーバーとログ出力を起動する (プロセスごとに 1 度だけ呼ぶ)
+
+    Args:
+        port: /metrics を公開するポート (None なら公開しない)
+        log_interval: ログに出力する間隔 (秒, None なら出力しない)
+    """
+    if port is not None:
+        try:
+            start_http_server(port)
+        except OSError:
+            # 同じホストで別のアプリが既に使っているポートなら、ログ出力だけにする
+            logger.warning("metrics port %d is unavailable", port)
+    if log_interval is not None:
+        start_log_export(log_interval)
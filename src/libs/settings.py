@@ -1,10 +1,62 @@
+from pathlib import Path
+from typing import Literal
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+type CsvEngine = Literal["pandas", "duckdb"]
+
 
 class Settings(BaseSettings):
-    # OpenAI APIの設定
-    openai_api_key: str = Field(..., description="OpenAI API Key")
+    # OpenAI APIの設定 (Markdown サマライザー以外のアプリでは不要なので空を許容)
+    openai_api_key: str = Field("", description="OpenAI API Key")
+    # OpenAI 互換 API の接続先 (None なら OpenAI 本家。ローカルのモックサーバー等に切り替えられる)
+    openai_base_url: str | None = Field(None, description="OpenAI 互換 API のベース URL")
+    openai_timeout_seconds: float = Field(60.0, description="1 リクエストの読み取りタイムアウト (秒)")
+    openai_connect_timeout_seconds: float = Field(5.0, description="接続確立のタイムアウト (秒)")
+
+    # 計測の設定 (Shiny は /metrics ルートで常に公開する)
+    metrics_port: int | None = Field(
+        None, description="Streamlit アプリの /metrics を公開するポート (None なら公開しない)"
+    )
+    metrics_log_interval_seconds: float | None = Field(
+        None, description="計測値をログに出力する間隔 (秒, None なら出力しない)"
+    )
+
+    # キャッシュの設定
+    cache_dir: Path = Field(Path(".cache"), description="永続キャッシュを保存するディレクトリ")
+    csv_cache_max_bytes: int = Field(10 * 1024**3, description="CSV 列指向キャッシュの容量上限 (bytes)")
+
+    # CSV ダッシュボードの設定
+    csv_engine: CsvEngine = Field("pandas", description="既定の処理エンジン (duckdb は任意依存)")
+    csv_duckdb_memory_limit: str | None = Field(
+        None, description="DuckDB エンジンのメモリ上限 (例: 4GB。None なら物理メモリの 80%)"
+    )
+    csv_memory_budget_bytes: int = Field(
+        4 * 1024**3, description="セッション間で共有するデータセットと派生結果のメモリ上限 (bytes, プロセス全体)"
+    )
+    csv_dataset_ttl_seconds: float | None = Field(
+        6 * 3600, description="使われなくなったデータセットをメモリから外すまでの秒数 (None なら上限超過時のみ)"
+    )
+    csv_duckdb_max_tables: int = Field(8, description="DuckDB エンジンで同時に開いておくファイル数の上限")
+    csv_timeseries_max_points: int = Field(2_000, description="時系列チャートに描く点数の既定の上限")
+
+    # Shiny デモの設定
+    shiny_demo_rows: int = Field(1_000, description="Shiny デモで生成するデータの行数")
+    shiny_upload_max_bytes: int = Field(200 * 1024**2, description="Shiny デモでアップロードできる CSV の上限 (bytes)")
+
+    # Markdown サマライザーの設定
+    summarizer_model: str = Field("gpt-4o-mini", description="要約に使うモデル名")
+    summarizer_chunk_tokens: int = Field(6_000, description="1 リクエストあたりの入力トークン上限")
+    summarizer_max_concurrency: int = Field(4, description="チャンク要約の同時リクエスト数")
+    summarizer_max_retries: int = Field(5, description="レート制限等の一時的なエラーを再試行する回数")
+    summarizer_input_token_budget: int | None = Field(
+        100_000, description="文書 1 件あたりの入力トークン上限 (圧縮後。None なら上限なし)"
+    )
+    summary_cache_max_bytes: int = Field(256 * 1024**2, description="要約キャッシュの容量上限 (bytes)")
+    summary_cache_ttl_seconds: float = Field(
+        30 * 24 * 3600, description="要約キャッシュの有効期限 (最終利用からの秒数)"
+    )
 
     # 環境変数の設定
     model_config = SettingsConfigDict(
@@ -0,0 +1,243 @@
+"""
+ストリーミング要約 (スケッチ) : 全件を保持せずに 1 パスでユニーク数・分位点・頻出値を近似する
+
+いずれもチャンク単位で update し、別々に作ったスケッチを merge で合算できる (並列処理・追記用)。
+メモリ使用量はデータの件数・ユニーク数によらず一定に収まる。
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+from pandas import Series
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """uint64 配列の各要素のビット長 (0 は 0)"""
+    v = values.copy()
+    for shift in (1, 2, 4, 8, 16, 32):
+        v |= v >> np.uint64(shift)
+    lengths: np.ndarray = np.bitwise_count(v)
+    return lengths
+
+
+class HyperLogLog:
+    """HyperLogLog によるユニーク数の推定 (標準誤差はおよそ 1.04 / sqrt(2**precision))"""
+
+    def __init__(self, precision: int = 14) -> None:
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, s: Series) -> None:
+        """値を追加する (欠損は数えない)
+
+        Args:
+            s: 追加する値
+        """
+        values = s.dropna()
+        if values.empty:
+            return
+        # 高カーディナリティの列では、ハッシュ前の重複除去 (categorize) の方が高くつく
+        hashes = pd.util.hash_pandas_object(values, index=False, categorize=False).to_numpy()
+        p = self.precision
+        buckets = (hashes >> np.uint64(64 - p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        # 残りのビットの先頭から数えた最初の 1 の位置
+        ranks = (64 - p + 1 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """同じ precision の別のスケッチを合算する"""
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        """ユニーク数の推定値"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int32))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # 少数のうちは空のレジスタの割合から数える (linear counting) 方が正確
+        if raw <= 2.5 * m and zeros:
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+
+class QuantileSketch:
+    """KLL 方式の分位点スケッチ
+
+    値をレベルごとのバッファに溜め、容量を超えたレベルはソートして 1 つおきに間引き、
+    重みを 2 倍にして上のレベルへ送る。順位の誤差はおよそ件数の 1.7 / k に収まる。
+    """
+
+    def __init__(self, k: int = 200, seed: int = 0) -> None:
+        self.k = k
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.levels: list[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        """レベルごとのバッファの容量 (上のレベルほど大きい)"""
+        depth = len(self.levels) - level - 1
+        return max(math.ceil(self.k * (2 / 3) ** depth), 2)
+
+    def _compact(self) -> None:
+        """容量を超えたレベルを下から順に間引く"""
+        level = 0
+        while level < len(self.levels):
+            buffer = self.levels[level]
+            if len(buffer) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                buffer = np.sort(buffer)
+                # 奇数個なら末尾の 1 つを残して偶数個を間引く
+                keep = buffer[len(buffer) - len(buffer) % 2 :]
+                offset = int(self._rng.integers(2))
+                promoted = buffer[offset : len(buffer) - len(keep) : 2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = keep
+            level += 1
+
+    def update(self, values: np.ndarray) -> None:
+        """値を追加する (NaN は数えない)
+
+        Args:
+            values: 追加する数値の配列
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """別のスケッチを合算する"""
+        if len(other.levels) > len(self.levels):
+            self.levels.extend(np.empty(0) for _ in range(len(other.levels) - len(self.levels)))
+        for level, buffer in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], buffer])
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compact()
+
+    def quantiles(self, qs: tuple[float, ...]) -> tuple[float, ...]:
+        """分位点の推定値 (0 と 1 は正確な最小値・最大値)
+
+        Args:
+            qs: 0〜1 の分位
+
+        Returns:
+            qs の順の推定値。値が 1 つも無ければ NaN
+        """
+        if not self.count:
+            return tuple(math.nan for _ in qs)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(b), 1 << level, dtype=np.int64) for level, b in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, cumulative = values[order], np.cumsum(weights[order])
+        result: list[float] = []
+        for q in qs:
+            if q <= 0:
+                result.append(self.min)
+            elif q >= 1:
+                result.append(self.max)
+            else:
+                i = int(np.searchsorted(cumulative, q * cumulative[-1], side="left"))
+                result.append(float(values[min(i, len(values) - 1)]))
+        return tuple(result)
+
+
+class HeavyHitters:
+    """Misra-Gries 方式の頻出値 (top-k) の要約
+
+    capacity 件の候補だけを保持する。推定した出現回数は実際より少なく出ることがあるが、
+    その差は (件数 / (capacity + 1)) 以下に収まり、それより多く出現する値は必ず候補に残る。
+    block_rows 行ごとに数えて候補へ合算するため、チャンクのユニークな値を一度に全部は作らない。
+    候補の照合は値の 64 ビットハッシュで行い、文字列にするのは候補に残った値だけにする。
+    """
+
+    def __init__(self, capacity: int = 100, block_rows: int = 65_536) -> None:
+        self.capacity = capacity
+        # 1 度に数える行数
+        self.block_rows = block_rows
+        self.count = 0
+        # 候補のハッシュ・推定回数・値 (同じ位置が対応する)
+        self._keys = np.empty(0, dtype=np.uint64)
+        self._counts = np.empty(0, dtype=np.int64)
+        self._values = np.empty(0, dtype=object)
+        # 直前のブロックの値がほとんどユニークだったか (次のブロックの数え方を決める)
+        self._distinct_blocks = False
+
+    def update(self, s: Series) -> None:
+        """値を追加する (欠損は数えない)
+
+        追加の作業領域は block_rows 行分と候補だけで、チャンクの大きさ・ユニーク数によらない。
+
+        Args:
+            s: 追加する値
+        """
+        for start in range(0, len(s), self.block_rows):
+            block = s.iloc[start : start + self.block_rows]
+            counts: np.ndarray
+            positions: np.ndarray
+            if self._distinct_blocks:
+                # ほとんどの値がユニークな列では、値ごとの集計を作らずに行のハッシュを直接数える
+                block = block.dropna()
+                hashes = pd.util.hash_pandas_object(block, index=False, categorize=False).to_numpy()
+                keys, positions, counts = np.unique(hashes, return_index=True, return_counts=True)
+                source = block
+            else:
+                value_counts = block.value_counts(dropna=True)
+                # category 列では出現しないカテゴリも 0 件として数えられる
+                value_counts = value_counts[value_counts > 0]
+                source = value_counts.index.to_series(index=None)
+                keys = pd.util.hash_pandas_object(source, index=False, categorize=False).to_numpy()
+                counts, positions = value_counts.to_numpy(dtype=np.int64), np.arange(len(source))
+            self._distinct_blocks = len(keys) > len(block) // 2
+            self.count += int(counts.sum())
+            self._merge(keys, counts.astype(np.int64, copy=False), source, positions)
+
+    def merge(self, other: "HeavyHitters") -> None:
+        """別の要約を合算する"""
+        self.count += other.count
+        values = pd.Series(other._values)  # noqa: SLF001 (同じクラスの内部状態)
+        self._merge(other._keys, other._counts, values, np.arange(len(values)))  # noqa: SLF001 (同じクラスの内部状態)
+
+    def _merge(self, keys: np.ndarray, counts: np.ndarray, source: Series, positions: np.ndarray) -> None:
+        """候補に (keys, counts) を合算し、capacity + 1 番目の回数を全体から引いて 0 以下になったものを捨てる
+
+        Args:
+            keys: 追加する値のハッシュ
+            counts: keys ごとの回数
+            source: 追加する値の元の Series
+            positions: keys[i] の値の source 上の位置 (候補に残ったものだけを文字列にする)
+        """
+        n_old = len(self._keys)
+        all_keys = np.concatenate([self._keys, keys])
+        all_counts = np.concatenate([self._counts, counts])
+        # 安定ソートなので、同じハッシュの先頭は既存の候補 (値を持っている方) になる
+        order = np.argsort(all_keys, kind="stable")
+        sorted_keys = all_keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        summed = np.add.reduceat(all_counts[order], starts) if len(starts) else all_counts
+        first = order[starts]
+        if len(summed) > self.capacity:
+            threshold = np.partition(summed, len(summed) - self.capacity - 1)[len(summed) - self.capacity - 1]
+            keep = summed > threshold
+            summed, first = summed[keep] - threshold, first[keep]
+        self._values = np.array(
+            [self._values[i] if i < n_old else str(source.iloc[positions[i - n_old]]) for i in first], dtype=object
+        )
+        self._keys = all_keys[first]
+        self._counts = summed
+
+    def top(self, k: int) -> list[tuple[str, int]]:
+        """出現回数の多い順に k 件 (値, 推定回数)"""
+        order = np.argsort(-self._counts, kind="stable")[:k]
+        return [(str(self._values[i]), int(self._counts[i])) for i in order]
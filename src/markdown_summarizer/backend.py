@@ -0,0 +1,52 @@
+"""
+LLM バックエンド : OpenAI 互換の Chat Completions API の接続先・モデル・タイムアウトをまとめて扱う
+"""
+
+from dataclasses import dataclass
+from typing import Self
+
+import openai
+from openai import AsyncOpenAI
+
+from src.libs.settings import Settings
+
+
+@dataclass(frozen=True, slots=True)
+class LLMBackend:
+    """OpenAI 互換 API の接続設定
+
+    base_url を差し替えるだけで OpenAI 本家・互換サーバー・ローカルのモックサーバー (src.mock_llm) を切り替えられる。
+    """
+
+    api_key: str
+    base_url: str | None = None
+    model: str = "gpt-4o-mini"
+    # 読み取り (応答待ち) と接続確立のタイムアウト (秒)
+    timeout: float = 60.0
+    connect_timeout: float = 5.0
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> Self:
+        """環境変数 (.env) の設定からバックエンドを作る"""
+        return cls(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url,
+            model=settings.summarizer_model,
+            timeout=settings.openai_timeout_seconds,
+            connect_timeout=settings.openai_connect_timeout_seconds,
+        )
+
+    @property
+    def is_configured(self) -> bool:
+        """API を呼び出せる設定か (独自の接続先なら API キーは不要)"""
+        return bool(self.api_key) or self.base_url is not None
+
+    def client(self) -> AsyncOpenAI:
+        """非同期クライアントを作る。再試行は RequestScheduler が行うので SDK 側では行わない"""
+        return AsyncOpenAI(
+            # 互換サーバーではキーを検証しないことが多いが、SDK は空のキーを受け付けない
+            api_key=self.api_key or "unused",
+            base_url=self.base_url,
+            timeout=openai.Timeout(self.timeout, connect=self.connect_timeout),
+            max_retries=0,
+        )
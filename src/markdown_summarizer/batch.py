@@ -0,0 +1,108 @@
+"""
+一括要約 : 複数の Markdown 文書をリクエスト枠を共有しながら並行に要約し、終わった順に返す
+"""
+
+import asyncio
+import csv
+import dataclasses
+import io
+import json
+import time
+from collections.abc import AsyncGenerator
+from dataclasses import dataclass
+
+import openai
+import tiktoken
+from openai import AsyncOpenAI
+from pydantic import ValidationError
+
+from src.markdown_summarizer.pipeline import SummarizerConfig, summarize_markdown
+from src.markdown_summarizer.scheduler import RequestScheduler
+from src.markdown_summarizer.summary_cache import SummaryCache
+
+
+@dataclass(frozen=True, slots=True)
+class BatchResult:
+    """1 文書分の要約結果"""
+
+    name: str
+    summary: str = ""
+    keywords: tuple[str, ...] = ()
+    # 文書を分割したチャンク数と、そのうち API に問い合わせた数 (残りはキャッシュを再利用)
+    chunks: int = 0
+    summarized: int = 0
+    # 圧縮後の入力トークン数と、圧縮・切り詰めで削減したトークン数
+    input_tokens: int = 0
+    saved_tokens: int = 0
+    seconds: float = 0.0
+    # 失敗した場合のエラー内容
+    error: str | None = None
+
+
+async def summarize_batch(
+    client: AsyncOpenAI,
+    enc: tiktoken.Encoding,
+    docs: list[tuple[str, str]],
+    config: SummarizerConfig,
+    cache: SummaryCache | None = None,
+) -> AsyncGenerator[BatchResult]:
+    """複数の文書を並行に要約し、完了した順に結果を返す
+
+    すべての文書で 1 つの RequestScheduler を共有するため、API への同時リクエスト数は文書数によらず
+    config.max_concurrency 本以下に収まり、レート制限時のバックオフも全体で揃う。
+    1 文書の失敗はその文書の error に記録し、残りの文書の処理は続ける。
+
+    Args:
+        client: OpenAI の非同期クライアント
+        enc: トークン数の計測に使うエンコーダー
+        docs: (ファイル名, Markdown テキスト) のリスト
+        config: 要約リクエストの設定
+        cache: 要約の永続キャッシュ (None ならキャッシュしない)
+
+    Yields:
+        文書ごとの要約結果 (完了順)
+    """
+    scheduler = RequestScheduler(config.max_concurrency, max_retries=config.max_retries)
+    # 同時に処理する文書数も制限し、数百件を一度にチャンク分割・トークン化しないようにする
+    doc_slots = asyncio.Semaphore(config.max_concurrency)
+
+    async def summarize_doc(name: str, md: str) -> BatchResult:
+        async with doc_slots:
+            start = time.perf_counter()
+            try:
+                result, report = await summarize_markdown(client, enc, md, config, cache, scheduler)
+            except (openai.OpenAIError, ValidationError) as e:
+                return BatchResult(
+                    name=name, seconds=round(time.perf_counter() - start, 3), error=f"{type(e).__name__}: {e}"
+                )
+            return BatchResult(
+                name=name,
+                summary=result.summary,
+                keywords=tuple(result.keywords),
+                chunks=report.chunks,
+                summarized=report.summarized,
+                input_tokens=report.input_tokens,
+                saved_tokens=report.saved_tokens,
+                seconds=round(time.perf_counter() - start, 3),
+            )
+
+    for done in asyncio.as_completed([summarize_doc(name, md) for name, md in docs]):
+        yield await done
+
+
+def to_jsonl(results: list[BatchResult]) -> bytes:
+    """結果を 1 行 1 文書の JSON Lines にする"""
+    return "".join(json.dumps(dataclasses.asdict(r), ensure_ascii=False) + "\n" for r in results).encode()
+
+
+def to_csv(results: list[BatchResult]) -> bytes:
+    """結果を CSV にする (キーワードは「, 」区切りの 1 列)"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([f.name for f in dataclasses.fields(BatchResult)])
+    for r in results:
+        row = dataclasses.asdict(r)
+        row["keywords"] = ", ".join(r.keywords)
+        writer.writerow(row.values())
+    # Excel で開いても文字化けしないよう BOM を付ける
+    return buf.getvalue().encode("utf-8-sig")
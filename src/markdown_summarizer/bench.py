@@ -0,0 +1,153 @@
+"""
+要約のスループット計測 : モックサーバー (src.mock_llm) をプロセス内で起動し、課金・ネットワーク無しで一括要約を計測する
+
+実行例 : python -m src.markdown_summarizer.bench --docs 200 --concurrency 1 4 16
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+import tiktoken
+import uvicorn
+
+from src.markdown_summarizer.backend import LLMBackend
+from src.markdown_summarizer.batch import BatchResult, summarize_batch
+from src.markdown_summarizer.pipeline import SummarizerConfig
+from src.mock_llm.main import MockCompletionServer, MockConfig, MockStats
+
+
+def synthetic_docs(n_docs: int, *, max_sections: int = 40, seed: int = 0) -> list[tuple[str, str]]:
+    """見出し・段落・箇条書きを含む合成 Markdown 文書を作る (セクション数は 1〜max_sections で一様)
+
+    Args:
+        n_docs: 文書数
+        max_sections: 1 文書あたりの最大セクション数
+        seed: 乱数シード
+
+    Returns:
+        (ファイル名, Markdown テキスト) のリスト
+    """
+    rng = random.Random(seed)  # noqa: S311 (計測データ生成用)
+    words = ["モデル", "推論", "コスト", "レイテンシ", "スループット", "評価", "データ", "学習", "API", "GPU"]
+    docs = []
+    for i in range(n_docs):
+        lines = [f"# ノート {i}"]
+        for j in range(rng.randint(1, max_sections)):
+            lines.append(f"\n## セクション {j}\n")
+            lines.extend(" ".join(rng.choices(words, k=rng.randint(20, 80))) + "。" for _ in range(rng.randint(1, 4)))
+            lines.extend(f"- {rng.choice(words)} {k}" for k in range(rng.randint(0, 5)))
+        docs.append((f"note_{i:04d}.md", "\n".join(lines) + "\n"))
+    return docs
+
+
+@contextmanager
+def serve(server: MockCompletionServer) -> Iterator[str]:
+    """モックサーバーを別スレッドで起動し、ベース URL を返す"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    uv_server = uvicorn.Server(uvicorn.Config(server.app(), log_level="warning"))
+    thread = threading.Thread(target=uv_server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not uv_server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        uv_server.should_exit = True
+        thread.join()
+        sock.close()
+
+
+async def _run(
+    backend: LLMBackend, enc: tiktoken.Encoding, docs: list[tuple[str, str]], config: SummarizerConfig
+) -> list[BatchResult]:
+    async with backend.client() as client:
+        return [r async for r in summarize_batch(client, enc, docs, config)]
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[round(q) - 1] if len(values) > 1 else values[0]
+
+
+def main() -> None:
+    """モックサーバーに対して一括要約を同時リクエスト数ごとに実行し、スループットとレイテンシを表示する"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--docs", type=int, default=100, help="文書数")
+    parser.add_argument("--max-sections", type=int, default=40, help="1 文書あたりの最大セクション数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="同時リクエスト数 (複数指定可)")
+    parser.add_argument("--chunk-tokens", type=int, default=1_000, help="1 チャンクあたりの入力トークン上限")
+    parser.add_argument("--ttft", type=float, default=0.2, help="モックの最初のトークンまでの時間 (秒)")
+    parser.add_argument("--tps", type=float, default=200.0, help="モックの生成速度 (tokens/s)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="モックが 429 を返す確率")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="モックが 500 を返す確率")
+    parser.add_argument("--encoding", default="cl100k_base", help="tiktoken のエンコーディング名")
+    parser.add_argument("--json", type=Path, help="結果を JSON で書き出すパス")
+    args = parser.parse_args()
+
+    docs = synthetic_docs(args.docs, max_sections=args.max_sections)
+    enc = tiktoken.get_encoding(args.encoding)
+    mock = MockCompletionServer(
+        MockConfig(
+            ttft_seconds=args.ttft,
+            tokens_per_second=args.tps,
+            rate_limit_rate=args.rate_limit_rate,
+            server_error_rate=args.server_error_rate,
+            retry_after_seconds=0.2,
+            seed=0,
+        )
+    )
+
+    rows: list[dict[str, float]] = []
+    with serve(mock) as base_url:
+        backend = LLMBackend(api_key="", base_url=base_url, model="mock")
+        for concurrency in args.concurrency:
+            config = SummarizerConfig(model=backend.model, chunk_tokens=args.chunk_tokens, max_concurrency=concurrency)
+            mock.stats = MockStats()
+            start = time.perf_counter()
+            results = asyncio.run(_run(backend, enc, docs, config))
+            wall = time.perf_counter() - start
+            latencies = [r.seconds for r in results]
+            stats = mock.stats
+            rows.append(
+                {
+                    "concurrency": concurrency,
+                    "docs": len(results),
+                    "failed": sum(r.error is not None for r in results),
+                    "requests": stats.requests,
+                    "wall_s": round(wall, 3),
+                    "docs_per_s": round(len(results) / wall, 2),
+                    "requests_per_s": round(stats.requests / wall, 2),
+                    "doc_p50_s": round(_percentile(latencies, 50), 3),
+                    "doc_p95_s": round(_percentile(latencies, 95), 3),
+                    "peak_in_flight": stats.peak_in_flight,
+                    "rate_limited": stats.rate_limited,
+                    "server_errors": stats.server_errors,
+                }
+            )
+
+    columns = list(rows[0])
+    print("  ".join(f"{c:>14}" for c in columns))
+    for row in rows:
+        print("  ".join(f"{row[c]:>14}" for c in columns))
+    if args.json:
+        args.json.write_text(json.dumps(rows, indent=2) + "\n", encoding="utf-8")
+
+    # 同時リクエスト数の上限を超えていたらスケジューラーの退行なので失敗扱いにする
+    if any(row["peak_in_flight"] > row["concurrency"] for row in rows):
+        print("peak_in_flight exceeded the concurrency limit", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Markdown の分割 : 見出し境界でセクションに分け、トークン予算に収まるチャンクへまとめる
+"""
+
+import itertools
+import re
+
+import tiktoken
+
+_HEADING_RE = re.compile(r"^ {0,3}#{1,6}(\s|$)")
+_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+# チャンクを必ず区切る見出し (# と ##)
+_BLOCK_HEADING_RE = re.compile(r"^ {0,3}#{1,2}(\s|$)")
+
+
+def count_tokens(enc: tiktoken.Encoding, text: str) -> int:
+    """text のトークン数 (特殊トークン風の文字列も通常の文字として数える)"""
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def split_sections(md: str) -> list[str]:
+    """見出し行の直前で Markdown を分割する。コードブロック内の # 行では分割しない
+
+    Args:
+        md: Markdown テキスト
+
+    Returns:
+        セクションのリスト (連結すると元のテキストに戻る)
+    """
+    sections: list[str] = []
+    current: list[str] = []
+    fence: str | None = None
+    for line in md.splitlines(keepends=True):
+        if m := _FENCE_RE.match(line):
+            marker = m.group(1)
+            if fence is None:
+                fence = marker
+            elif marker[0] == fence[0] and len(marker) >= len(fence):
+                fence = None
+        elif fence is None and _HEADING_RE.match(line) and current:
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def _split_oversized(enc: tiktoken.Encoding, text: str, max_tokens: int) -> list[str]:
+    """1 セクションが予算を超える場合、段落 → 行 → トークン列の順に細かく分割する"""
+    for sep in ("\n\n", "\n"):
+        pieces = text.split(sep)
+        if sum(1 for p in pieces if p) > 1:
+            parts = [p + sep for p in pieces[:-1]] + [pieces[-1]]
+            return _pack(enc, [p for p in parts if p], max_tokens)
+    # 改行の無い長い行はトークン境界で切る。マルチバイト文字を壊さないよう文字位置に変換して切り出す
+    tokens = enc.encode(text, disallowed_special=())
+    _, offsets = enc.decode_with_offsets(tokens)
+    cuts = sorted({*offsets[::max_tokens][1:], 0, len(text)})
+    return [text[a:b] for a, b in itertools.pairwise(cuts) if a < b]
+
+
+def _pack(enc: tiktoken.Encoding, parts: list[str], max_tokens: int) -> list[str]:
+    """連続する断片を予算に収まる限り 1 チャンクに詰める"""
+    chunks: list[str] = []
+    current: list[str] = []
+    current_tokens = 0
+    for part in parts:
+        n = count_tokens(enc, part)
+        if n > max_tokens:
+            if current:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_oversized(enc, part, max_tokens))
+            continue
+        if current and current_tokens + n > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(part)
+        current_tokens += n
+    if current:
+        chunks.append("".join(current))
+    return [c for c in chunks if c.strip()]
+
+
+def split_blocks(sections: list[str]) -> list[list[str]]:
+    """セクションを # / ## 見出しの位置でブロックにまとめる
+
+    Args:
+        sections: split_sections の結果
+
+    Returns:
+        ブロックごとのセクションのリスト
+    """
+    blocks: list[list[str]] = []
+    for section in sections:
+        if not blocks or _BLOCK_HEADING_RE.match(section):
+            blocks.append([])
+        blocks[-1].append(section)
+    return blocks
+
+
+def chunk_markdown(enc: tiktoken.Encoding, md: str, max_tokens: int) -> list[str]:
+    """Markdown を見出し境界で max_tokens 以下のチャンクにまとめる
+
+    全体が予算に収まる場合は 1 チャンクのまま返す。収まらない場合は # / ## 見出しの位置で必ず区切り、
+    ブロックの中だけで詰め合わせる。文書の一部を編集しても他のブロックのチャンクは変わらないため、
+    チャンク単位の要約キャッシュをそのまま再利用できる。
+
+    Args:
+        enc: トークン数の計測に使うエンコーダー
+        md: Markdown テキスト
+        max_tokens: 1 チャンクあたりのトークン上限
+
+    Returns:
+        チャンクのリスト
+    """
+    if count_tokens(enc, md) <= max_tokens:
+        return [md] if md.strip() else []
+    chunks: list[str] = []
+    for block in split_blocks(split_sections(md)):
+        chunks.extend(_pack(enc, block, max_tokens))
+    return chunks
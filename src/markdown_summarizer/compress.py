@@ -0,0 +1,169 @@
+"""
+入力の圧縮 : 要約に寄与しにくい Markdown の構文を削って短くし、入力トークンの上限に収める
+"""
+
+import re
+from dataclasses import dataclass
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import tiktoken
+
+from src.markdown_summarizer.chunking import count_tokens, split_sections
+
+_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})\s*([\w+-]*)")
+# ChatGPT の出典リンク [oai_citation_attribution:0‡OpenAI](https://...) (直前の空白ごと削る)
+_CITATION_RE = re.compile(r"[^\S\n]*\[oai_citation(?:_attribution)?:\d+‡[^\]]*\]\([^)\s]*\)")
+# 画像とリンク。リンク先に空白や括弧を含まない単純な形だけを扱う
+_LINK_RE = re.compile(r"(!?)\[([^\]]*)\]\(([^)\s]+)(?:\s+\"[^\"]*\")?\)")
+_ANCHOR_RE = re.compile(r"<a\s+(?:name|id)=\"[^\"]*\"\s*>\s*</a>", re.IGNORECASE)
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+_TABLE_ROW_RE = re.compile(r"^ {0,3}\|.*\|\s*$")
+_TABLE_DELIMITER_RE = re.compile(r"^ {0,3}\|(\s*:?-{3,}:?\s*\|)+\s*$")
+_RULE_RE = re.compile(r"^ {0,3}([-*_])(\s*\1){2,}\s*$")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+# リンク先から取り除くトラッキング用のクエリパラメータ
+_TRACKING_PARAMS = ("utm_", "goal", "fbclid", "gclid")
+
+# 表の本文を残す最大行数 (超えた分は行数だけを残す)
+TABLE_MAX_ROWS = 20
+
+
+@dataclass(frozen=True, slots=True)
+class PreparedInput:
+    """API に送る直前の入力と、圧縮・切り詰めによるトークン数の変化"""
+
+    text: str
+    # 元の Markdown のトークン数
+    original_tokens: int
+    # 送信するテキストのトークン数
+    tokens: int
+    # 上限を超えたため末尾を切り詰めたかどうか
+    truncated: bool = False
+
+    @property
+    def saved_tokens(self) -> int:
+        """圧縮・切り詰めで削減したトークン数"""
+        return self.original_tokens - self.tokens
+
+
+def _clean_url(url: str) -> str:
+    """リンク先からトラッキング用のクエリパラメータを取り除く"""
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not k.startswith(_TRACKING_PARAMS)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _condense_table(rows: list[str]) -> list[str]:
+    """表を区切り行と余分な空白を除いた「a | b | c」形式の行にまとめ、長い表は先頭の行だけを残す"""
+    cells = [" | ".join(c.strip() for c in row.strip().strip("|").split("|")) + "\n" for row in rows]
+    header, body = cells[0], cells[1:]
+    if len(body) > TABLE_MAX_ROWS:
+        body = [*body[:TABLE_MAX_ROWS], f"(他 {len(body) - TABLE_MAX_ROWS} 行省略)\n"]
+    return [header, *body]
+
+
+def _condense_blocks(lines: list[str]) -> list[str]:
+    """コードブロックを言語と行数だけの 1 行に置き換え、表を圧縮する"""
+    out: list[str] = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if m := _FENCE_RE.match(line):
+            marker, lang = m.group(1), m.group(2)
+            end = i + 1
+            while end < len(lines) and not (
+                (close := _FENCE_RE.match(lines[end]))
+                and close.group(1)[0] == marker[0]
+                and len(close.group(1)) >= len(marker)
+            ):
+                end += 1
+            out.append(f"[コード{f' ({lang})' if lang else ''}: {max(end - i - 1, 0)} 行省略]\n")
+            i = end + 1
+            continue
+        if _TABLE_ROW_RE.match(line) and i + 1 < len(lines) and _TABLE_DELIMITER_RE.match(lines[i + 1]):
+            end = i + 2
+            while end < len(lines) and _TABLE_ROW_RE.match(lines[end]):
+                end += 1
+            out.extend(_condense_table([line, *lines[i + 2 : end]]))
+            i = end
+            continue
+        out.append(line)
+        i += 1
+    return out
+
+
+def compress_markdown(md: str) -> str:
+    """要約に寄与しにくい構文を削って Markdown を短くする
+
+    - コードブロックは言語と行数だけを残す
+    - 表は区切り行と桁揃えの空白を除き、TABLE_MAX_ROWS 行を超える分は行数だけを残す
+    - ChatGPT の出典リンク、HTML のアンカー・コメント、水平線を取り除く
+    - 文書内リンクと 2 回目以降に現れるリンクはテキストだけを残し、リンク先のトラッキング用パラメータを除く
+
+    圧縮済みのテキストをもう一度渡しても変化しない (同じ文書から常に同じキャッシュキーが得られる)。
+
+    Args:
+        md: Markdown テキスト
+
+    Returns:
+        圧縮した Markdown テキスト
+    """
+    text = _CITATION_RE.sub("", _ANCHOR_RE.sub("", _COMMENT_RE.sub("", md)))
+    lines = [line for line in _condense_blocks(text.splitlines(keepends=True)) if not _RULE_RE.match(line)]
+
+    seen: set[str] = set()
+
+    def replace_link(m: re.Match[str]) -> str:
+        image, label, url = m.groups()
+        url = _clean_url(url)
+        if image or url.startswith("#") or url in seen:
+            return label
+        seen.add(url)
+        return f"[{label}]({url})"
+
+    text = _LINK_RE.sub(replace_link, "".join(lines))
+    text = _BLANK_LINES_RE.sub("\n\n", text).strip()
+    return text + "\n" if md.endswith("\n") else text
+
+
+def _truncate(enc: tiktoken.Encoding, md: str, max_tokens: int) -> str:
+    """見出し単位のセクションを先頭から max_tokens に収まるだけ残す。先頭のセクションだけで超える場合はトークン境界で切る"""
+    kept: list[str] = []
+    total = 0
+    for section in split_sections(md):
+        n = count_tokens(enc, section)
+        if total + n > max_tokens:
+            break
+        kept.append(section)
+        total += n
+    if kept:
+        return "".join(kept).rstrip() + "\n"
+    tokens = enc.encode(md, disallowed_special=())
+    _, offsets = enc.decode_with_offsets(tokens[: max_tokens + 1])
+    # マルチバイト文字を壊さないよう、max_tokens + 1 個目のトークンが始まる文字位置で切る
+    return md[: offsets[max_tokens]]
+
+
+def prepare_input(
+    enc: tiktoken.Encoding, md: str, *, compress: bool = True, max_tokens: int | None = None
+) -> PreparedInput:
+    """Markdown を圧縮し、入力トークンの上限に収める
+
+    Args:
+        enc: トークン数の計測に使うエンコーダー
+        md: Markdown テキスト
+        compress: False なら圧縮せず、上限の確認だけを行う
+        max_tokens: 入力トークンの上限 (None なら上限なし)。超えた分は末尾のセクションから削る
+
+    Returns:
+        送信するテキストとトークン数の内訳
+    """
+    original = count_tokens(enc, md)
+    text = compress_markdown(md) if compress and md.strip() else md
+    tokens = count_tokens(enc, text) if text is not md else original
+    if max_tokens is None or tokens <= max_tokens:
+        return PreparedInput(text=text, original_tokens=original, tokens=tokens)
+    text = _truncate(enc, text, max_tokens)
+    return PreparedInput(text=text, original_tokens=original, tokens=count_tokens(enc, text), truncated=True)
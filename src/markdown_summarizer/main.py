@@ -2,14 +2,27 @@
 Streamlit sample : Markdown ノートを ChatGPT で要約 & キーワード抽出
 """
 
-import json
+import dataclasses
 
 import streamlit as st
-import tiktoken
-from openai import OpenAI
-from pydantic import BaseModel
+from streamlit.runtime.uploaded_file_manager import UploadedFile
 
+from src.libs.metrics import metrics, start_exporters
 from src.libs.settings import settings
+from src.markdown_summarizer.backend import LLMBackend
+from src.markdown_summarizer.batch import BatchResult, summarize_batch, to_csv, to_jsonl
+from src.markdown_summarizer.compress import PreparedInput
+from src.markdown_summarizer.models import SummaryResponse
+from src.markdown_summarizer.pipeline import (
+    SummarizerConfig,
+    SummaryReport,
+    SummaryStream,
+    document_keys,
+    prepare_document,
+    stream_summary,
+    summarize_markdown,
+)
+from src.markdown_summarizer.resources import SummarizerResources, load_resources
 
 # ────────────────────────────────
 #   ページ設定
@@ -20,18 +33,43 @@ st.title("📝 Markdown Summarizer & Keyword Extractor")
 # ────────────────────────────────
 #   API キー確認
 # ────────────────────────────────
-if not settings.openai_api_key:
-    st.error("OpenAI API キーが設定されていません。.env ファイルに OPENAI_API_KEY を設定してください。")
+backend = LLMBackend.from_settings(settings)
+if not backend.is_configured:
+    st.error(
+        "OpenAI API キーが設定されていません。.env ファイルに OPENAI_API_KEY "
+        "(または OpenAI 互換サーバーの OPENAI_BASE_URL) を設定してください。"
+    )
     st.stop()
 
-client = OpenAI(api_key=settings.openai_api_key)
+
+@st.cache_resource(show_spinner="初回起動の準備中です…")
+def get_resources() -> SummarizerResources:
+    """プロセス内で共有するリソース (API クライアント・トークナイザー・要約キャッシュ) を 1 度だけ読み込む"""
+    loaded = load_resources(settings)
+    metrics.register_cache("summary", loaded.cache.stats)
+    # 計測値のサイドカー HTTP サーバー・ログ出力もプロセスごとに 1 度だけ起動する
+    start_exporters(settings.metrics_port, settings.metrics_log_interval_seconds)
+    return loaded
+
+
+resources = get_resources()
+# トークン数の計測・チャンク分割用エンコーダー
+enc = resources.enc
+config = SummarizerConfig(
+    model=backend.model,
+    chunk_tokens=settings.summarizer_chunk_tokens,
+    max_concurrency=settings.summarizer_max_concurrency,
+    max_retries=settings.summarizer_max_retries,
+    input_token_budget=settings.summarizer_input_token_budget,
+)
 
 # ────────────────────────────────
 #   入力: ファイル or テキストエリア
 # ────────────────────────────────
-uploaded = st.file_uploader(
-    "Markdown (.md / .txt) をアップロードするか、下のテキストエリアに直接貼り付けてください",
+uploads = st.file_uploader(
+    "Markdown (.md / .txt) をアップロードするか、下のテキストエリアに直接貼り付けてください (複数ファイルで一括要約)",
     type=["md", "txt"],
+    accept_multiple_files=True,
 )
 
 default_md = """\
@@ -325,72 +363,117 @@ score = compare_pair(llm, reference_model="gpt-4o", dataset="arena-hard")
 
 text_input = st.text_area(
     "▼ 直接入力する場合はこちら",
-    default_md if uploaded is None else "",
+    "" if uploads else default_md,
     height=250,
 )
 
 # 再実行ボタン
 rerun_button = st.button("🔄 テキストを変更して再実行", type="primary")
-
-if uploaded:
-    text_md = uploaded.read().decode("utf-8")
-elif text_input.strip():
-    text_md = text_input
-else:
-    st.info("Markdown を入力／アップロードすると結果が表示されます。")
-    st.stop()
-
-
-# ────────────────────────────────
-#   structured output 用モデル
-# ────────────────────────────────
-class SummaryResponse(BaseModel):
-    summary: str
-    keywords: list[str]
+streaming = st.toggle("⚡ 要約を生成しながら表示する", value=True)
+compress = st.toggle("🗜 表・コード・出典リンク等を圧縮してから送る", value=True)
+config = dataclasses.replace(config, compress_input=compress)
 
 
 # ────────────────────────────────
 #   OpenAI へ問い合わせ
 # ────────────────────────────────
-@st.cache_data(show_spinner="ChatGPT が要約中です…")
-def call_openai(md: str) -> SummaryResponse:
+@metrics.timed("markdown_summarizer.call_openai")
+def call_openai(md: PreparedInput) -> tuple[SummaryResponse, SummaryReport]:
     """
     OpenAI API を使用して Markdown テキストを要約・キーワード抽出する。
-    Structured output を用いるため文字列パースは不要。
+    入力は prepare_document で圧縮・入力トークン上限の確認を済ませたもの。
+    トークン上限を超える長文は見出し境界で分割し、チャンクごとの要約を並行に実行してから統合する。
+    要約はチャンクの内容ごとにディスクへキャッシュされ、編集したチャンクだけが再要約される。
     """
-    # 入力トークン数の軽い検査（極端な長文のときに警告したい場合などに使用）
-    enc = tiktoken.get_encoding("cl100k_base")
-    _ = len(enc.encode(md))
-
-    system_msg = (
-        "あなたは優秀な日本語編集者です。\n"
-        "ユーザーから渡される Markdown ノートを 300 文字以内で要約し、主要キーワードを最大 10 語抽出して下さい。\n"
-        '出力は JSON で {"summary": ..., "keywords": [...]} 形式とします。'
+    return resources.loop.run(summarize_markdown(resources.client, enc, md, config, resources.cache))
+
+
+# ────────────────────────────────
+#   一括要約 (複数ファイル)
+# ────────────────────────────────
+def batch_row(r: BatchResult) -> dict[str, object]:
+    """結果テーブルの 1 行"""
+    return {
+        "ファイル": r.name,
+        "要約": r.summary if r.error is None else f"⚠️ {r.error}",
+        "キーワード": ", ".join(r.keywords),
+        "再要約チャンク": f"{r.summarized} / {r.chunks}",
+        "入力トークン": r.input_tokens,
+        "削減トークン": r.saved_tokens,
+        "秒": round(r.seconds, 2),
+    }
+
+
+def run_batch(docs: list[tuple[str, str]], batch_config: SummarizerConfig) -> list[BatchResult]:
+    """文書をまとめて要約し、完了した文書から順に結果テーブルへ追加する"""
+    progress = st.progress(0.0, text=f"0 / {len(docs)} 件完了")
+    table = st.empty()
+    results: list[BatchResult] = []
+    batch = summarize_batch(resources.client, enc, docs, batch_config, resources.cache)
+    for r in resources.loop.iterate(batch):
+        results.append(r)
+        progress.progress(len(results) / len(docs), text=f"{len(results)} / {len(docs)} 件完了")
+        table.dataframe([batch_row(r) for r in results], use_container_width=True)
+    progress.empty()
+    table.empty()
+    return results
+
+
+def display_batch(files: list[UploadedFile]) -> None:
+    """複数ファイルを一括要約し、結果テーブルとダウンロードを表示する"""
+    st.subheader(f"📚 一括要約 ({len(files)} ファイル)")
+    concurrency = st.slider("同時リクエスト数", 1, 32, settings.summarizer_max_concurrency)
+    docs = [(f.name, f.getvalue().decode("utf-8", errors="replace")) for f in files]
+
+    if rerun_button:
+        for _, md in docs:
+            resources.cache.discard(document_keys(enc, md, config))
+        st.success("アップロードした文書のキャッシュをクリアしました。新しい要約を生成します。")
+
+    # 同じファイル群なら、ウィジェット操作による再実行で要約し直さない
+    signature = tuple(f.file_id for f in files)
+    stored = st.session_state.get("batch_results")
+    if rerun_button or stored is None or stored[0] != signature:
+        results = run_batch(docs, dataclasses.replace(config, max_concurrency=concurrency))
+        st.session_state["batch_results"] = (signature, results)
+    else:
+        results = stored[1]
+
+    failed = sum(r.error is not None for r in results)
+    reused = sum(r.chunks - r.summarized for r in results)
+    saved = sum(r.saved_tokens for r in results)
+    st.caption(
+        f"{len(results)} 件完了 (失敗 {failed} 件) / キャッシュを再利用したチャンク {reused} 件"
+        f" / 圧縮で削減した入力 {saved:,} トークン"
     )
+    st.dataframe([batch_row(r) for r in results], use_container_width=True)
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0.3,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": md},
-        ],
-        max_tokens=600,
+    col_jsonl, col_csv = st.columns(2)
+    col_jsonl.download_button(
+        "🔽 JSONL で保存", to_jsonl(results), file_name="summaries.jsonl", mime="application/jsonl"
     )
+    col_csv.download_button("🔽 CSV で保存", to_csv(results), file_name="summaries.csv", mime="text/csv")
 
-    # content は必ず JSON 文字列で返る
-    data = json.loads(response.choices[0].message.content or "{}")
-    return SummaryResponse(**data)
 
+if len(uploads) > 1:
+    display_batch(uploads)
+    st.stop()
 
-# ボタンが押されたらキャッシュをクリア
-if rerun_button:
-    call_openai.clear()
-    st.success("キャッシュをクリアしました。新しい要約を生成します。")
+if uploads:
+    text_md = uploads[0].getvalue().decode("utf-8")
+elif text_input.strip():
+    text_md = text_input
+else:
+    st.info("Markdown を入力／アップロードすると結果が表示されます。")
+    st.stop()
+
+# 送信前に圧縮・入力トークン上限の確認を行う (キャッシュキーも圧縮後のテキストから決まる)
+prepared = prepare_document(enc, text_md, config)
 
-with st.spinner("OpenAI へ問い合わせ中…"):
-    result = call_openai(text_md)
+# ボタンが押されたら、この文書の要約キャッシュだけを削除する
+if rerun_button:
+    resources.cache.discard(document_keys(enc, prepared, config))
+    st.success("この文書のキャッシュをクリアしました。新しい要約を生成します。")
 
 # ────────────────────────────────
 #   結果表示
@@ -398,9 +481,50 @@ with st.spinner("OpenAI へ問い合わせ中…"):
 st.subheader("📄 入力 Markdown（抜粋）")
 MAX_LEN = 2000
 st.code(text_md[:MAX_LEN] + (" …" if len(text_md) > MAX_LEN else ""), language="markdown")
+st.caption(
+    f"入力 {prepared.original_tokens:,} トークン → 送信 {prepared.tokens:,} トークン "
+    f"({prepared.saved_tokens:,} トークン削減)"
+)
+if prepared.truncated:
+    st.warning(
+        f"入力トークン上限 ({config.input_token_budget:,}) を超えたため、文書の末尾を削って要約します。"
+        "上限は SUMMARIZER_INPUT_TOKEN_BUDGET で変更できます。"
+    )
+if prepared.text != text_md:
+    with st.expander("🗜 送信するテキスト (圧縮後)"):
+        st.code(prepared.text, language="markdown")
 
 st.subheader("📝 要約")
-st.write(result.summary)
+if streaming:
+    out = SummaryStream()
+    with metrics.timer("markdown_summarizer.stream_summary"):
+        st.write_stream(
+            resources.loop.iterate(stream_summary(resources.client, enc, prepared, config, out, resources.cache))
+        )
+    result, report = out.get()
+else:
+    with st.spinner("ChatGPT が要約中です…"):
+        result, report = call_openai(prepared)
+    st.write(result.summary)
+
+if report.chunks > 1:
+    st.caption(f"{report.chunks} チャンク中 {report.summarized} チャンクを要約 (残りはキャッシュを再利用)")
+for timing in report.timings:
+    metrics.observe(f"markdown_summarizer.request.{timing.stage}", timing.total)
+if report.timings:
+    final = report.timings[-1]
+    st.caption(f"最初のトークンまで {final.ttft:.2f} 秒 / 完了まで {final.total:.2f} 秒")
+    # セッション内のリクエストごとのレイテンシを蓄積して推移を追えるようにする
+    history = st.session_state.setdefault("request_timings", [])
+    history.extend({"stage": t.stage, "ttft_s": round(t.ttft, 3), "total_s": round(t.total, 3)} for t in report.timings)
+if history := st.session_state.get("request_timings"):
+    with st.expander(f"⏱ リクエストごとのレイテンシ ({len(history)} 件)"):
+        st.dataframe(history, use_container_width=True)
+with st.expander("🚀 リソースの読み込み時間 (プロセスごとに初回のみ)"):
+    st.dataframe(
+        [{"resource": name, "seconds": round(sec, 3)} for name, sec in resources.load_seconds.items()],
+        use_container_width=True,
+    )
 
 st.subheader("🔑 キーワード")
 st.write(", ".join(result.keywords))
@@ -0,0 +1,13 @@
+"""
+要約結果のモデル
+"""
+
+from pydantic import BaseModel
+
+
+# ────────────────────────────────
+#   structured output 用モデル
+# ────────────────────────────────
+class SummaryResponse(BaseModel):
+    summary: str
+    keywords: list[str]
@@ -0,0 +1,439 @@
+"""
+要約パイプライン : 長文をチャンクに分けて並行に要約 (map) し、部分要約を 1 つに統合 (reduce) する
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from collections.abc import AsyncGenerator
+from dataclasses import dataclass, field, replace
+from typing import Literal
+
+import tiktoken
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessageParam
+
+from src.markdown_summarizer.chunking import chunk_markdown, count_tokens
+from src.markdown_summarizer.compress import PreparedInput, prepare_input
+from src.markdown_summarizer.models import SummaryResponse
+from src.markdown_summarizer.scheduler import RequestScheduler
+from src.markdown_summarizer.streaming import SummaryStreamParser
+from src.markdown_summarizer.summary_cache import SummaryCache, summary_key
+
+logger = logging.getLogger(__name__)
+
+type Stage = Literal["single", "map", "reduce"]
+
+# 統合後に残すキーワード数の上限 (プロンプトの「最大 10 語」と揃える)
+MAX_KEYWORDS = 10
+
+SYSTEM_PROMPT = (
+    "あなたは優秀な日本語編集者です。\n"
+    "ユーザーから渡される Markdown ノートを 300 文字以内で要約し、主要キーワードを最大 10 語抽出して下さい。\n"
+    '出力は JSON で {"summary": ..., "keywords": [...]} 形式とします。'
+)
+MAP_PROMPT = (
+    "あなたは優秀な日本語編集者です。\n"
+    "ユーザーから渡されるのは長い Markdown 文書の一部です。この部分を 300 文字以内で要約し、"
+    "主要キーワードを最大 10 語抽出して下さい。\n"
+    '出力は JSON で {"summary": ..., "keywords": [...]} 形式とします。'
+)
+REDUCE_PROMPT = (
+    "あなたは優秀な日本語編集者です。\n"
+    "ユーザーから長い Markdown 文書の各部分の要約 (sections) と、出現頻度順のキーワード候補 (keyword_candidates) が"
+    " JSON で渡されます。\n"
+    "文書全体の要約を 300 文字以内でまとめ、文書全体を代表するキーワードを候補から最大 10 語選んで下さい。\n"
+    '出力は JSON で {"summary": ..., "keywords": [...]} 形式とします。'
+)
+
+
+@dataclass(frozen=True, slots=True)
+class SummarizerConfig:
+    """要約リクエストの設定"""
+
+    model: str = "gpt-4o-mini"
+    # 1 チャンクあたりの入力トークン上限
+    chunk_tokens: int = 6_000
+    # 同時に投げるリクエスト数の上限
+    max_concurrency: int = 4
+    # 一時的なエラー (レート制限等) の再試行回数
+    max_retries: int = 5
+    temperature: float = 0.3
+    max_output_tokens: int = 600
+    # 表・コードブロック・出典リンク等を圧縮してから送るかどうか
+    compress_input: bool = True
+    # 文書 1 件あたりの入力トークン上限 (None なら上限なし)。超えた分は末尾のセクションから削る
+    input_token_budget: int | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class RequestTiming:
+    """1 リクエストのレイテンシ (秒)"""
+
+    stage: Stage
+    # 最初のトークンが届くまでの時間 (ストリーミングしないリクエストでは total と同じ)
+    ttft: float
+    total: float
+
+
+@dataclass(frozen=True, slots=True)
+class SummaryReport:
+    """1 回の要約処理の内訳"""
+
+    # 文書を分割したチャンク数
+    chunks: int
+    # API に問い合わせたチャンク数 (残りはキャッシュを再利用)
+    summarized: int
+    # 圧縮後の入力トークン数と、圧縮・切り詰めで削減したトークン数
+    input_tokens: int = 0
+    saved_tokens: int = 0
+    # 実際に投げたリクエストごとのレイテンシ
+    timings: tuple[RequestTiming, ...] = ()
+
+
+@dataclass(slots=True)
+class SummaryStream:
+    """stream_summary の結果の受け皿。テキストを流し終えると result / report が埋まる"""
+
+    result: SummaryResponse | None = None
+    report: SummaryReport | None = None
+
+    def get(self) -> tuple[SummaryResponse, SummaryReport]:
+        """確定した要約と内訳を返す
+
+        Returns:
+            文書全体の要約とキーワード、処理の内訳
+
+        Raises:
+            RuntimeError: ストリームを最後まで読み終えていない場合
+        """
+        if self.result is None or self.report is None:
+            msg = "stream_summary has not finished"
+            raise RuntimeError(msg)
+        return self.result, self.report
+
+
+@dataclass(slots=True)
+class _Run:
+    """1 回の要約処理で共有する状態"""
+
+    client: AsyncOpenAI
+    config: SummarizerConfig
+    scheduler: RequestScheduler
+    timings: list[RequestTiming] = field(default_factory=list)
+
+    def record(self, stage: Stage, start: float, first: float | None) -> None:
+        """リクエストのレイテンシを記録する"""
+        end = time.perf_counter()
+        timing = RequestTiming(stage=stage, ttft=(first or end) - start, total=end - start)
+        self.timings.append(timing)
+        logger.info("%s request: ttft=%.3fs total=%.3fs", stage, timing.ttft, timing.total)
+
+
+def _messages(system: str, user: str) -> list[ChatCompletionMessageParam]:
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+
+async def complete_json(run: _Run, stage: Stage, system: str, user: str) -> SummaryResponse:
+    """1 回のチャット補完で JSON 形式の要約を得る
+
+    Args:
+        run: 要約処理の状態
+        stage: レイテンシの記録に使う処理段階
+        system: システムプロンプト
+        user: ユーザーメッセージ
+
+    Returns:
+        要約とキーワード
+    """
+    config = run.config
+    async with run.scheduler.slot():
+        start = time.perf_counter()
+        response = await run.scheduler.call(
+            lambda: run.client.chat.completions.create(
+                model=config.model,
+                temperature=config.temperature,
+                response_format={"type": "json_object"},
+                messages=_messages(system, user),
+                max_tokens=config.max_output_tokens,
+            )
+        )
+        run.record(stage, start, None)
+    # content は必ず JSON 文字列で返る
+    return SummaryResponse.model_validate_json(response.choices[0].message.content or "{}")
+
+
+async def stream_json(
+    run: _Run, stage: Stage, system: str, user: str, parser: SummaryStreamParser
+) -> AsyncGenerator[str]:
+    """ストリーミングのチャット補完を行い、summary のテキストを届いた分だけ返す
+
+    全体を受信し終えたら parser.result() で検証済みの要約を取り出せる。
+
+    Args:
+        run: 要約処理の状態
+        stage: レイテンシの記録に使う処理段階
+        system: システムプロンプト
+        user: ユーザーメッセージ
+        parser: 応答を逐次パースするパーサー
+
+    Yields:
+        summary に追加されたテキスト
+    """
+    config = run.config
+    async with run.scheduler.slot():
+        start = time.perf_counter()
+        first: float | None = None
+        # 再試行するのは応答が始まる前のエラーだけ (ストリームの途中で切れた場合はそのまま失敗させる)
+        stream = await run.scheduler.call(
+            lambda: run.client.chat.completions.create(
+                model=config.model,
+                temperature=config.temperature,
+                response_format={"type": "json_object"},
+                messages=_messages(system, user),
+                max_tokens=config.max_output_tokens,
+                stream=True,
+            )
+        )
+        # 読み終えたら (途中で中断されても) HTTP 応答を閉じ、イベントループの終了時に後始末が残らないようにする
+        async with stream:
+            async for chunk in stream:
+                if not chunk.choices or not (delta := chunk.choices[0].delta.content):
+                    continue
+                if first is None:
+                    first = time.perf_counter()
+                if text := parser.feed(delta):
+                    yield text
+        run.record(stage, start, first)
+
+
+def chunk_keys(chunks: list[str], config: SummarizerConfig) -> list[str]:
+    """チャンクごとの要約キャッシュのキー (1 チャンクのみの文書は全体要約のプロンプトで要約する)"""
+    prompt = SYSTEM_PROMPT if len(chunks) == 1 else MAP_PROMPT
+    return [summary_key(config.model, prompt, chunk) for chunk in chunks]
+
+
+def document_key(keys: list[str], config: SummarizerConfig) -> str:
+    """チャンクの要約を統合した結果のキャッシュキー (チャンクのキー列から決まる)"""
+    return summary_key(config.model, REDUCE_PROMPT, "\n".join(keys))
+
+
+def prepare_document(enc: tiktoken.Encoding, md: str | PreparedInput, config: SummarizerConfig) -> PreparedInput:
+    """config に従って文書を圧縮し、入力トークンの上限に収める (準備済みの入力はそのまま返す)
+
+    Args:
+        enc: トークン数の計測に使うエンコーダー
+        md: Markdown テキスト、または準備済みの入力
+        config: 要約リクエストの設定
+
+    Returns:
+        送信するテキストとトークン数の内訳
+    """
+    if isinstance(md, PreparedInput):
+        return md
+    return prepare_input(enc, md, compress=config.compress_input, max_tokens=config.input_token_budget)
+
+
+def document_keys(enc: tiktoken.Encoding, md: str | PreparedInput, config: SummarizerConfig) -> list[str]:
+    """文書の要約に使うキャッシュキーをすべて返す。文書単位でキャッシュを削除するときに使う
+
+    Args:
+        enc: トークン数の計測に使うエンコーダー
+        md: Markdown テキスト、または準備済みの入力
+        config: 要約リクエストの設定
+
+    Returns:
+        チャンクごとのキーと、統合結果のキー
+    """
+    text = prepare_document(enc, md, config).text
+    keys = chunk_keys(chunk_markdown(enc, text, config.chunk_tokens) or [text], config)
+    return keys if len(keys) == 1 else [*keys, document_key(keys, config)]
+
+
+async def stream_summary(
+    client: AsyncOpenAI,
+    enc: tiktoken.Encoding,
+    md: str | PreparedInput,
+    config: SummarizerConfig,
+    out: SummaryStream,
+    cache: SummaryCache | None = None,
+    *,
+    stream: bool = True,
+    scheduler: RequestScheduler | None = None,
+) -> AsyncGenerator[str]:
+    """Markdown を要約・キーワード抽出し、最後のリクエストの summary を生成しながら返す
+
+    chunk_tokens に収まる文書は 1 リクエストで要約する。超える文書は見出し境界でチャンクに分け、
+    max_concurrency 本までの並行リクエストで各チャンクを要約してから統合する。ストリーミングするのは
+    文書全体の要約を生成するリクエスト (1 チャンクならその要約、複数チャンクなら統合) だけである。
+    cache を渡すとチャンクの内容ごとに要約を保存し、編集されていないチャンクは問い合わせずに再利用する。
+    文書は送信前に prepare_document で圧縮し、入力トークンの上限に収める。
+
+    Args:
+        client: OpenAI の非同期クライアント
+        enc: トークン数の計測に使うエンコーダー
+        md: Markdown テキスト、または prepare_document で準備済みの入力
+        config: 要約リクエストの設定
+        out: 確定した要約と内訳を受け取るオブジェクト
+        cache: 要約の永続キャッシュ (None ならキャッシュしない)
+        stream: False なら最後のリクエストもストリーミングせず、何も yield しない
+        scheduler: 複数の文書でリクエスト枠を共有する場合のスケジューラー (None なら config から作る)
+
+    Yields:
+        文書全体の summary に追加されたテキスト
+    """
+    prepared = prepare_document(enc, md, config)
+    logger.info(
+        "input tokens: %d -> %d (saved %d%s)",
+        prepared.original_tokens,
+        prepared.tokens,
+        prepared.saved_tokens,
+        ", truncated" if prepared.truncated else "",
+    )
+    chunks = chunk_markdown(enc, prepared.text, config.chunk_tokens) or [prepared.text]
+    keys = chunk_keys(chunks, config)
+    final_key = keys[0] if len(chunks) == 1 else document_key(keys, config)
+    report = SummaryReport(
+        chunks=len(chunks), summarized=0, input_tokens=prepared.tokens, saved_tokens=prepared.saved_tokens
+    )
+    if cache is not None and (cached := cache.get(final_key)) is not None:
+        out.result, out.report = cached, report
+        if stream:
+            yield cached.summary
+        return
+
+    if scheduler is None:
+        scheduler = RequestScheduler(config.max_concurrency, max_retries=config.max_retries)
+    run = _Run(client=client, config=config, scheduler=scheduler)
+    if len(chunks) == 1:
+        stage: Stage = "single"
+        system, user = SYSTEM_PROMPT, chunks[0]
+        summarized = 1
+    else:
+        partials, summarized = await _map_chunks(run, chunks, keys, cache)
+        stage = "reduce"
+        system, user = REDUCE_PROMPT, await _reduce_input(run, enc, partials)
+
+    if stream:
+        parser = SummaryStreamParser()
+        async for text in stream_json(run, stage, system, user, parser):
+            yield text
+        result = parser.result()
+    else:
+        result = await complete_json(run, stage, system, user)
+    if stage == "reduce":
+        result = _normalize_keywords(result)
+    if cache is not None:
+        cache.put(final_key, result)
+    out.result = result
+    out.report = replace(report, summarized=summarized, timings=tuple(run.timings))
+
+
+async def summarize_markdown(
+    client: AsyncOpenAI,
+    enc: tiktoken.Encoding,
+    md: str | PreparedInput,
+    config: SummarizerConfig,
+    cache: SummaryCache | None = None,
+    scheduler: RequestScheduler | None = None,
+) -> tuple[SummaryResponse, SummaryReport]:
+    """Markdown を要約・キーワード抽出する (ストリーミングしない版の stream_summary)
+
+    Args:
+        client: OpenAI の非同期クライアント
+        enc: トークン数の計測に使うエンコーダー
+        md: Markdown テキスト、または prepare_document で準備済みの入力
+        config: 要約リクエストの設定
+        cache: 要約の永続キャッシュ (None ならキャッシュしない)
+        scheduler: 複数の文書でリクエスト枠を共有する場合のスケジューラー (None なら config から作る)
+
+    Returns:
+        文書全体の要約とキーワード、処理の内訳
+    """
+    out = SummaryStream()
+    async for _ in stream_summary(client, enc, md, config, out, cache, stream=False, scheduler=scheduler):
+        pass
+    return out.get()
+
+
+async def _map_chunks(
+    run: _Run, chunks: list[str], keys: list[str], cache: SummaryCache | None
+) -> tuple[list[SummaryResponse], int]:
+    """各チャンクを並行に要約する。キャッシュ済みのチャンクは問い合わせない
+
+    Args:
+        run: 要約処理の状態
+        chunks: チャンクのリスト
+        keys: チャンクごとのキャッシュキー
+        cache: 要約の永続キャッシュ (None ならキャッシュしない)
+
+    Returns:
+        チャンクごとの要約と、API に問い合わせたチャンク数
+    """
+    summarized = 0
+
+    async def summarize_chunk(key: str, chunk: str) -> SummaryResponse:
+        nonlocal summarized
+        if cache is not None and (cached := cache.get(key)) is not None:
+            return cached
+        response = await complete_json(run, "map", MAP_PROMPT, chunk)
+        summarized += 1
+        if cache is not None:
+            cache.put(key, response)
+        return response
+
+    partials = await asyncio.gather(*(summarize_chunk(k, c) for k, c in zip(keys, chunks, strict=True)))
+    return list(partials), summarized
+
+
+def _reduce_payload(partials: list[SummaryResponse]) -> str:
+    """部分要約とキーワード候補 (出現頻度順) を reduce 用の JSON にまとめる"""
+    counts = Counter(kw.strip() for p in partials for kw in p.keywords if kw.strip())
+    return json.dumps(
+        {
+            "sections": [p.summary for p in partials],
+            "keyword_candidates": [kw for kw, _ in counts.most_common()],
+        },
+        ensure_ascii=False,
+    )
+
+
+def _normalize_keywords(result: SummaryResponse) -> SummaryResponse:
+    """キーワードの重複・空白を除き、上限数に切り詰める"""
+    keywords = list(dict.fromkeys(kw.strip() for kw in result.keywords if kw.strip()))
+    return SummaryResponse(summary=result.summary, keywords=keywords[:MAX_KEYWORDS])
+
+
+async def _reduce_input(run: _Run, enc: tiktoken.Encoding, partials: list[SummaryResponse]) -> str:
+    """部分要約を統合リクエストの入力にまとめる
+
+    部分要約の合計が chunk_tokens を超える場合は、前半・後半を並行に統合してから入力にする。
+
+    Args:
+        run: 要約処理の状態
+        enc: トークン数の計測に使うエンコーダー
+        partials: チャンクごとの要約
+
+    Returns:
+        統合リクエストに渡す JSON
+    """
+    payload = _reduce_payload(partials)
+    if len(partials) > 2 and count_tokens(enc, payload) > run.config.chunk_tokens:
+        mid = len(partials) // 2
+        halves = await asyncio.gather(
+            _reduce_summaries(run, enc, partials[:mid]),
+            _reduce_summaries(run, enc, partials[mid:]),
+        )
+        payload = _reduce_payload(list(halves))
+    return payload
+
+
+async def _reduce_summaries(run: _Run, enc: tiktoken.Encoding, partials: list[SummaryResponse]) -> SummaryResponse:
+    """部分要約を 1 つの要約に統合する (階層的な統合の途中段階)"""
+    result = await complete_json(run, "reduce", REDUCE_PROMPT, await _reduce_input(run, enc, partials))
+    return _normalize_keywords(result)
@@ -0,0 +1,106 @@
+"""
+プロセス全体で共有するリソース : 常駐イベントループ・接続プール付き API クライアント・トークナイザー・要約キャッシュ
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections.abc import AsyncGenerator, Coroutine, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any
+
+import tiktoken
+from openai import AsyncOpenAI
+
+from src.libs.settings import Settings
+from src.markdown_summarizer.backend import LLMBackend
+from src.markdown_summarizer.summary_cache import SummaryCache
+
+logger = logging.getLogger(__name__)
+
+# トークン数の計測・チャンク分割に使うエンコーディング
+TOKENIZER = "cl100k_base"
+
+
+class BackgroundLoop:
+    """専用スレッドで動き続けるイベントループ
+
+    httpx の接続プールは作成したイベントループに結び付くため、Streamlit の再実行ごとに asyncio.run で
+    新しいループを作ると keep-alive 接続を使い回せない。非同期処理をすべてこのループで実行して接続を共有する。
+    """
+
+    def __init__(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="summarizer-loop", daemon=True)
+        self._thread.start()
+
+    def run[T](self, coro: Coroutine[Any, Any, T]) -> T:
+        """coro をこのループで実行し、完了まで待って結果を返す"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def iterate[T](self, agen: AsyncGenerator[T]) -> Iterator[T]:
+        """非同期ジェネレーターをこのループで進め、値を呼び出し元のスレッドで 1 つずつ返す
+
+        Streamlit の要素の更新は呼び出し元 (スクリプト) のスレッドで行う必要があるため、値だけを受け渡す。
+        途中で反復をやめた場合も agen を閉じ、HTTP ストリーム等の後始末をこのループで行う。
+        """
+
+        async def step() -> T:
+            return await anext(agen)
+
+        try:
+            while True:
+                try:
+                    yield self.run(step())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(agen.aclose())
+
+
+@dataclass(frozen=True, slots=True)
+class SummarizerResources:
+    """要約に使う重いリソース一式"""
+
+    loop: BackgroundLoop
+    client: AsyncOpenAI
+    enc: tiktoken.Encoding
+    cache: SummaryCache
+    # リソースごとの読み込み時間 (秒)
+    load_seconds: dict[str, float]
+
+
+@contextmanager
+def _timed(timings: dict[str, float], name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
+def load_resources(settings: Settings) -> SummarizerResources:
+    """要約に使うリソースを読み込む。プロセスごとに 1 度だけ呼ぶ想定 (st.cache_resource 等で共有する)
+
+    Args:
+        settings: 環境変数 (.env) の設定
+
+    Returns:
+        共有リソース一式
+    """
+    timings: dict[str, float] = {}
+    with _timed(timings, "tokenizer"):
+        # BPE 表は TIKTOKEN_CACHE_DIR にあれば読み込むだけ (無ければダウンロードする)
+        enc = tiktoken.get_encoding(TOKENIZER)
+    with _timed(timings, "event_loop"):
+        loop = BackgroundLoop()
+    with _timed(timings, "client"):
+        client = LLMBackend.from_settings(settings).client()
+    with _timed(timings, "summary_cache"):
+        cache = SummaryCache(
+            settings.cache_dir / "summaries",
+            max_bytes=settings.summary_cache_max_bytes,
+            ttl=settings.summary_cache_ttl_seconds,
+        )
+    logger.info("summarizer resources loaded: %s", {k: round(v, 3) for k, v in timings.items()})
+    return SummarizerResources(loop=loop, client=client, enc=enc, cache=cache, load_seconds=timings)
@@ -0,0 +1,93 @@
+"""
+リクエストスケジューラー : 同時リクエスト数を制限し、レート制限時はすべてのリクエストで足並みを揃えて待つ
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+# 再試行するエラー (レート制限・一時的な接続断・サーバーエラー)
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+# Retry-After ヘッダーを信用する上限 (秒)
+MAX_RETRY_AFTER = 60.0
+
+
+def retry_after(error: openai.OpenAIError) -> float | None:
+    """エラー応答の Retry-After (-Ms) ヘッダーが示す待ち時間 (秒)。無ければNone"""
+    if not isinstance(error, openai.APIStatusError):
+        return None
+    headers = error.response.headers
+    for header, divisor in (("retry-after-ms", 1000), ("retry-after", 1)):
+        try:
+            seconds = float(headers[header]) / divisor
+        except (KeyError, ValueError):
+            continue
+        if 0 < seconds <= MAX_RETRY_AFTER:
+            return seconds
+    return None
+
+
+class RequestScheduler:
+    """API リクエストの同時実行数と再試行を管理する
+
+    - slot() で同時に実行中のリクエストを max_concurrency 本までに制限する
+    - call() は一時的なエラーを指数バックオフ (ジッター付き) で再試行する
+    - レート制限 (429) を受けたら Retry-After まで全リクエストの送信を止め、制限を悪化させない
+    """
+
+    def __init__(
+        self, max_concurrency: int, *, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # この時刻 (time.monotonic) までは新しいリクエストを送らない
+        self._resume_at = 0.0
+        self.retries = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """同時実行数の枠を 1 つ確保する"""
+        async with self._semaphore:
+            yield
+
+    async def call[T](self, request: Callable[[], Awaitable[T]]) -> T:
+        """request を実行し、一時的なエラーなら待ってから再試行する
+
+        待機中も slot() の枠は保持したままにする (レート制限中は他のリクエストも送れないため)。
+
+        Args:
+            request: API を呼び出すコルーチン関数 (再試行のたびに呼び直す)
+
+        Returns:
+            request の戻り値
+
+        Raises:
+            openai.OpenAIError: 再試行できないエラー、または再試行回数を使い切った場合
+        """
+        attempt = 0
+        while True:
+            if (wait := self._resume_at - time.monotonic()) > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await request()
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_after(e) or min(self.max_delay, self.base_delay * 2**attempt) * random.uniform(0.5, 1.0)  # noqa: S311
+                if isinstance(e, openai.RateLimitError):
+                    self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                attempt += 1
+                self.retries += 1
+                logger.warning(
+                    "%s; retrying in %.1fs (attempt %d/%d)", type(e).__name__, delay, attempt, self.max_retries
+                )
+                await asyncio.sleep(delay)
@@ -0,0 +1,139 @@
+"""
+ストリーミング応答の逐次パース : 生成途中の JSON から summary の文字列を取り出す
+"""
+
+import re
+
+from src.markdown_summarizer.models import SummaryResponse
+
+# "summary" キーの値 (文字列) の開始位置。エスケープされた \"summary\" には一致させない
+_SUMMARY_START_RE = re.compile(r'(?<!\\)"summary"\s*:\s*"')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_HEX4_RE = re.compile(r"[0-9a-fA-F]{4}")
+_HIGH_SURROGATES = range(0xD800, 0xDC00)
+_LOW_SURROGATES = range(0xDC00, 0xE000)
+
+
+class _InvalidEscapeError(ValueError):
+    """JSON として不正なエスケープ"""
+
+
+class SummaryStreamParser:
+    """生成途中の JSON 文字列を受け取り、summary の値を確定した分だけ返す
+
+    エスケープ (\\n や \\uXXXX) が断片の途中で切れている場合は、続きが届くまで出力を保留する。
+    不正なエスケープに出会ったらそこで逐次表示をやめ、エラーは result() の検証に任せる。
+    """
+
+    def __init__(self) -> None:
+        self._buf = ""
+        # summary の値のうち、次に読む位置 (値の開始が未着ならNone)
+        self._pos: int | None = None
+        self._done = False
+
+    def feed(self, delta: str) -> str:
+        """応答の断片を追加し、新たに確定した summary のテキストを返す
+
+        Args:
+            delta: ストリームで届いた応答の断片
+
+        Returns:
+            summary に追加された文字列 (無ければ空文字)
+        """
+        self._buf += delta
+        if self._done:
+            return ""
+        if self._pos is None:
+            m = _SUMMARY_START_RE.search(self._buf)
+            if m is None:
+                return ""
+            self._pos = m.end()
+
+        buf, i = self._buf, self._pos
+        out: list[str] = []
+        while i < len(buf):
+            c = buf[i]
+            if c == '"':
+                self._done = True
+                i += 1
+                break
+            if c != "\\":
+                out.append(c)
+                i += 1
+                continue
+            try:
+                decoded = _decode_escape(buf, i)
+            except _InvalidEscapeError:
+                self._done = True
+                break
+            if decoded is None:
+                break
+            text, i = decoded
+            out.append(text)
+        self._pos = i
+        return "".join(out)
+
+    def result(self) -> SummaryResponse:
+        """受信し終えた応答全体を SummaryResponse として検証して返す
+
+        Returns:
+            検証済みの要約
+
+        Raises:
+            pydantic.ValidationError: 応答が JSON として不正、またはスキーマに合わない場合
+        """
+        return SummaryResponse.model_validate_json(self._buf)
+
+
+def _decode_escape(buf: str, i: int) -> tuple[str, int] | None:
+    """buf[i] から始まるエスケープを復号する
+
+    Args:
+        buf: 受信済みの応答
+        i: バックスラッシュの位置
+
+    Returns:
+        (復号した文字, 次に読む位置)。エスケープが途中で切れている場合はNone
+
+    Raises:
+        _InvalidEscapeError: 未知のエスケープ・16 進数でない \\u・対になっていないサロゲートの場合
+    """
+    if i + 1 >= len(buf):
+        return None
+    if buf[i + 1] != "u":
+        if buf[i + 1] not in _ESCAPES:
+            raise _InvalidEscapeError(buf[i : i + 2])
+        return _ESCAPES[buf[i + 1]], i + 2
+    if i + 6 > len(buf):
+        return None
+    code = _hex4(buf, i + 2)
+    if code in _LOW_SURROGATES:
+        raise _InvalidEscapeError(buf[i : i + 6])
+    if code not in _HIGH_SURROGATES:
+        return chr(code), i + 6
+    return _decode_surrogate_pair(buf, i, code)
+
+
+def _decode_surrogate_pair(buf: str, i: int, high: int) -> tuple[str, int] | None:
+    """上位サロゲート (buf[i:i+6]) に続く下位サロゲートの \\uXXXX と合わせて 1 文字に復号する
+
+    下位側が届くまでは None を返して待つ。届いた分が \\u で始まらない・下位サロゲートでない場合は
+    _InvalidEscapeError を送出する。
+    """
+    tail = buf[i + 6 : i + 8]
+    if not "\\u".startswith(tail):
+        raise _InvalidEscapeError(buf[i : i + 8])
+    if i + 12 > len(buf):
+        return None
+    low = _hex4(buf, i + 8)
+    if low not in _LOW_SURROGATES:
+        raise _InvalidEscapeError(buf[i : i + 12])
+    return chr(0x10000 + ((high - 0xD800) << 10) + (low - 0xDC00)), i + 12
+
+
+def _hex4(buf: str, i: int) -> int:
+    """buf[i] から 4 桁の 16 進数を読む (int() が受け付ける空白・符号・_ は認めない)"""
+    digits = buf[i : i + 4]
+    if not _HEX4_RE.fullmatch(digits):
+        raise _InvalidEscapeError(digits)
+    return int(digits, 16)
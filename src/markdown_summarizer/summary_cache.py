@@ -0,0 +1,81 @@
+"""
+要約結果の永続キャッシュ : 入力テキスト・モデル・プロンプトのハッシュをキーにして要約を保存する
+"""
+
+import hashlib
+from collections.abc import Iterable
+from pathlib import Path
+
+from pydantic import ValidationError
+
+from src.libs.disk_cache import CacheStats, DiskCache
+from src.markdown_summarizer.models import SummaryResponse
+
+
+def summary_key(model: str, prompt: str, text: str) -> str:
+    """要約リクエストの内容から決まるキャッシュキー
+
+    モデルやプロンプトを変えると別のキーになるため、古い要約が返ることはない。
+
+    Args:
+        model: モデル名
+        prompt: システムプロンプト
+        text: 要約対象のテキスト
+
+    Returns:
+        16 進のハッシュ文字列
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in (model, prompt, text):
+        data = part.encode()
+        # 区切りの曖昧さを無くすため、各要素の長さも混ぜる
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class SummaryCache:
+    """要約結果を 1 件 1 JSON ファイルで保存する永続キャッシュ (容量上限・TTL 付き)"""
+
+    def __init__(self, root: Path, *, max_bytes: int, ttl: float | None) -> None:
+        self._disk = DiskCache(root, suffix=".json", max_bytes=max_bytes, ttl=ttl)
+
+    def get(self, key: str) -> SummaryResponse | None:
+        """キーに対応する要約を返す。無い・期限切れ・壊れている場合はNone
+
+        Args:
+            key: summary_key で求めたキー
+
+        Returns:
+            キャッシュ済みの要約、なければNone
+        """
+        path = self._disk.get(key)
+        if path is None:
+            return None
+        try:
+            return SummaryResponse.model_validate_json(path.read_bytes())
+        except (FileNotFoundError, ValidationError):
+            self._disk.discard(key)
+            return None
+
+    def put(self, key: str, response: SummaryResponse) -> None:
+        """要約を保存する
+
+        Args:
+            key: summary_key で求めたキー
+            response: 保存する要約
+        """
+
+        def write(path: Path) -> None:
+            path.write_text(response.model_dump_json(), encoding="utf-8")
+
+        self._disk.put(key, write)
+
+    def discard(self, keys: Iterable[str]) -> None:
+        """指定したキーの要約を削除する"""
+        for key in keys:
+            self._disk.discard(key)
+
+    def stats(self) -> CacheStats:
+        """現在の利用統計を返す"""
+        return self._disk.stats()
@@ -0,0 +1,50 @@
+"""
+起動前のウォームアップ : アプリのポートを開く前に重いモジュールを読み込み、トークナイザーの BPE 表を取得しておく
+
+scripts/launch.sh と Dockerfile から実行する。別プロセスなので効果はディスク側 (BPE 表の TIKTOKEN_CACHE_DIR への保存、
+.pyc の生成、OS のページキャッシュ) に残り、アプリ本体の初回読み込みからダウンロードとコンパイルの時間が無くなる。
+"""
+
+import importlib
+import json
+import os
+import sys
+import time
+
+# 読み込みに時間のかかるモジュール (アプリの import 順)
+HEAVY_MODULES = (
+    "streamlit",
+    "openai",
+    "pydantic_settings",
+    "tiktoken",
+    "src.markdown_summarizer.pipeline",
+    "src.markdown_summarizer.batch",
+    "src.markdown_summarizer.resources",
+)
+
+
+def main() -> None:
+    """重いモジュールの import とトークナイザーの読み込みにかかった時間を JSON で出力する"""
+    timings: dict[str, float] = {}
+    start = time.perf_counter()
+    # import 時間を計測するため、このモジュールの先頭では読み込まない
+    for name in HEAVY_MODULES:
+        t = time.perf_counter()
+        importlib.import_module(name)
+        timings[f"import {name}"] = time.perf_counter() - t
+
+    tokenizer = sys.modules["src.markdown_summarizer.resources"].TOKENIZER
+    t = time.perf_counter()
+    sys.modules["tiktoken"].get_encoding(tokenizer)
+    timings[f"tokenizer {tokenizer}"] = time.perf_counter() - t
+    timings["total"] = time.perf_counter() - start
+
+    report = {
+        "warmup_seconds": {name: round(sec, 3) for name, sec in timings.items()},
+        "tiktoken_cache_dir": os.environ.get("TIKTOKEN_CACHE_DIR"),
+    }
+    sys.stdout.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+OpenAI 互換のモック Chat Completions サーバー : 課金・ネットワーク無しで要約アプリの負荷試験を行うためのもの
+
+起動例 : uvicorn src.mock_llm.main:app --port 8600 (設定は MOCK_LLM_* 環境変数)
+"""
+
+import asyncio
+import dataclasses
+import hashlib
+import json
+import random
+import time
+import uuid
+from collections.abc import AsyncIterator, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any
+
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+
+class MockConfig(BaseSettings):
+    # 応答の速さ
+    ttft_seconds: float = Field(0.3, description="最初のトークンを返すまでの時間 (秒)")
+    tokens_per_second: float = Field(50.0, description="最初のトークン以降の生成速度")
+    output_tokens: int = Field(120, description="1 応答あたりの生成トークン数")
+    # エラー注入 (確率)
+    rate_limit_rate: float = Field(0.0, description="429 (レート制限) を返す確率")
+    server_error_rate: float = Field(0.0, description="500 を返す確率")
+    retry_after_seconds: float = Field(1.0, description="429 の Retry-After (秒)")
+    seed: int | None = Field(None, description="エラー注入の乱数シード")
+
+    model_config = SettingsConfigDict(env_prefix="MOCK_LLM_", extra="ignore")
+
+
+@dataclass(slots=True)
+class MockStats:
+    """サーバーが受けたリクエストの統計"""
+
+    requests: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    rate_limited: int = 0
+    server_errors: int = 0
+    completion_tokens: int = 0
+
+
+def _error(status: int, message: str, error_type: str, headers: dict[str, str] | None = None) -> JSONResponse:
+    """OpenAI と同じ形式のエラー応答"""
+    body = {"error": {"message": message, "type": error_type, "param": None, "code": None}}
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+def _fake_tokens(prompt: str, n_tokens: int) -> list[str]:
+    """プロンプトから決まる疑似的な出力 ({"summary", "keywords"} の JSON) をトークン相当の断片に分けて返す"""
+    digest = hashlib.blake2b(prompt.encode(), digest_size=4).hexdigest()
+    words = [f"要約{digest}"] + [f"語{i}" for i in range(max(n_tokens - 12, 0))]
+    content = json.dumps(
+        {"summary": " ".join(words), "keywords": [f"キーワード{i}" for i in range(5)]},
+        ensure_ascii=False,
+    )
+    # おおよそ 1 トークン 4 文字として分割する
+    size = max(len(content) // max(n_tokens, 1), 1)
+    return [content[i : i + size] for i in range(0, len(content), size)]
+
+
+class MockCompletionServer:
+    """設定どおりの遅延・生成速度・エラーで応答する Chat Completions エンドポイント"""
+
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self.stats = MockStats()
+        self._rng = random.Random(config.seed)  # noqa: S311 (エラー注入用で暗号用途ではない)
+
+    def app(self) -> Starlette:
+        """Starlette アプリを作る"""
+        routes = [
+            Route("/v1/chat/completions", self.completions, methods=["POST"]),
+            Route("/stats", self.get_stats, methods=["GET"]),
+            Route("/stats/reset", self.reset_stats, methods=["POST"]),
+            Route("/healthz", ping, methods=["GET"]),
+        ]
+        return Starlette(routes=routes)
+
+    async def completions(self, request: Request) -> Response:
+        """POST /v1/chat/completions"""
+        body: dict[str, Any] = await request.json()
+        config, stats = self.config, self.stats
+        stats.requests += 1
+        if (error := self._inject_error()) is not None:
+            return error
+
+        prompt = "".join(str(m.get("content", "")) for m in body.get("messages", []))
+        n_tokens = min(config.output_tokens, int(body.get("max_tokens") or config.output_tokens))
+        pieces = _fake_tokens(prompt, n_tokens)
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        model = str(body.get("model", "mock"))
+        stats.completion_tokens += len(pieces)
+
+        if body.get("stream"):
+            return StreamingResponse(self._stream(completion_id, model, pieces), media_type="text/event-stream")
+
+        with self._in_flight():
+            await asyncio.sleep(config.ttft_seconds + max(len(pieces) - 1, 0) / config.tokens_per_second)
+        prompt_tokens = len(prompt) // 4
+        return JSONResponse(
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(pieces)},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(pieces),
+                    "total_tokens": prompt_tokens + len(pieces),
+                },
+            }
+        )
+
+    async def get_stats(self, _: Request) -> JSONResponse:
+        """GET /stats"""
+        return JSONResponse({"config": self.config.model_dump(), **dataclasses.asdict(self.stats)})
+
+    async def reset_stats(self, _: Request) -> JSONResponse:
+        """POST /stats/reset (処理中のリクエスト数は保持する)"""
+        self.stats = MockStats(in_flight=self.stats.in_flight)
+        return JSONResponse(dataclasses.asdict(self.stats))
+
+    def _inject_error(self) -> JSONResponse | None:
+        """設定された確率で 429 / 500 のエラー応答を返す"""
+        draw = self._rng.random()
+        if draw < self.config.rate_limit_rate:
+            self.stats.rate_limited += 1
+            retry_after_ms = str(int(self.config.retry_after_seconds * 1000))
+            return _error(429, "Rate limit reached (mock)", "requests", headers={"retry-after-ms": retry_after_ms})
+        if draw < self.config.rate_limit_rate + self.config.server_error_rate:
+            self.stats.server_errors += 1
+            return _error(500, "Internal server error (mock)", "server_error")
+        return None
+
+    @contextmanager
+    def _in_flight(self) -> Iterator[None]:
+        """処理中のリクエスト数を数える"""
+        self.stats.in_flight += 1
+        self.stats.peak_in_flight = max(self.stats.peak_in_flight, self.stats.in_flight)
+        try:
+            yield
+        finally:
+            self.stats.in_flight -= 1
+
+    async def _stream(self, completion_id: str, model: str, pieces: list[str]) -> AsyncIterator[str]:
+        """SSE 形式で 1 断片ずつ返す。最初の断片までは ttft_seconds、以降は tokens_per_second の速さ"""
+        with self._in_flight():
+            created = int(time.time())
+            await asyncio.sleep(self.config.ttft_seconds)
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(1 / self.config.tokens_per_second)
+                delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+                yield _sse(completion_id, model, created, delta, None)
+            yield _sse(completion_id, model, created, {}, "stop")
+            yield "data: [DONE]\n\n"
+
+
+def ping(_: Request) -> PlainTextResponse:
+    return PlainTextResponse("ok")
+
+
+def _sse(completion_id: str, model: str, created: int, delta: dict[str, str], finish_reason: str | None) -> str:
+    """ストリーミング応答 (chat.completion.chunk) の 1 イベント"""
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+
+app = MockCompletionServer(MockConfig()).app()
@@ -0,0 +1,138 @@
+"""
+共有データセット : デモ用データと検索用の配列を 1 度だけファイルに書き出し、各ワーカーはメモリマップで参照する
+
+uvicorn のワーカーを複数起動しても、データ本体・ソート済みの列・大陸ごとの行位置は OS のページキャッシュ上の
+1 部だけを共有し、プロセスごとのコピーや再計算は行わない。本番起動 (scripts/launch.sh の shiny_demo_prod) では
+ワーカーを起動する前に ``python -m src.shiny_demo.dataset`` で書き出しておく。
+"""
+
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from src.libs.settings import settings
+from src.shiny_demo.groups import GroupIndex
+from src.shiny_demo.histogram import SortedColumn
+
+CONTINENTS = ["Africa", "Americas", "Asia", "Europe", "Oceania"]
+HIST_COLUMNS = ["lifeExp", "gdpPercap", "pop"]
+SEED = 42
+
+
+@dataclass(frozen=True, slots=True)
+class SharedDataset:
+    """デモ用データと、ヒストグラム・大陸フィルター用のインデックス"""
+
+    frame: pd.DataFrame
+    continent_index: GroupIndex
+    hist_columns: dict[str, SortedColumn]
+
+
+def generate_frame(n_rows: int, seed: int = SEED) -> pd.DataFrame:
+    """デモ用のデータを生成する
+
+    Args:
+        n_rows: 行数
+        seed: 乱数のシード
+
+    Returns:
+        デモ用のDataFrame
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "lifeExp": rng.normal(72, 10, n_rows).round(1),
+            "gdpPercap": rng.lognormal(10, 1, n_rows).round(0),
+            "pop": rng.integers(100_000, 100_000_000, n_rows, dtype=np.int64),
+            # 文字列の object 列ではなく、1 行 1 バイトのコードを持つ category 型で保持する
+            "continent": pd.Categorical.from_codes(
+                rng.integers(0, len(CONTINENTS), n_rows, dtype=np.int8), dtype=pd.CategoricalDtype(CONTINENTS)
+            ),
+        }
+    )
+
+
+def dataset_dir(root: Path, n_rows: int) -> Path:
+    """行数ごとの保存先"""
+    return root / f"demo-{n_rows}-{SEED}"
+
+
+def write_dataset(root: Path, n_rows: int) -> Path:
+    """データとインデックスを生成して書き出す。既に書き出し済みなら何もしない
+
+    一時ディレクトリに書いてから rename するため、複数のプロセスが同時に呼んでも書きかけのファイルは見えない。
+
+    Args:
+        root: 保存先の親ディレクトリ
+        n_rows: 行数
+
+    Returns:
+        書き出したディレクトリ
+    """
+    target = dataset_dir(root, n_rows)
+    if target.exists():
+        return target
+    root.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=root, prefix=".tmp-"))
+    # mkdtemp は所有者だけが読める権限で作るため、別ユーザーのワーカーからも読めるようにする
+    tmp.chmod(0o755)
+    try:
+        df = generate_frame(n_rows)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        # 圧縮しない IPC ファイルにして、読み込み側がページキャッシュをそのまま参照できるようにする
+        with pa.OSFile(str(tmp / "frame.arrow"), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        index = GroupIndex.from_categorical(df["continent"])
+        np.save(tmp / "continent_order.npy", index.order)
+        np.save(tmp / "continent_offsets.npy", index.offsets)
+        for col in HIST_COLUMNS:
+            np.save(tmp / f"sorted_{col}.npy", SortedColumn.from_values(df[col].to_numpy()).values)
+        tmp.rename(target)
+    except OSError:
+        # 他のプロセスが先に書き出した場合は、そちらを使う
+        if not target.exists():
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return target
+
+
+def load_dataset(root: Path, n_rows: int) -> SharedDataset:
+    """書き出したデータとインデックスをメモリマップで開く (無ければ書き出してから開く)
+
+    Args:
+        root: 保存先の親ディレクトリ
+        n_rows: 行数
+
+    Returns:
+        デモ用データとインデックス
+    """
+    path = write_dataset(root, n_rows)
+    table = pa.ipc.open_file(pa.memory_map(str(path / "frame.arrow"))).read_all()
+    frame = table.to_pandas(split_blocks=True)
+    continent_index = GroupIndex(
+        labels=tuple(str(c) for c in frame["continent"].cat.categories),
+        order=np.load(path / "continent_order.npy", mmap_mode="r"),
+        offsets=np.load(path / "continent_offsets.npy"),
+    )
+    hist_columns = {col: SortedColumn(np.load(path / f"sorted_{col}.npy", mmap_mode="r")) for col in HIST_COLUMNS}
+    return SharedDataset(frame=frame, continent_index=continent_index, hist_columns=hist_columns)
+
+
+def shared_root() -> Path:
+    """共有データセットの保存先 (CACHE_DIR 配下)"""
+    return settings.cache_dir / "shiny_demo"
+
+
+def main() -> None:
+    """SHINY_DEMO_ROWS 行のデータセットを書き出し、保存先を表示する"""
+    print(write_dataset(shared_root(), settings.shiny_demo_rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+グループインデックス : カテゴリ列の値ごとに行位置を 1 度だけまとめておき、絞り込みを O(該当行数) で返す
+"""
+
+from dataclasses import dataclass
+from typing import Self
+
+import numpy as np
+from pandas import Series
+
+
+@dataclass(frozen=True, slots=True)
+class GroupIndex:
+    """カテゴリ列の値 → 行位置の対応表"""
+
+    labels: tuple[str, ...]
+    # グループ順 (グループ内は元の行順) に並べた行位置。先頭には欠損の行が並ぶ
+    order: np.ndarray
+    # labels[i] の行位置は order[offsets[i] : offsets[i + 1]]
+    offsets: np.ndarray
+
+    @classmethod
+    def from_categorical(cls, values: Series) -> Self:
+        """category 型の列から作る
+
+        Args:
+            values: category 型の列
+
+        Returns:
+            列のカテゴリごとのインデックス
+        """
+        codes = values.cat.codes.to_numpy()
+        labels = tuple(str(c) for c in values.cat.categories)
+        # 欠損 (-1) を 0 番にずらして数え、累積和をグループの開始位置にする
+        counts = np.bincount(codes.astype(np.int64) + 1, minlength=len(labels) + 1)
+        return cls(labels=labels, order=np.argsort(codes, kind="stable"), offsets=np.cumsum(counts))
+
+    def positions(self, label: str) -> np.ndarray:
+        """label の行位置 (昇順)。order のビューなのでコピーしない
+
+        Args:
+            label: カテゴリの値
+
+        Returns:
+            該当する行位置 (存在しない値なら空)
+        """
+        if label not in self.labels:
+            return self.order[:0]
+        i = self.labels.index(label)
+        return self.order[self.offsets[i] : self.offsets[i + 1]]
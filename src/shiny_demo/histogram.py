@@ -0,0 +1,65 @@
+"""
+ヒストグラム : 列をソート済みの配列として 1 度だけ保持し、任意のビン数へ二分探索で集計し直す
+"""
+
+from dataclasses import dataclass
+from typing import Self
+
+import numpy as np
+from matplotlib.figure import Figure
+
+
+@dataclass(frozen=True, slots=True)
+class SortedColumn:
+    """ヒストグラム用に欠損を除いて昇順に並べた列の値"""
+
+    values: np.ndarray
+
+    @classmethod
+    def from_values(cls, values: np.ndarray) -> Self:
+        """列の値から作る (NaN・無限大は除く)"""
+        data = np.asarray(values, dtype=np.float64)
+        return cls(np.sort(data[np.isfinite(data)]))
+
+    def histogram(self, bins: int) -> tuple[np.ndarray, np.ndarray]:
+        """最小値〜最大値を bins 等分した度数を返す (np.histogram と同じ結果)
+
+        ビンの境界をソート済みの値に二分探索するだけなので、計算量は行数によらず O(bins log n) で済む。
+
+        Args:
+            bins: ビン数
+
+        Returns:
+            各ビンの度数と、bins + 1 個のビンの境界
+        """
+        if not len(self.values):
+            return np.zeros(bins, dtype=np.int64), np.linspace(0.0, 1.0, bins + 1)
+        lo, hi = float(self.values[0]), float(self.values[-1])
+        if lo == hi:
+            # np.histogram と同じく、値が 1 種類だけなら前後 0.5 の幅を取る
+            lo, hi = lo - 0.5, hi + 0.5
+        edges = np.linspace(lo, hi, bins + 1)
+        # 各ビンは左閉右開。最後のビンだけは最大値を含める
+        positions = np.searchsorted(self.values, edges, side="left")
+        positions[-1] = len(self.values)
+        return np.diff(positions), edges
+
+
+def histogram_figure(counts: np.ndarray, edges: np.ndarray, title: str) -> Figure:
+    """度数と境界から棒グラフを描く
+
+    pyplot のグローバルな状態を使わずに Figure を直接作るため、複数のセッションから同時に描画しても干渉しない。
+
+    Args:
+        counts: 各ビンの度数
+        edges: ビンの境界
+        title: グラフのタイトル
+
+    Returns:
+        描画した Figure
+    """
+    fig = Figure()
+    ax = fig.subplots()
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align="edge", edgecolor="white")
+    ax.set_title(title)
+    return fig
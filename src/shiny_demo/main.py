@@ -1,27 +1,44 @@
-import io
-from collections.abc import Generator
+from collections.abc import Iterator
+from typing import cast
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from matplotlib.figure import Figure
 from shiny import App, Inputs, Outputs, Session, reactive, render, ui
 from starlette.applications import Starlette
 from starlette.requests import Request
 from starlette.responses import PlainTextResponse
 from starlette.routing import Mount, Route
 
+from src.libs.export import EXPORT_FORMATS, ExportFormat, iter_export
+from src.libs.metrics import CONTENT_TYPE, metrics
+from src.libs.settings import settings
+from src.shiny_demo.dataset import HIST_COLUMNS, load_dataset, shared_root
+from src.shiny_demo.histogram import histogram_figure
+from src.shiny_demo.upload import upload_server, upload_ui
+
 # --- デモ用データ ------------------------------------------------------------
-rng = np.random.default_rng(42)
-df0 = pd.DataFrame(
-    {
-        "lifeExp": rng.normal(72, 10, 1_000).round(1),
-        "gdpPercap": rng.lognormal(10, 1, 1_000).round(0),
-        "pop": rng.integers(100_000, 100_000_000, 1_000, dtype=np.int64),
-        "continent": rng.choice(["Africa", "Americas", "Asia", "Europe", "Oceania"], 1_000),
-    }
-)
+# 表に送る行数の上限 (1,000 万行のデータでもブラウザーへ全行を送らない)
+TABLE_MAX_ROWS = 10_000
+
+# データ本体とインデックスはファイルからメモリマップで開き、同じホストのワーカー間で 1 部だけを共有する
+shared = load_dataset(shared_root(), settings.shiny_demo_rows)
+df0 = shared.frame
+# 大陸ごとの行位置。絞り込みは比較演算をせず、この対応表のビューを返すだけにする
+continent_index = shared.continent_index
+# ビン数を変えるたびに列全体を集計し直さないよう、ソート済みの値を使う
+hist_columns = shared.hist_columns
+
+
+def materialize(positions: np.ndarray | None, limit: int | None = None) -> pd.DataFrame:
+    """行位置 (None なら全行) の先頭 limit 行を DataFrame として取り出す"""
+    if positions is None:
+        return df0 if limit is None else df0.iloc[:limit]
+    return df0.take(positions[:limit])
+
 
 # --- UI ---------------------------------------------------------------------
+format_choices: dict[str, str] = {fmt: spec.label for fmt, spec in EXPORT_FORMATS.items()}
 app_ui = ui.page_navbar(
     ui.nav_panel(
         "Histogram",
@@ -31,7 +48,7 @@ app_ui = ui.page_navbar(
                 ui.input_selectize(
                     "col",
                     "Column",
-                    ["lifeExp", "gdpPercap", "pop"],
+                    HIST_COLUMNS,
                     selected="lifeExp",
                 ),
             ),
@@ -43,16 +60,17 @@ app_ui = ui.page_navbar(
         ui.input_select(
             "continent",
             "Filter by continent",
-            ["All", *sorted(df0.continent.unique())],
+            ["All", *continent_index.labels],
             selected="All",
         ),
+        ui.output_text("tbl_info"),
         ui.output_data_frame("tbl"),
     ),
     ui.nav_panel(
         "Upload / Download",
-        ui.input_file("file", "Upload a CSV"),
-        ui.output_data_frame("preview"),
-        ui.download_button("dl", "Download filtered CSV"),
+        upload_ui("upload"),
+        ui.input_select("fmt", "Download format", format_choices),
+        ui.download_button("dl", "Download filtered data"),
     ),
     ui.nav_panel("About", ui.markdown("Powered by **Shiny for Python**.")),
     title="PyShiny Demo",
@@ -64,43 +82,55 @@ def server(input_: Inputs, output: Outputs, _session: Session) -> None:
     # 1. Histogram -----------------------------------------------------------
     @output
     @render.plot
-    def hist() -> None:
-        data = df0[input_.col()]
-        plt.hist(data, bins=input_.bins(), edgecolor="white")
-        plt.title(f"{input_.col()} distribution")
+    @metrics.timed("shiny_demo.hist")
+    def hist() -> Figure:
+        col = input_.col()
+        counts, edges = hist_columns[col].histogram(input_.bins())
+        return histogram_figure(counts, edges, f"{col} distribution")
 
     # 2. Filtered table ------------------------------------------------------
     @reactive.Calc
-    def filtered() -> pd.DataFrame:
+    @metrics.timed("shiny_demo.filtered")
+    def filtered() -> np.ndarray | None:
+        """選択中の大陸の行位置 (絞り込み無しならNone)。DataFrame は表示・ダウンロードの直前まで作らない"""
         sel = input_.continent()
-        return df0 if sel == "All" else df0[df0.continent == sel]
+        return None if sel == "All" else continent_index.positions(sel)
+
+    @output
+    @render.text
+    def tbl_info() -> str:
+        positions = filtered()
+        n = len(df0) if positions is None else len(positions)
+        return f"{n:,} rows" + (f" (showing first {TABLE_MAX_ROWS:,})" if n > TABLE_MAX_ROWS else "")
 
     @output
     @render.data_frame
     def tbl() -> pd.DataFrame:
-        return filtered()
+        with metrics.timer("shiny_demo.tbl") as t:
+            frame = materialize(filtered(), TABLE_MAX_ROWS)
+            t.rows = len(frame)
+        return frame
 
     # 3. Upload preview ------------------------------------------------------
-    @reactive.Calc
-    def uploaded_df() -> pd.DataFrame | None:
-        files = input_.file()
-        if not files:
-            return None
-        return pd.read_csv(files[0]["datapath"])
-
-    @output
-    @render.data_frame
-    def preview() -> pd.DataFrame:
-        df = uploaded_df()
-        return df if df is not None else pd.DataFrame()
+    # 読み込みはスレッドで行い、他のセッションのイベントループを止めない
+    upload_server("upload", max_bytes=settings.shiny_upload_max_bytes)
 
     # 4. Download ------------------------------------------------------------
+    def export_format() -> ExportFormat:
+        return cast("ExportFormat", input_.fmt())
+
+    # 全体を文字列化せず、チャンク単位で生成しながら送る
     @output
-    @render.download(filename="filtered.csv")
-    def dl() -> Generator[str]:
-        buf = io.StringIO()
-        filtered().to_csv(buf, index=False)
-        yield buf.getvalue()
+    @render.download(
+        filename=lambda: f"filtered{EXPORT_FORMATS[export_format()].suffix}",
+        media_type=lambda: EXPORT_FORMATS[export_format()].mime,
+    )
+    def dl() -> Iterator[bytes]:
+        # 送信し終えるまでを 1 回のダウンロードとして計測する
+        with metrics.timer("shiny_demo.dl") as t:
+            frame = materialize(filtered())
+            t.rows = len(frame)
+            yield from iter_export(frame, export_format())
 
 
 shiny_app = App(app_ui, server)
@@ -110,8 +140,14 @@ def ping(_: Request) -> PlainTextResponse:
     return PlainTextResponse("ok")
 
 
+def metrics_endpoint(_: Request) -> PlainTextResponse:
+    """Prometheus 形式の計測値 (ワーカーごとの値なので、複数ワーカー時は各ポートをスクレイプする)"""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
 routes = [
     Route("/healthz", ping, methods=["GET"]),
+    Route("/metrics", metrics_endpoint, methods=["GET"]),
     Mount("/", shiny_app),
 ]
 
@@ -0,0 +1,126 @@
+"""
+CSV アップロード : 読み込みをスレッドで行ってイベントループを塞がず、先頭の行だけをプレビューに残す
+"""
+
+import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+import pandas as pd
+from shiny import Inputs, Outputs, Session, module, reactive, render, ui
+
+from src.libs.metrics import metrics
+
+# プレビューに表示する行数
+PREVIEW_ROWS = 100
+# 行数を数えるときに 1 回のスレッド呼び出しで読むバイト数 (この単位で進捗を更新する)
+COUNT_BLOCK_BYTES = 16 * 1024 * 1024
+
+
+@dataclass(frozen=True, slots=True)
+class UploadSummary:
+    """アップロードされた CSV の先頭行と全体の大きさ"""
+
+    name: str
+    preview: pd.DataFrame
+    # 改行の数から求めたデータ行数 (引用符内の改行も数えるため、その場合は実際より多くなる)
+    n_rows: int
+    n_cols: int
+
+
+def _count_newlines(f: BinaryIO) -> tuple[int, int, bool]:
+    """f の現在位置から COUNT_BLOCK_BYTES を読み、(読んだバイト数, 改行の数, 改行で終わっているか) を返す"""
+    block = f.read(COUNT_BLOCK_BYTES)
+    return len(block), block.count(b"\n"), block.endswith(b"\n")
+
+
+async def read_csv_summary(path: Path, name: str, on_progress: Callable[[int], None] = lambda _: None) -> UploadSummary:
+    """CSV の先頭 PREVIEW_ROWS 行だけをパースし、行数は生のバイト列の改行から数える
+
+    パースと行数の集計は asyncio.to_thread で行うため、大きなファイルでも同じワーカーの他のセッションを止めない。
+    全行をパースしないので、読み込み時間の大半はディスクからの読み出しになり、メモリ使用量は 1 ブロック分に収まる。
+
+    Args:
+        path: CSV ファイルのパス
+        name: 表示用のファイル名
+        on_progress: ブロックを読み終えるたびに、読み込み済みのバイト数で呼ばれる
+
+    Returns:
+        先頭の行と行数・列数
+    """
+    preview = await asyncio.to_thread(pd.read_csv, path, nrows=PREVIEW_ROWS)
+    n_lines = 0
+    ends_with_newline = True
+    with path.open("rb") as f:
+        while True:
+            size, count, newline = await asyncio.to_thread(_count_newlines, f)
+            if size == 0:
+                break
+            n_lines += count
+            ends_with_newline = newline
+            on_progress(f.tell())
+    # 改行で終わらない最終行と、ヘッダー行を数え直す
+    n_rows = max(n_lines + (not ends_with_newline) - 1, 0)
+    return UploadSummary(name=name, preview=preview, n_rows=n_rows, n_cols=preview.shape[1])
+
+
+@module.ui
+def upload_ui() -> ui.TagList:
+    """アップロード欄と読み込み結果"""
+    return ui.TagList(
+        ui.input_file("file", "Upload a CSV", accept=[".csv", "text/csv"]),
+        ui.output_text("info"),
+        ui.output_data_frame("preview"),
+    )
+
+
+@module.server
+def upload_server(input_: Inputs, _output: Outputs, session: Session, max_bytes: int) -> None:
+    """アップロードされた CSV をバックグラウンドで読み込み、進捗と先頭の行を表示する
+
+    Args:
+        input_: 入力
+        _output: 出力
+        session: セッション
+        max_bytes: 受け付けるファイルサイズの上限 (bytes)
+    """
+
+    @reactive.extended_task
+    async def parse(path: Path, name: str, size: int) -> UploadSummary:
+        with ui.Progress(min=0, max=max(size, 1), session=session) as progress, metrics.timer("shiny_demo.upload") as t:
+            progress.set(0, message=f"Reading {name}…")
+            summary = await read_csv_summary(path, name, lambda n: progress.set(n, detail=f"{n / 1024**2:,.0f} MB"))
+            t.rows = summary.n_rows
+            return summary
+
+    @reactive.effect
+    @reactive.event(input_.file)
+    def _start() -> None:
+        files = input_.file()
+        if not files:
+            return
+        file = files[0]
+        if file["size"] > max_bytes:
+            ui.notification_show(
+                f"{file['name']} is too large ({file['size'] / 1024**2:,.0f} MB > {max_bytes / 1024**2:,.0f} MB).",
+                type="error",
+            )
+            return
+        parse.invoke(Path(file["datapath"]), file["name"], file["size"])
+
+    @render.text
+    def info() -> str:
+        if parse.status() == "running":
+            return "Reading…"
+        if parse.status() == "error":
+            return "Could not read the CSV file."
+        if parse.status() != "success":
+            return ""
+        summary = parse.result()
+        return f"{summary.name}: {summary.n_rows:,} rows × {summary.n_cols} columns (showing first {PREVIEW_ROWS})"
+
+    @render.data_frame
+    def preview() -> pd.DataFrame:
+        return parse.result().preview if parse.status() == "success" else pd.DataFrame()